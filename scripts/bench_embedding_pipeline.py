@@ -0,0 +1,249 @@
+"""Benchmark the embedding build pipeline offline against the mock LLM provider.
+
+Seeds a throwaway database with synthetic problems, runs ``build_embeddings``
+through the real rewriter/generator/rate-limiter stack with ``provider =
+"mock"``, and reports throughput, per-stage busy time and peak memory.
+
+    uv run python bench_embedding_pipeline.py --problems 2000 \\
+        --rewrite-latency-ms 800 --embed-latency-ms 300 --rate-limit-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+_WORDS = (
+    "array integer string tree graph node edge query subarray prefix sum "
+    "minimum maximum distinct pair index value operation cost path modulo"
+).split()
+
+
+def _synthetic_html(rng: random.Random, size: int) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 24)))
+        block = (
+            f"<p>Given <code>n</code> and <code>a<sub>i</sub></code> "
+            f"with 1 &le; n &le; 10<sup>5</sup>, {words}.</p>"
+        )
+        parts.append(block)
+        length += len(block)
+    return "".join(parts)
+
+
+def _write_config(args: argparse.Namespace, workdir: str, db_path: str) -> str:
+    def toml_value(value):
+        return json.dumps(value) if isinstance(value, str) else repr(value)
+
+    mock = {
+        "latency_dist": args.latency_dist,
+        "latency_jitter": args.latency_jitter,
+        "rate_limit_rate": args.rate_limit_rate,
+        "unavailable_rate": args.unavailable_rate,
+        "max_batch_size": args.max_batch_size,
+        "seed": args.seed,
+    }
+    if args.retry_after is not None:
+        mock["retry_after"] = args.retry_after
+    lines = [
+        "[database]",
+        f"path = {toml_value(db_path)}",
+        "[llm]",
+        'provider = "mock"',
+        "[llm.mock]",
+        *(f"{k} = {toml_value(v)}" for k, v in mock.items()),
+        "[llm.models.embedding]",
+        'name = "mock-embedding"',
+        f"dim = {args.dim}",
+        f"batch_size = {args.batch_size}",
+        f"rpm = {args.embed_rpm}",
+        "[llm.models.embedding.mock]",
+        f"latency_ms = {args.embed_latency_ms}",
+        f"latency_per_item_ms = {args.embed_latency_per_item_ms}",
+        "[llm.models.rewrite]",
+        'name = "mock-rewrite"',
+        f"workers = {args.rewrite_workers}",
+        f"batch_size = {args.rewrite_batch_size}",
+        f"rpm = {args.rewrite_rpm}",
+        "timeout = 600",
+        "[llm.models.rewrite.mock]",
+        f"latency_ms = {args.rewrite_latency_ms}",
+        "[embedding]",
+        f"text_workers = {args.text_workers}",
+        "[logging]",
+        f"level = {toml_value(args.log_level)}",
+        f"directory = {toml_value(os.path.join(workdir, 'logs'))}",
+    ]
+    path = os.path.join(workdir, "config.toml")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def _seed_problems(args: argparse.Namespace, db_path: str) -> None:
+    from utils.database import ProblemsDatabaseManager
+
+    ProblemsDatabaseManager(db_path)
+    rng = random.Random(args.seed)
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO problems (id, source, slug, title, difficulty, link, content)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    str(i),
+                    sources[i % len(sources)],
+                    f"p{i}",
+                    f"Problem {i}",
+                    "Medium",
+                    f"https://example.com/{i}",
+                    _synthetic_html(rng, args.content_kb * 1024),
+                )
+                for i in range(args.problems)
+            ),
+        )
+    conn.close()
+
+
+def _peak_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    from embedding_cli import build_embeddings
+    from embeddings import EmbeddingGenerator, EmbeddingRewriter, EmbeddingStorage
+    from utils.config import get_config
+    from utils.database import EmbeddingDatabaseManager
+
+    config = get_config()
+    db = EmbeddingDatabaseManager(db_path=config.database_path)
+    storage = EmbeddingStorage(db)
+    rewriter = EmbeddingRewriter(config)
+    generator = EmbeddingGenerator(config)
+    sources = sorted({s.strip() for s in args.sources.split(",") if s.strip()})
+    rss_before = _peak_rss_mb(resource.RUSAGE_SELF)
+    started = time.monotonic()
+    try:
+        report = await build_embeddings(
+            db,
+            storage,
+            rewriter,
+            generator,
+            sources,
+            args.batch_size,
+            rebuild=False,
+            dry_run=False,
+        )
+    finally:
+        await rewriter.aclose()
+        await generator.aclose()
+        db.close()
+    wall = time.monotonic() - started
+    return {
+        "problems": args.problems,
+        "wall_secs": round(wall, 2),
+        "problems_per_sec": round(report.succeeded / wall, 1) if wall else None,
+        # Busy seconds summed over concurrent calls / wall time: above 1.0
+        # means the stage overlapped with itself, the largest one bounds.
+        "stage_utilization": {
+            stage: round(secs / wall, 2) for stage, secs in report.stage_secs.items()
+        },
+        "rate_limiter": {
+            "rewrite": rewriter.limiter.stats,
+            "embedding": generator.limiter.stats,
+        },
+        "provider": {
+            name: {
+                "calls": provider.calls,
+                "items": provider.items,
+                "injected_failures": provider.throttled,
+            }
+            for name, provider in (
+                ("rewrite", rewriter._provider),
+                ("embedding", generator._provider),
+            )
+        },
+        "peak_rss_mb": {
+            "seeded": round(rss_before, 1),
+            "main": round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+            # Only counts workers already reaped; the pool is shut down
+            # without waiting, so this can read 0 for short runs.
+            "text_workers": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        },
+        "summary": report.to_dict(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the embedding build pipeline with the mock provider"
+    )
+    parser.add_argument("--problems", type=int, default=1000)
+    parser.add_argument("--content-kb", type=int, default=4)
+    parser.add_argument("--sources", type=str, default="leetcode,codeforces")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--rewrite-workers", type=int, default=8)
+    parser.add_argument("--rewrite-batch-size", type=int, default=1)
+    parser.add_argument("--text-workers", type=int, default=0)
+    parser.add_argument("--rewrite-latency-ms", type=float, default=500.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=200.0)
+    parser.add_argument("--embed-latency-per-item-ms", type=float, default=2.0)
+    parser.add_argument(
+        "--latency-dist",
+        choices=("fixed", "uniform", "exponential", "lognormal"),
+        default="lognormal",
+    )
+    parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0.5,
+        help="uniform: +/- fraction of the latency; lognormal: sigma",
+    )
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429s")
+    parser.add_argument("--unavailable-rate", type=float, default=0.0, help="503s")
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--max-batch-size", type=int, default=0)
+    parser.add_argument("--rewrite-rpm", type=int, default=0)
+    parser.add_argument("--embed-rpm", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", type=str, default="WARNING")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the temporary database"
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="embed-bench-")
+    db_path = os.path.join(workdir, "data.db")
+    # Must be set before utils.config is imported anywhere.
+    os.environ["CONFIG_PATH"] = _write_config(args, workdir, db_path)
+    try:
+        _seed_problems(args, db_path)
+        result = asyncio.run(_run(args))
+    finally:
+        if not args.keep:
+            import shutil
+
+            shutil.rmtree(workdir, ignore_errors=True)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if args.keep:
+        print(f"Benchmark database kept in {workdir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
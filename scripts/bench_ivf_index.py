@@ -0,0 +1,197 @@
+"""Benchmark the IVF search backend against exact search on synthetic vectors.
+
+Seeds a throwaway database with clustered unit vectors, refreshes the numpy
+(exact) and IVF indexes from it, and reports recall@k and per-query latency
+for a sweep of ``nprobe`` values, with the vec0 KNN scan as a baseline.
+
+    uv run python bench_ivf_index.py --vectors 100000 --dim 768 \\
+        --nprobe 4,8,16,32,64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def _write_config(args: argparse.Namespace, workdir: str) -> str:
+    lines = [
+        "[database]",
+        f"path = {json.dumps(os.path.join(workdir, 'data.db'))}",
+        "[llm.models.embedding]",
+        f"dim = {args.dim}",
+        "[similar]",
+        f"index_dir = {json.dumps(os.path.join(workdir, 'vec_index'))}",
+        f"ivf_lists = {args.lists}",
+        "[logging]",
+        f"level = {json.dumps(args.log_level)}",
+        f"directory = {json.dumps(os.path.join(workdir, 'logs'))}",
+    ]
+    path = os.path.join(workdir, "config.toml")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def _clustered(np, rng, centers, count: int, spread: float):
+    """Unit vectors scattered around randomly chosen ``centers``."""
+    picks = rng.integers(0, len(centers), count)
+    noise = rng.standard_normal((count, centers.shape[1]), dtype=np.float32)
+    vectors = centers[picks] + noise * (spread / np.sqrt(centers.shape[1]))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+async def _seed_vectors(args: argparse.Namespace, db, np, centers, rng) -> None:
+    from embedding_cli import _prepare_db
+    from embeddings import EmbeddingStorage
+
+    await _prepare_db(db, args.dim, rebuild=False)
+    storage = EmbeddingStorage(db)
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+    step = 10000
+    for start in range(0, args.vectors, step):
+        count = min(step, args.vectors - start)
+        vectors = _clustered(np, rng, centers, count, args.spread)
+        for s, source in enumerate(sources):
+            items = [
+                (str(start + i), "", vectors[i].tolist())
+                for i in range(s, count, len(sources))
+            ]
+            await storage.save_embeddings_batch(source, items, "synthetic", args.dim)
+
+
+def _latency_stats(latencies) -> dict:
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return {
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(p95, 3),
+    }
+
+
+async def _run_queries(db, index, queries, top_k: int, truth=None):
+    from embeddings import EmbeddingStorage
+
+    storage = EmbeddingStorage(db, search_index=index)
+    latencies = []
+    found = []
+    for q in queries:
+        start = time.perf_counter()
+        results = await storage.search_similar(q, None, top_k, -float("inf"))
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append({(r["source"], r["problem_id"]) for r in results})
+    row = _latency_stats(latencies)
+    if truth is not None:
+        hits = sum(len(t & f) for t, f in zip(truth, found))
+        row["recall"] = round(hits / max(1, sum(len(t) for t in truth)), 4)
+    return row, found
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    import numpy as np
+
+    from embeddings import IVFIndex, MatrixIndex
+    from utils.config import get_config
+    from utils.database import EmbeddingDatabaseManager
+
+    config = get_config()
+    similar_config = config.get_similar_config()
+    db = EmbeddingDatabaseManager(db_path=config.database_path)
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((args.clusters, args.dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    try:
+        started = time.perf_counter()
+        await _seed_vectors(args, db, np, centers, rng)
+        seed_secs = time.perf_counter() - started
+        queries = [
+            q.tolist() for q in _clustered(np, rng, centers, args.queries, args.spread)
+        ]
+
+        exact = MatrixIndex(db, similar_config.index_dir, args.dim)
+        started = time.perf_counter()
+        exact.refresh()
+        export_secs = time.perf_counter() - started
+        ivf = IVFIndex(db, similar_config.index_dir, args.dim, nlist=args.lists)
+        started = time.perf_counter()
+        ivf.refresh()
+        train_secs = time.perf_counter() - started
+
+        exact_row, truth = await _run_queries(db, exact, queries, args.top_k)
+        report = {
+            "vectors": args.vectors,
+            "dim": args.dim,
+            "lists": ivf.list_count,
+            "top_k": args.top_k,
+            "queries": args.queries,
+            "seed_secs": round(seed_secs, 2),
+            "matrix_export_secs": round(export_secs, 2),
+            "ivf_train_secs": round(train_secs, 2),
+            "exact_numpy": exact_row,
+        }
+        if args.vec0_queries:
+            report["exact_vec0"], _ = await _run_queries(
+                db, None, queries[: args.vec0_queries], args.top_k
+            )
+        sweep = {}
+        for nprobe in sorted({int(p) for p in args.nprobe.split(",") if p.strip()}):
+            ivf.nprobe = nprobe
+            sweep[str(nprobe)], _ = await _run_queries(
+                db, ivf, queries, args.top_k, truth
+            )
+        report["ivf_by_nprobe"] = sweep
+    finally:
+        db.close()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark IVF recall/latency against exact search"
+    )
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument(
+        "--spread",
+        type=float,
+        default=1.0,
+        help="Noise norm around each cluster center (centers are unit vectors)",
+    )
+    parser.add_argument("--sources", type=str, default="leetcode,codeforces")
+    parser.add_argument("--lists", type=int, default=0, help="0 = 4 * sqrt(n)")
+    parser.add_argument("--nprobe", type=str, default="1,4,8,16,32,64")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--vec0-queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", type=str, default="WARNING")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the temporary database"
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ivf-bench-")
+    # Must be set before utils.config is imported anywhere.
+    os.environ["CONFIG_PATH"] = _write_config(args, workdir)
+    try:
+        result = asyncio.run(_run(args))
+    finally:
+        if not args.keep:
+            import shutil
+
+            shutil.rmtree(workdir, ignore_errors=True)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if args.keep:
+        print(f"Benchmark database kept in {workdir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
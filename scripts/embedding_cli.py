@@ -4,27 +4,47 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import copy
 import json
 import math
 import os
+import random
+import signal
 import sys
-import tempfile
 import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
 
 from embeddings import (
+    DuplicateTable,
     EmbeddingGenerator,
     EmbeddingRewriter,
+    EmbeddingServer,
     EmbeddingStorage,
+    IndexVersion,
+    IndexVersions,
+    IVFIndex,
+    MatrixIndex,
+    NeighborTable,
+    QuantizedIndex,
+    QueryEmbeddingCache,
     SimilaritySearcher,
 )
+from embeddings.progress import ProgressReporter
 from embeddings.providers import PermanentProviderError, TransientProviderError
+from embeddings.query_cache import embed_query
+from embeddings.rewriter import REWRITE_PROMPT_VERSION, content_hash
+from embeddings.storage import deserialize_vector
 from leetcode import html_to_text
-from utils.config import get_config
-from utils.database import EmbeddingDatabaseManager
+from utils.config import ConfigManager, get_config
+from utils.database import (
+    METADATA_TABLE,
+    QUANTIZATION_MODES,
+    VEC_TABLE,
+    EmbeddingDatabaseManager,
+)
 from utils.logger import get_core_logger
 
 logger = get_core_logger()
@@ -36,114 +56,324 @@ LOGS_DIR = os.path.join(os.path.dirname(__file__), "logs")
 class BuildReport:
     total_pending: int = 0
     succeeded: int = 0
+    rewrite_cached: int = 0
+    resumed: int = 0
+    new: int = 0
+    changed: int = 0
+    unchanged: int = 0
     skipped: Dict[str, int] = field(default_factory=dict)
     failed: Dict[str, int] = field(default_factory=dict)
     duration_secs: float = 0.0
+    stage_secs: Dict[str, float] = field(default_factory=dict)
+    sources: Dict[str, "BuildReport"] = field(default_factory=dict)
     _skipped_ids: Dict[str, List[str]] = field(default_factory=dict)
     _failed_ids: Dict[str, List[str]] = field(default_factory=dict)
 
-    def add_skipped(self, reason: str, problem_id: str) -> None:
+    def for_source(self, source: str) -> "BuildReport":
+        return self.sources.setdefault(source, BuildReport())
+
+    def add_skipped(
+        self, reason: str, problem_id: str, source: str | None = None
+    ) -> None:
         self.skipped[reason] = self.skipped.get(reason, 0) + 1
         self._skipped_ids.setdefault(reason, []).append(problem_id)
+        if source is not None:
+            self.for_source(source).add_skipped(reason, problem_id)
 
-    def add_failed(self, reason: str, problem_id: str) -> None:
+    def add_failed(
+        self, reason: str, problem_id: str, source: str | None = None
+    ) -> None:
         self.failed[reason] = self.failed.get(reason, 0) + 1
         self._failed_ids.setdefault(reason, []).append(problem_id)
+        if source is not None:
+            self.for_source(source).add_failed(reason, problem_id)
 
-    def add_succeeded(self) -> None:
+    def add_succeeded(self, source: str | None = None) -> None:
         self.succeeded += 1
+        if source is not None:
+            self.for_source(source).add_succeeded()
+
+    def add_rewrite_cached(self, source: str | None = None) -> None:
+        self.rewrite_cached += 1
+        if source is not None:
+            self.for_source(source).add_rewrite_cached()
+
+    def add_resumed(self, source: str | None = None) -> None:
+        self.resumed += 1
+        if source is not None:
+            self.for_source(source).add_resumed()
+
+    def add_interrupted(self, count: int, source: str | None = None) -> None:
+        """Fail ``count`` problems a stopped build never got to (no IDs known)."""
+        if count <= 0:
+            return
+        self.failed["interrupted"] = self.failed.get("interrupted", 0) + count
+        if source is not None:
+            self.for_source(source).add_interrupted(count)
+
+    def add_skipped_count(
+        self, reason: str, count: int, source: str | None = None
+    ) -> None:
+        """Skip ``count`` problems that were never selected (no IDs kept)."""
+        if count <= 0:
+            return
+        self.skipped[reason] = self.skipped.get(reason, 0) + count
+        if source is not None:
+            self.for_source(source).add_skipped_count(reason, count)
 
-    def to_dict(self) -> dict:
+    def add_stage_time(self, stage: str, secs: float) -> None:
+        self.stage_secs[stage] = self.stage_secs.get(stage, 0.0) + secs
+
+    def _counts(self) -> dict:
         return {
             "total_pending": self.total_pending,
             "succeeded": self.succeeded,
+            "rewrite_cached": self.rewrite_cached,
+            "resumed": self.resumed,
+            "new": self.new,
+            "changed": self.changed,
+            "unchanged": self.unchanged,
             "skipped": dict(self.skipped),
             "failed": dict(self.failed),
-            "duration_secs": round(self.duration_secs, 1),
         }
 
+    def to_dict(self) -> dict:
+        data = self._counts()
+        data["duration_secs"] = round(self.duration_secs, 1)
+        if self.stage_secs:
+            data["stage_secs"] = {
+                stage: round(secs, 2) for stage, secs in self.stage_secs.items()
+            }
+        if self.sources:
+            data["sources"] = {
+                name: report._counts() for name, report in self.sources.items()
+            }
+        return data
+
     @property
     def total_failed(self) -> int:
         return sum(self.failed.values())
 
 
-def _write_progress(job_id: str, data: dict) -> None:
-    """Atomic write of progress file via temp + rename."""
-    os.makedirs(LOGS_DIR, exist_ok=True)
-    path = os.path.join(LOGS_DIR, f"{job_id}.progress.json")
-    fd, tmp = tempfile.mkstemp(dir=LOGS_DIR, suffix=".tmp")
-    try:
-        with os.fdopen(fd, "w") as f:
-            json.dump(data, f)
-        os.replace(tmp, path)
-    except Exception:
-        try:
-            os.unlink(tmp)
-        except OSError:
-            pass
-        raise
+def _normalize_content(content: str) -> Tuple[str, float]:
+    """Process-pool entry point: ``html_to_text`` plus the CPU seconds it took."""
+    started = time.process_time()
+    text = html_to_text(content) if content else ""
+    return text, time.process_time() - started
+
+
+# Pending rows are problems with no metadata row for the current model/dim,
+# no vector, or a stored content hash that no longer matches. Rows whose hash
+# is NULL predate hashing and count as current (see backfill_content_hashes).
+_PENDING_FROM = """
+    FROM problems p
+    LEFT JOIN {meta_table} pe
+      ON pe.source = p.source AND pe.problem_id = p.id
+     AND pe.model = ? AND pe.dim = ?
+    LEFT JOIN temp.build_vector_ids v
+      ON v.source = p.source AND v.problem_id = p.id
+"""
+_PENDING_IS_NEW = "(pe.problem_id IS NULL OR v.problem_id IS NULL)"
+_PENDING_IS_CHANGED = (
+    "(pe.content_hash IS NOT NULL AND pe.content_hash != content_sha256(p.content))"
+)
 
 
-def _fetch_problems_with_content_sync(
-    db: EmbeddingDatabaseManager,
-    source: str,
-    filter_pattern: str | None = None,
-) -> List[Tuple[str, str]]:
-    conditions = ["source = ?", "content IS NOT NULL", "content != ''"]
+# Problems --find-duplicates mapped to a canonical copy on another source.
+_IS_DUPLICATE = """EXISTS (
+    SELECT 1 FROM problem_duplicates d
+    WHERE d.source = p.source AND d.problem_id = p.id
+)"""
+
+
+def _pending_where(
+    source: str, filter_pattern: str | None, skip_duplicates: bool = False
+) -> Tuple[str, list]:
+    conditions = ["p.source = ?", "p.content IS NOT NULL", "p.content != ''"]
     params: list = [source]
     if filter_pattern:
-        conditions.append("id LIKE '%' || ? || '%'")
+        conditions.append("p.id LIKE '%' || ? || '%'")
         params.append(filter_pattern)
-    where_clause = " AND ".join(conditions)
-    rows = db.execute(
+    if skip_duplicates:
+        conditions.append(f"NOT {_IS_DUPLICATE}")
+    return " AND ".join(conditions), params
+
+
+def _load_vector_ids_sync(
+    db: EmbeddingDatabaseManager, source: str, vec_table: str = VEC_TABLE
+) -> None:
+    """Snapshot vector keys of ``source`` into a temp table the anti-join can use.
+
+    vec0 has no index on ``problem_id``, so joining it directly would scan the
+    partition once per problem.
+    """
+    db.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS build_vector_ids (
+            source TEXT NOT NULL,
+            problem_id TEXT NOT NULL,
+            PRIMARY KEY (source, problem_id)
+        )
+        """,
+        commit=True,
+    )
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM temp.build_vector_ids WHERE source = ?", (source,))
+        conn.execute(
+            f"""
+            INSERT OR IGNORE INTO temp.build_vector_ids (source, problem_id)
+            SELECT source, problem_id FROM {vec_table} WHERE source = ?
+            """,
+            (source,),
+        )
+
+
+def _count_pending_sync(
+    db: EmbeddingDatabaseManager,
+    source: str,
+    model: str,
+    dim: int,
+    filter_pattern: str | None = None,
+    meta_table: str = METADATA_TABLE,
+    skip_duplicates: bool = False,
+) -> Tuple[int, int, int]:
+    """Return ``(total, new, changed)`` without pulling content into Python."""
+    where_clause, params = _pending_where(source, filter_pattern, skip_duplicates)
+    row = db.execute(
         f"""
-        SELECT id, content
-        FROM problems
+        SELECT COUNT(*),
+               COALESCE(SUM({_PENDING_IS_NEW}), 0),
+               COALESCE(SUM(NOT {_PENDING_IS_NEW} AND {_PENDING_IS_CHANGED}), 0)
+        {_PENDING_FROM.format(meta_table=meta_table)}
         WHERE {where_clause}
-        ORDER BY id ASC
         """,
-        tuple(params),
-        fetchall=True,
+        (model, dim, *params),
+        fetchone=True,
     )
-    return [(str(row[0]), row[1]) for row in rows] if rows else []
+    return (int(row[0]), int(row[1]), int(row[2])) if row else (0, 0, 0)
 
 
-def _count_problems_with_content_sync(
-    db: EmbeddingDatabaseManager, source: str, filter_pattern: str | None = None
+def _count_duplicates_pending_sync(
+    db: EmbeddingDatabaseManager,
+    source: str,
+    model: str,
+    dim: int,
+    filter_pattern: str | None = None,
+    meta_table: str = METADATA_TABLE,
 ) -> int:
-    conditions = ["source = ?", "content IS NOT NULL", "content != ''"]
-    params: list = [source]
-    if filter_pattern:
-        conditions.append("id LIKE '%' || ? || '%'")
-        params.append(filter_pattern)
-    where_clause = " AND ".join(conditions)
+    """Pending problems a build skips because they are known duplicates."""
+    where_clause, params = _pending_where(source, filter_pattern)
     row = db.execute(
         f"""
         SELECT COUNT(*)
-        FROM problems
-        WHERE {where_clause}
+        {_PENDING_FROM.format(meta_table=meta_table)}
+        WHERE {where_clause} AND {_IS_DUPLICATE}
+          AND ({_PENDING_IS_NEW} OR {_PENDING_IS_CHANGED})
         """,
-        tuple(params),
+        (model, dim, *params),
         fetchone=True,
     )
     return int(row[0]) if row else 0
 
 
-def _fetch_problem_ids_with_content_sync(
+def _fetch_pending_page_sync(
+    db: EmbeddingDatabaseManager,
+    source: str,
+    model: str,
+    dim: int,
+    rewrite_model: str,
+    filter_pattern: str | None,
+    after_id,
+    limit: int,
+    meta_table: str = METADATA_TABLE,
+    skip_duplicates: bool = False,
+) -> list:
+    where_clause, params = _pending_where(source, filter_pattern, skip_duplicates)
+    if after_id is not None:
+        where_clause += " AND p.id > ?"
+        params.append(after_id)
+    return (
+        db.execute(
+            f"""
+            SELECT p.id, p.content, content_sha256(p.content), {_PENDING_IS_NEW},
+                   j.rewritten_content
+            {_PENDING_FROM.format(meta_table=meta_table)}
+            LEFT JOIN embedding_journal j
+              ON j.source = p.source AND j.problem_id = p.id
+             AND j.model = ? AND j.prompt_version = ?
+             AND j.content_hash = content_sha256(p.content)
+            WHERE {where_clause}
+              AND ({_PENDING_IS_NEW} OR {_PENDING_IS_CHANGED})
+            ORDER BY p.id ASC
+            LIMIT ?
+            """,
+            (model, dim, rewrite_model, REWRITE_PROMPT_VERSION, *params, limit),
+            fetchall=True,
+        )
+        or []
+    )
+
+
+async def _iter_pending(
+    db: EmbeddingDatabaseManager,
+    source: str,
+    model: str,
+    dim: int,
+    rewrite_model: str,
+    filter_pattern: str | None = None,
+    page_size: int = 200,
+    meta_table: str = METADATA_TABLE,
+    skip_duplicates: bool = False,
+) -> AsyncIterator[Tuple[str, str, str, bool, Optional[str]]]:
+    """Yield ``(problem_id, content, content_hash, is_new, journaled)`` for pending problems.
+
+    ``journaled`` is the rewrite an interrupted build already produced for
+    the current content, or None. Pages are keyed on ``problems.id`` rather
+    than held open as one cursor, so rows saved by the pipeline meanwhile
+    cannot be revisited and the DB lock is only held per page. At most one
+    page of content is in memory.
+    """
+    after_id = None
+    while True:
+        rows = await asyncio.to_thread(
+            _fetch_pending_page_sync,
+            db,
+            source,
+            model,
+            dim,
+            rewrite_model,
+            filter_pattern,
+            after_id,
+            page_size,
+            meta_table,
+            skip_duplicates,
+        )
+        for pid, content, digest, is_new, journaled in rows:
+            yield str(pid), content, digest, bool(is_new), journaled
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1][0]
+
+
+def _count_problems_with_content_sync(
     db: EmbeddingDatabaseManager, source: str, filter_pattern: str | None = None
-) -> List[str]:
+) -> int:
     conditions = ["source = ?", "content IS NOT NULL", "content != ''"]
     params: list = [source]
     if filter_pattern:
         conditions.append("id LIKE '%' || ? || '%'")
         params.append(filter_pattern)
     where_clause = " AND ".join(conditions)
-    rows = db.execute(
-        f"SELECT id FROM problems WHERE {where_clause} ORDER BY id ASC",
+    row = db.execute(
+        f"""
+        SELECT COUNT(*)
+        FROM problems
+        WHERE {where_clause}
+        """,
         tuple(params),
-        fetchall=True,
+        fetchone=True,
     )
-    return [str(row[0]) for row in rows] if rows else []
+    return int(row[0]) if row else 0
 
 
 def _fetch_sources_with_content_sync(db: EmbeddingDatabaseManager) -> List[str]:
@@ -159,10 +389,14 @@ def _fetch_sources_with_content_sync(db: EmbeddingDatabaseManager) -> List[str]:
     return [row[0] for row in rows] if rows else []
 
 
-async def _prepare_db(db: EmbeddingDatabaseManager, dim: int, rebuild: bool) -> None:
+async def _prepare_db(
+    db: EmbeddingDatabaseManager, dim: int, rebuild: bool, vec_table: str = VEC_TABLE
+) -> None:
     if rebuild:
-        db.execute("DROP TABLE IF EXISTS vec_embeddings", commit=True)
-    db.create_vec_table(dim)
+        db.execute(f"DROP TABLE IF EXISTS {vec_table}", commit=True)
+        if vec_table == VEC_TABLE:
+            db.drop_quantized_tables()
+    db.create_vec_table(dim, vec_table)
 
 
 async def build_embeddings(
@@ -170,190 +404,472 @@ async def build_embeddings(
     storage: EmbeddingStorage,
     rewriter: EmbeddingRewriter | None,
     generator: EmbeddingGenerator | None,
-    source: str,
+    source: str | Sequence[str],
     batch_size: int,
     rebuild: bool,
     dry_run: bool,
     filter_pattern: str | None = None,
-    job_id: str | None = None,
+    progress: ProgressReporter | None = None,
+    reembed_only: bool = False,
+    report: BuildReport | None = None,
+    stop: asyncio.Event | None = None,
 ) -> BuildReport:
+    """Embed pending problems of one or more sources through one pipeline.
+
+    Pending rows of every source are interleaved into the same rewrite and
+    embed queues, so embedding batches fill across source boundaries instead
+    of draining per source. Per-source counts are kept in ``report.sources``;
+    pass ``report`` to keep partial counts if the build raises. Rows are
+    written to ``storage``'s tables, which may be a shadow index version.
+
+    Every finished rewrite is journaled until its embedding batch commits, so
+    a build that dies in between resumes those problems straight at the
+    embed stage. Setting ``stop`` ends the build early: nothing new is
+    started, in-flight rewrites and embed batches are still saved, and the
+    rest is counted as failed ``interrupted``.
+    """
+    sources = [source] if isinstance(source, str) else list(source)
     config = get_config()
     embedding_config = config.get_embedding_model_config()
-    report = BuildReport()
+    rewrite_config = config.get_rewrite_model_config()
+    report = report if report is not None else BuildReport()
     start_time = time.monotonic()
     wall_start = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
-    await _prepare_db(db, embedding_config.dim, rebuild)
+    await _prepare_db(db, embedding_config.dim, rebuild, storage.vec_table)
+
+    # Rewrites stored with existing embeddings predate the rewrite cache; in
+    # re-embed mode they are the fallback when no cache entry matches. They
+    # are read from the live index, also when building a shadow version.
+    legacy_rewrites: Dict[str, Dict[str, str]] = {}
+    if reembed_only:
+        live_storage = EmbeddingStorage(db)
+        for src in sources:
+            legacy_rewrites[src] = await live_storage.get_rewritten_contents(src)
 
     if rebuild:
-        await storage.delete_all_embeddings(source)
+        for src in sources:
+            await storage.delete_all_embeddings(src)
 
-    if not rebuild and not db.check_dimension_consistency(embedding_config.dim):
+    if not rebuild and not db.check_dimension_consistency(
+        embedding_config.dim, storage.vec_table
+    ):
         raise ValueError(
             "Embedding dimension mismatch. Please run with --rebuild to reset the index."
         )
 
-    total_problems = await asyncio.to_thread(
-        _count_problems_with_content_sync, db, source, filter_pattern
-    )
-    existing_metadata = await storage.get_existing_ids(
-        source, embedding_config.name, embedding_config.dim
-    )
-    existing_vectors = await storage.get_existing_vector_ids(source)
-    existing_ids = existing_metadata.intersection(existing_vectors)
-
-    if filter_pattern:
-        filtered_ids = set(
-            await asyncio.to_thread(
-                _fetch_problem_ids_with_content_sync, db, source, filter_pattern
+    model, dim = embedding_config.name, embedding_config.dim
+    skip_duplicates = config.get_duplicates_config().skip_in_builds
+    select_started = time.monotonic()
+    active_sources: List[str] = []
+    for src in sources:
+        src_report = report.for_source(src)
+        try:
+            await asyncio.to_thread(_load_vector_ids_sync, db, src, storage.vec_table)
+            if not dry_run:
+                backfilled = await storage.backfill_content_hashes(src, model, dim)
+                if backfilled:
+                    logger.info(
+                        "Source '%s': recorded content hashes for %s existing rows",
+                        src,
+                        backfilled,
+                    )
+            total, src_report.new, src_report.changed = await asyncio.to_thread(
+                _count_pending_sync,
+                db,
+                src,
+                model,
+                dim,
+                filter_pattern,
+                storage.meta_table,
+                skip_duplicates,
+            )
+            if skip_duplicates:
+                duplicates = await asyncio.to_thread(
+                    _count_duplicates_pending_sync,
+                    db,
+                    src,
+                    model,
+                    dim,
+                    filter_pattern,
+                    storage.meta_table,
+                )
+                report.add_skipped_count("duplicate", duplicates, src)
+                if duplicates:
+                    logger.info(
+                        "Source '%s': skipping %s known duplicates",
+                        src,
+                        duplicates,
+                    )
+        except Exception as exc:
+            logger.error(
+                "Failed to select pending problems for source '%s': %s",
+                src,
+                exc,
+                exc_info=True,
             )
+            report.add_failed(f"source_fatal:{src}", src, src)
+            continue
+        src_report.total_pending = src_report.new + src_report.changed
+        src_report.unchanged = total - src_report.total_pending
+        report.new += src_report.new
+        report.changed += src_report.changed
+        report.unchanged += src_report.unchanged
+        if src_report.total_pending:
+            active_sources.append(src)
+        logger.info(
+            "Source '%s': %s problems with content, pending %s "
+            "(new %s, changed %s, unchanged %s)",
+            src,
+            total,
+            src_report.total_pending,
+            src_report.new,
+            src_report.changed,
+            src_report.unchanged,
+        )
+    pending_count = report.new + report.changed
+    report.add_stage_time("select", time.monotonic() - select_started)
+    if len(sources) > 1:
+        logger.info(
+            "Pending embeddings: %s (new %s, changed %s, unchanged %s)",
+            pending_count,
+            report.new,
+            report.changed,
+            report.unchanged,
         )
-        pending_count = len(filtered_ids - existing_ids)
-    else:
-        pending_count = max(total_problems - len(existing_ids), 0)
-
-    logger.info("Total problems with content: %s", total_problems)
-    logger.info("Existing embeddings: %s", len(existing_ids))
-    logger.info("Pending embeddings: %s", pending_count)
 
     if dry_run:
         batch_calls = math.ceil(pending_count / batch_size) if batch_size else 0
         logger.info("Estimated embedding API calls: %s", batch_calls)
-        logger.info("Estimated rewrite API calls: %s", pending_count)
+        logger.info(
+            "Estimated rewrite API calls: %s (upper bound, cached rewrites are reused)",
+            0
+            if reembed_only
+            else math.ceil(pending_count / max(1, rewrite_config.batch_size)),
+        )
         report.total_pending = pending_count
         report.duration_secs = time.monotonic() - start_time
         return report
 
-    if rewriter is None or generator is None:
+    if generator is None or (rewriter is None and not reembed_only):
         raise ValueError("Embedding generator not initialized")
 
-    problems = await asyncio.to_thread(
-        _fetch_problems_with_content_sync, db, source, filter_pattern
-    )
-    pending = [(pid, content) for pid, content in problems if pid not in existing_ids]
-
-    if not pending:
+    if not pending_count:
         logger.info("No pending embeddings to process.")
         report.duration_secs = time.monotonic() - start_time
         return report
 
-    total_pending = len(pending)
+    total_pending = pending_count
     report.total_pending = total_pending
     effective_batch_size = max(1, batch_size or 1)
-    rewrite_workers = max(
-        1, min(getattr(rewriter.model_config, "workers", 1), total_pending)
-    )
+    rewrite_workers = max(1, min(rewrite_config.workers, total_pending))
+    rewrite_batch_size = max(1, rewrite_config.batch_size)
+    queue_size = rewrite_workers * rewrite_batch_size * 2
+    text_workers = config.get_embedding_build_config().text_workers
+    text_workers = max(1, min(text_workers or os.cpu_count() or 1, total_pending))
     logger.info(
-        "Starting rewrite pipeline: %s problems, workers=%s, batch_size=%s",
+        "Starting rewrite pipeline: %s problems from %s source(s), "
+        "text_workers=%s, workers=%s, batch_size=%s, rewrite_batch_size=%s%s",
         total_pending,
+        len(active_sources),
+        text_workers,
         rewrite_workers,
         effective_batch_size,
+        rewrite_batch_size,
+        " (re-embed only)" if reembed_only else "",
     )
-    executor = ThreadPoolExecutor(max_workers=rewrite_workers)
-
+    # html_to_text is a full BeautifulSoup parse plus regex passes; running
+    # it in worker processes keeps the event loop free for the I/O stages.
+    pool = ProcessPoolExecutor(max_workers=text_workers)
     try:
-        rewrite_queue: asyncio.Queue[Tuple[str, str] | None] = asyncio.Queue()
-        embed_queue: asyncio.Queue[Tuple[str, str] | None] = asyncio.Queue()
-        for item in pending:
-            rewrite_queue.put_nowait(item)
-        for _ in range(rewrite_workers):
-            rewrite_queue.put_nowait(None)
+        # All queues are bounded so the producer only runs a few pages ahead
+        # of the rewrite workers, and rewrites ahead of the embedder. Items
+        # are (source, problem_id, HTML / text / rewrite, content hash).
+        text_queue: asyncio.Queue[Tuple[str, str, str, str] | None] = asyncio.Queue(
+            maxsize=queue_size
+        )
+        rewrite_queue: asyncio.Queue[Tuple[str, str, str, str] | None] = asyncio.Queue(
+            maxsize=queue_size
+        )
+        embed_queue: asyncio.Queue[Tuple[str, str, str, str] | None] = asyncio.Queue(
+            maxsize=max(queue_size, effective_batch_size * 2)
+        )
 
         progress_lock = asyncio.Lock()
         rewrite_done = 0
         rewrite_skipped = 0
         embed_done = 0
 
+        def stopping() -> bool:
+            return stop is not None and stop.is_set()
+
+        async def interrupt(queue: asyncio.Queue, source: str, problem_id: str) -> None:
+            nonlocal rewrite_done, rewrite_skipped
+            async with progress_lock:
+                rewrite_skipped += 1
+                rewrite_done += 1
+                report.add_failed("interrupted", problem_id, source)
+            queue.task_done()
+
         def _update_progress(phase: str) -> None:
-            if not job_id:
+            # In-memory only; the reporter publishes on its own interval.
+            if progress is None:
                 return
-            try:
-                _write_progress(
-                    job_id,
-                    {
-                        "phase": phase,
-                        "rewrite_progress": {
-                            "done": rewrite_done,
-                            "total": total_pending,
-                            "skipped": rewrite_skipped,
-                        },
-                        "embed_progress": {
-                            "done": embed_done,
-                            "total": total_pending - rewrite_skipped,
-                        },
-                        "started_at": wall_start,
-                    },
-                )
-            except Exception:
-                pass
+            progress.update(
+                phase,
+                rewrite_progress={
+                    "done": rewrite_done,
+                    "total": total_pending,
+                    "skipped": rewrite_skipped,
+                },
+                embed_progress={
+                    "done": embed_done,
+                    "total": total_pending - rewrite_skipped,
+                },
+                started_at=wall_start,
+            )
 
-        async def rewrite_worker(worker_id: int) -> None:
+        async def skip_rewrite(reason: str, source: str, problem_id: str) -> None:
             nonlocal rewrite_done, rewrite_skipped
+            async with progress_lock:
+                rewrite_skipped += 1
+                rewrite_done += 1
+                report.add_skipped(reason, problem_id, source)
+                _update_progress("rewriting")
+            rewrite_queue.task_done()
+
+        async def produce() -> None:
+            nonlocal total_pending
+            # Round-robin over the per-source streams so every source keeps
+            # work in flight until its pending rows run out.
+            nonlocal rewrite_done
+            streams = {
+                src: aiter(
+                    _iter_pending(
+                        db,
+                        src,
+                        model,
+                        dim,
+                        rewrite_config.name,
+                        filter_pattern,
+                        meta_table=storage.meta_table,
+                        skip_duplicates=skip_duplicates,
+                    )
+                )
+                for src in active_sources
+            }
+            streamed = {src: [0, 0] for src in active_sources}  # [total, new]
+            while streams and not stopping():
+                for src in list(streams):
+                    try:
+                        problem_id, content, digest, is_new, journaled = await anext(
+                            streams[src]
+                        )
+                    except StopAsyncIteration:
+                        del streams[src]
+                        continue
+                    streamed[src][0] += 1
+                    streamed[src][1] += is_new
+                    if journaled:
+                        # Rewritten before an interruption; only the embed
+                        # stage is left.
+                        await embed_queue.put((src, problem_id, journaled, digest))
+                        async with progress_lock:
+                            rewrite_done += 1
+                            report.add_resumed(src)
+                            _update_progress("rewriting")
+                    else:
+                        await text_queue.put((src, problem_id, content, digest))
+            for _ in range(text_workers):
+                await text_queue.put(None)
+            async with progress_lock:
+                if stopping():
+                    for src, (count, _) in streamed.items():
+                        report.add_interrupted(
+                            report.sources[src].total_pending - count, src
+                        )
+                    return
+                for src, (count, new) in streamed.items():
+                    src_report = report.sources[src]
+                    if count == src_report.total_pending:
+                        continue
+                    # Problems changed between counting and streaming.
+                    delta_new = new - src_report.new
+                    delta_changed = count - new - src_report.changed
+                    for target in (src_report, report):
+                        target.new += delta_new
+                        target.changed += delta_changed
+                        target.total_pending += delta_new + delta_changed
+                        target.unchanged -= delta_new + delta_changed
+                total_pending = report.total_pending
+
+        async def normalize_worker() -> None:
+            loop = asyncio.get_running_loop()
             while True:
-                item = await rewrite_queue.get()
+                item = await text_queue.get()
                 if item is None:
-                    rewrite_queue.task_done()
+                    text_queue.task_done()
                     break
-                problem_id, content = item
-                text = html_to_text(content) if content else ""
-                if not text.strip():
-                    logger.warning("Problem %s skipped: empty_content", problem_id)
-                    async with progress_lock:
-                        rewrite_skipped += 1
-                        rewrite_done += 1
-                        report.add_skipped("empty_content", problem_id)
-                        _update_progress("rewriting")
-                    rewrite_queue.task_done()
-                    continue
-                try:
-                    rewritten = await rewriter.rewrite_with_executor(text, executor)
-                except asyncio.TimeoutError:
-                    logger.error(
-                        "Problem %s: rewrite_timeout after %ss",
-                        problem_id,
-                        rewriter.model_config.timeout,
-                    )
-                    async with progress_lock:
-                        rewrite_skipped += 1
-                        rewrite_done += 1
-                        report.add_skipped("rewrite_timeout", problem_id)
-                        _update_progress("rewriting")
-                    rewrite_queue.task_done()
-                    continue
-                except Exception as exc:
-                    logger.error("Problem %s: rewrite_error: %s", problem_id, exc)
-                    async with progress_lock:
-                        rewrite_skipped += 1
-                        rewrite_done += 1
-                        report.add_skipped("rewrite_error", problem_id)
-                        _update_progress("rewriting")
-                    rewrite_queue.task_done()
+                src, problem_id, content, digest = item
+                if stopping():
+                    await interrupt(text_queue, src, problem_id)
                     continue
-                if not rewritten or not rewritten.strip():
-                    logger.warning("Problem %s: rewrite_empty", problem_id)
-                    async with progress_lock:
-                        rewrite_skipped += 1
-                        rewrite_done += 1
-                        report.add_skipped("rewrite_empty", problem_id)
-                        _update_progress("rewriting")
-                    rewrite_queue.task_done()
-                    continue
-                await embed_queue.put((problem_id, rewritten))
+                text, cpu_secs = await loop.run_in_executor(
+                    pool, _normalize_content, content
+                )
+                report.add_stage_time("normalize_cpu", cpu_secs)
+                await rewrite_queue.put((src, problem_id, text, digest))
+                text_queue.task_done()
+
+        async def normalize_stage() -> None:
+            await asyncio.gather(*(normalize_worker() for _ in range(text_workers)))
+            for _ in range(rewrite_workers):
+                await rewrite_queue.put(None)
+
+        async def prepare_rewrite(
+            item: Tuple[str, str, str, str],
+        ) -> Optional[Tuple[str, str, str, str, str]]:
+            """Resolve empty/cached items; return ``(source, id, text, key, hash)`` if an LLM call is needed."""
+            nonlocal rewrite_done
+            src, problem_id, text, digest = item
+            if stopping():
+                await interrupt(rewrite_queue, src, problem_id)
+                return None
+            if not text.strip():
+                logger.warning("Problem %s:%s skipped: empty_content", src, problem_id)
+                await skip_rewrite("empty_content", src, problem_id)
+                return None
+            text_key = content_hash(text)
+            cached = await storage.get_cached_rewrite(
+                text_key, rewrite_config.name, REWRITE_PROMPT_VERSION
+            )
+            if cached is None and reembed_only:
+                cached = legacy_rewrites[src].get(problem_id)
+            if cached:
+                await embed_queue.put((src, problem_id, cached, digest))
                 async with progress_lock:
                     rewrite_done += 1
-                    if rewrite_done % 50 == 0 or rewrite_done == total_pending:
-                        logger.info(
-                            "Rewrite progress %s/%s (skipped %s)",
-                            rewrite_done,
-                            total_pending,
-                            rewrite_skipped,
-                        )
+                    report.add_rewrite_cached(src)
                     _update_progress("rewriting")
                 rewrite_queue.task_done()
+                return None
+            if reembed_only:
+                logger.warning(
+                    "Problem %s:%s skipped: rewrite_not_cached", src, problem_id
+                )
+                await skip_rewrite("rewrite_not_cached", src, problem_id)
+                return None
+            return src, problem_id, text, text_key, digest
+
+        async def finish_rewrite(
+            src: str,
+            problem_id: str,
+            text_key: str,
+            digest: str,
+            rewritten: str | BaseException,
+        ) -> None:
+            nonlocal rewrite_done
+            if isinstance(rewritten, asyncio.TimeoutError):
+                logger.error(
+                    "Problem %s:%s: rewrite_timeout after %ss",
+                    src,
+                    problem_id,
+                    rewrite_config.timeout,
+                )
+                await skip_rewrite("rewrite_timeout", src, problem_id)
+                return
+            if isinstance(rewritten, Exception):
+                logger.error(
+                    "Problem %s:%s: rewrite_error: %s", src, problem_id, rewritten
+                )
+                await skip_rewrite("rewrite_error", src, problem_id)
+                return
+            if isinstance(rewritten, BaseException):
+                raise rewritten
+            if not rewritten or not rewritten.strip():
+                logger.warning("Problem %s:%s: rewrite_empty", src, problem_id)
+                await skip_rewrite("rewrite_empty", src, problem_id)
+                return
+            try:
+                await storage.record_rewrite(
+                    src,
+                    problem_id,
+                    digest,
+                    text_key,
+                    rewrite_config.name,
+                    REWRITE_PROMPT_VERSION,
+                    rewritten,
+                )
+            except Exception as exc:
+                logger.warning(
+                    "Problem %s:%s: rewrite journal write failed: %s",
+                    src,
+                    problem_id,
+                    exc,
+                )
+            await embed_queue.put((src, problem_id, rewritten, digest))
+            async with progress_lock:
+                rewrite_done += 1
+                if rewrite_done % 50 == 0 or rewrite_done == total_pending:
+                    logger.info(
+                        "Rewrite progress %s/%s (skipped %s)",
+                        rewrite_done,
+                        total_pending,
+                        rewrite_skipped,
+                    )
+                _update_progress("rewriting")
+            rewrite_queue.task_done()
+
+        async def rewrite_worker(worker_id: int) -> None:
+            done = False  # saw the sentinel while filling a batch
+            while not done:
+                item = await rewrite_queue.get()
+                if item is None:
+                    rewrite_queue.task_done()
+                    break
+                # Gather up to rewrite_batch_size uncached items without
+                # waiting; cached and empty ones are resolved on the way.
+                batch: List[Tuple[str, str, str, str, str]] = []
+                while True:
+                    prepared = await prepare_rewrite(item)
+                    if prepared is not None:
+                        batch.append(prepared)
+                    if len(batch) >= rewrite_batch_size:
+                        break
+                    try:
+                        item = rewrite_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if item is None:
+                        done = True
+                        break
+                started = time.monotonic()
+                if len(batch) == 1:
+                    src, problem_id, text, text_key, digest = batch[0]
+                    try:
+                        rewritten: str | BaseException = await rewriter.rewrite(text)
+                    except Exception as exc:
+                        rewritten = exc
+                    report.add_stage_time("rewrite", time.monotonic() - started)
+                    await finish_rewrite(src, problem_id, text_key, digest, rewritten)
+                elif batch:
+                    try:
+                        results = await rewriter.rewrite_batch([b[2] for b in batch])
+                    except Exception as exc:
+                        results = [exc] * len(batch)
+                    report.add_stage_time("rewrite", time.monotonic() - started)
+                    for (src, problem_id, _, text_key, digest), rewritten in zip(
+                        batch, results
+                    ):
+                        await finish_rewrite(
+                            src, problem_id, text_key, digest, rewritten
+                        )
+                if done:
+                    rewrite_queue.task_done()
 
         async def embed_worker() -> None:
             nonlocal embed_done
-            buffer: List[Tuple[str, str]] = []
+            buffer: List[Tuple[str, str, str, str]] = []
             while True:
                 item = await embed_queue.get()
                 if item is None:
@@ -366,7 +882,6 @@ async def build_embeddings(
                         storage,
                         generator,
                         embedding_config,
-                        source,
                         report,
                         progress_lock,
                     )
@@ -381,7 +896,6 @@ async def build_embeddings(
                     storage,
                     generator,
                     embedding_config,
-                    source,
                     report,
                     progress_lock,
                 )
@@ -390,78 +904,113 @@ async def build_embeddings(
                     _update_progress("embedding")
             logger.info("Embedding pipeline complete (%s succeeded)", report.succeeded)
 
+        producer_task = asyncio.create_task(produce())
+        normalize_task = asyncio.create_task(normalize_stage())
         rewrite_tasks = [
             asyncio.create_task(rewrite_worker(i)) for i in range(rewrite_workers)
         ]
         embed_task = asyncio.create_task(embed_worker())
+        tasks = [producer_task, normalize_task, *rewrite_tasks, embed_task]
+
+        async def drain() -> None:
+            await producer_task
+            await text_queue.join()
+            await normalize_task
+            await rewrite_queue.join()
+            await embed_queue.put(None)
+            await embed_queue.join()
 
-        await rewrite_queue.join()
-        await embed_queue.put(None)
-        await embed_queue.join()
-        await asyncio.gather(*rewrite_tasks)
-        await embed_task
+        try:
+            # gather surfaces the first task failure instead of leaving the
+            # joins waiting on a dead worker.
+            await asyncio.gather(drain(), *tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        logger.info(
+            "Rate limiter stats: rewrite=%s embedding=%s",
+            rewriter.limiter.stats if rewriter is not None else None,
+            generator.limiter.stats,
+        )
     finally:
-        executor.shutdown(wait=True)
+        pool.shutdown(wait=False, cancel_futures=True)
         report.duration_secs = time.monotonic() - start_time
+        if report.stage_secs:
+            # Busy time summed over concurrent calls; compare with
+            # duration_secs to see which stage bounds the build.
+            logger.info(
+                "Stage seconds: %s (wall %.1fs)",
+                {k: round(v, 2) for k, v in report.stage_secs.items()},
+                report.duration_secs,
+            )
 
     return report
 
 
 async def _flush_with_bisect(
-    batch: List[Tuple[str, str]],
+    batch: List[Tuple[str, str, str, str]],
     storage: EmbeddingStorage,
     generator: EmbeddingGenerator,
     embedding_config,
-    source: str,
     report: BuildReport,
     progress_lock: asyncio.Lock,
-    max_retries: int = 3,
 ) -> None:
-    """Retry-then-bisect flush strategy."""
-    rewritten_texts = [item[1] for item in batch]
-    problem_ids = [item[0] for item in batch]
+    """Flush a batch, bisecting to isolate items that fail permanently.
+
+    A batch may mix sources; it is embedded with one call and saved per source.
+    Transient provider errors are already retried by the generator's rate
+    limiter; once its budget is spent the whole batch is failed rather than
+    bisected, which would only multiply calls against an exhausted quota.
+    """
+    rewritten_texts = [item[2] for item in batch]
 
-    for attempt in range(max_retries):
+    try:
+        started = time.monotonic()
         try:
             embeddings = await generator.embed_batch(rewritten_texts)
-            if len(embeddings) != len(problem_ids):
-                raise PermanentProviderError(
-                    f"Batch size mismatch: expected {len(problem_ids)} got {len(embeddings)}"
-                )
-            for pid, rewritten, emb in zip(problem_ids, rewritten_texts, embeddings):
-                await storage.save_embedding(
-                    source,
-                    pid,
-                    rewritten,
-                    embedding_config.name,
-                    embedding_config.dim,
-                    emb,
-                )
-                async with progress_lock:
-                    report.add_succeeded()
-            return
-        except TransientProviderError as exc:
-            if attempt < max_retries - 1:
-                wait = min(2 ** (attempt + 1), 60)
-                logger.warning("Transient error, retrying in %ss: %s", wait, exc)
-                await asyncio.sleep(wait)
-                continue
-            break
-        except PermanentProviderError:
-            break
-        except Exception as exc:
-            if attempt < max_retries - 1:
-                wait = min(2 ** (attempt + 1), 60)
-                logger.warning("Embed error, retrying in %ss: %s", wait, exc)
-                await asyncio.sleep(wait)
-                continue
-            break
+        finally:
+            report.add_stage_time("embed", time.monotonic() - started)
+        if len(embeddings) != len(batch):
+            raise PermanentProviderError(
+                f"Batch size mismatch: expected {len(batch)} got {len(embeddings)}"
+            )
+        by_source: Dict[str, list] = {}
+        hashes: Dict[str, Dict[str, str]] = {}
+        for (src, pid, rewritten, digest), embedding in zip(batch, embeddings):
+            by_source.setdefault(src, []).append((pid, rewritten, embedding))
+            hashes.setdefault(src, {})[pid] = digest
+        started = time.monotonic()
+        for src, items in by_source.items():
+            await storage.save_embeddings_batch(
+                src,
+                items,
+                embedding_config.name,
+                embedding_config.dim,
+                hashes[src],
+            )
+        report.add_stage_time("save", time.monotonic() - started)
+        async with progress_lock:
+            for src, _, _, _ in batch:
+                report.add_succeeded(src)
+        return
+    except TransientProviderError as exc:
+        logger.error(
+            "Batch of %s: embed_transient failure after retries: %s",
+            len(batch),
+            exc,
+        )
+        async with progress_lock:
+            for src, pid, _, _ in batch:
+                report.add_failed("embed_transient", pid, src)
+        return
+    except Exception as exc:
+        logger.warning("Embed batch of %s failed, bisecting: %s", len(batch), exc)
 
     if len(batch) == 1:
-        pid = problem_ids[0]
-        logger.error("Problem %s: embed_permanent failure", pid)
+        src, pid = batch[0][0], batch[0][1]
+        logger.error("Problem %s:%s: embed_permanent failure", src, pid)
         async with progress_lock:
-            report.add_failed("embed_permanent", pid)
+            report.add_failed("embed_permanent", pid, src)
         return
 
     mid = len(batch) // 2
@@ -470,20 +1019,16 @@ async def _flush_with_bisect(
         storage,
         generator,
         embedding_config,
-        source,
         report,
         progress_lock,
-        max_retries,
     )
     await _flush_with_bisect(
         batch[mid:],
         storage,
         generator,
         embedding_config,
-        source,
         report,
         progress_lock,
-        max_retries,
     )
 
 
@@ -516,9 +1061,15 @@ async def query_similar(
         print("Embedding index is empty. Run embedding_cli.py --build first.")
         return
 
-    rewritten = await rewriter.rewrite(query)
-    embedding = await generator.embed(rewritten)
-    searcher = SimilaritySearcher(db, storage)
+    cache = QueryEmbeddingCache.from_config(config, db)
+    rewritten, embedding = await embed_query(rewriter, generator, query, cache)
+    if cache is not None:
+        logger.debug("Query cache stats: %s", cache.stats)
+    searcher = SimilaritySearcher(
+        db,
+        storage,
+        collapse_duplicates=config.get_duplicates_config().collapse_in_search,
+    )
     results = await searcher.search(embedding, source, top_k, min_similarity)
 
     if not results:
@@ -561,6 +1112,294 @@ async def show_stats(
     print(f"  Pending: {pending}")
 
 
+def show_index_versions(versions: IndexVersions) -> None:
+    rows = versions.list_versions()
+    if not rows:
+        print("No embedding index versions.")
+        return
+    print("Embedding index versions:")
+    for v in rows:
+        print(
+            f"  v{v.version} [{v.status}] model={v.model} dim={v.dim} "
+            f"rows={versions.count_rows(v)} created={v.created_at} "
+            f"activated={v.activated_at or '-'}"
+        )
+
+
+async def refresh_neighbors(neighbors: NeighborTable) -> None:
+    started = time.monotonic()
+    recomputed = await asyncio.to_thread(neighbors.refresh)
+    print(
+        f"Neighbor lists: {recomputed} recomputed "
+        f"in {time.monotonic() - started:.1f}s (k={neighbors.k})"
+    )
+
+
+async def refresh_duplicates(duplicates: DuplicateTable) -> None:
+    started = time.monotonic()
+    compared = await asyncio.to_thread(duplicates.refresh)
+    print(
+        f"Duplicate problems: {compared} compared "
+        f"in {time.monotonic() - started:.1f}s (threshold={duplicates.threshold})"
+    )
+
+
+def _iter_content_pages_sync(
+    db: EmbeddingDatabaseManager, page_size: int = 500
+) -> Iterator[List[str]]:
+    after: Tuple[str, str] = ("", "")
+    while True:
+        rows = db.execute(
+            """
+            SELECT source, id, content
+            FROM problems
+            WHERE content IS NOT NULL AND content != ''
+              AND (source, id) > (?, ?)
+            ORDER BY source, id
+            LIMIT ?
+            """,
+            (*after, page_size),
+            fetchall=True,
+        )
+        if not rows:
+            return
+        yield [content for _, _, content in rows]
+        after = (rows[-1][0], rows[-1][1])
+
+
+def fit_local_idf(db: EmbeddingDatabaseManager, config: ConfigManager) -> None:
+    """Fit the local provider's IDF weights on every problem statement."""
+    from embeddings.providers.local import HashedNgramEncoder
+
+    local = config.get_local_provider_config()
+    encoder = HashedNgramEncoder(
+        config.get_embedding_model_config().dim,
+        ngram_min=local.ngram_min,
+        ngram_max=local.ngram_max,
+        buckets=local.buckets,
+        density=local.density,
+        seed=local.seed,
+    )
+    text_workers = config.get_embedding_build_config().text_workers
+    with ProcessPoolExecutor(max_workers=text_workers or None) as pool:
+        texts = (
+            text
+            for page in _iter_content_pages_sync(db)
+            for text, _ in pool.map(_normalize_content, page, chunksize=32)
+        )
+        docs = encoder.fit_idf(texts)
+    encoder.save_idf(local.idf_path)
+    print(f"Fitted local IDF weights on {docs} problems: {local.idf_path}")
+    print("Rebuild local embedding indexes so stored vectors use the new weights.")
+
+
+def _fresh_build_report(
+    db: EmbeddingDatabaseManager, sources: Sequence[str], filter_pattern: str | None
+) -> BuildReport:
+    """Dry-run counts for a build into a new, empty index version."""
+    report = BuildReport()
+    for src in sources:
+        count = _count_problems_with_content_sync(db, src, filter_pattern)
+        src_report = report.for_source(src)
+        src_report.total_pending = src_report.new = count
+        report.total_pending += count
+        report.new += count
+    logger.info(
+        "Dry run: a new index version would embed %s problems", report.total_pending
+    )
+    return report
+
+
+def _version_pending_sync(db: EmbeddingDatabaseManager, version: IndexVersion) -> int:
+    """Problems of any source still missing or stale in ``version``."""
+    skip_duplicates = get_config().get_duplicates_config().skip_in_builds
+    pending = 0
+    for src in _fetch_sources_with_content_sync(db):
+        _load_vector_ids_sync(db, src, version.vec_table)
+        _, new, changed = _count_pending_sync(
+            db,
+            src,
+            version.model,
+            version.dim,
+            None,
+            version.meta_table,
+            skip_duplicates,
+        )
+        pending += new + changed
+    return pending
+
+
+async def _finish_shadow_build(
+    db: EmbeddingDatabaseManager, versions: IndexVersions, version: IndexVersion
+) -> None:
+    """Swap a shadow version in once it covers every source."""
+    pending = await asyncio.to_thread(_version_pending_sync, db, version)
+    if pending:
+        logger.info(
+            "Index v%s still has %s pending problems; it stays in shadow until "
+            "a build completes it (run --build --source all)",
+            version.version,
+            pending,
+        )
+        return
+    await asyncio.to_thread(versions.activate, version.version)
+    print(f"Activated embedding index v{version.version}.")
+
+
+def _sample_vectors_sync(
+    db: EmbeddingDatabaseManager, source: Optional[str], samples: int
+) -> List[Tuple[Tuple[str, str], List[float]]]:
+    if source:
+        rows = db.execute(
+            "SELECT rowid FROM vec_embeddings WHERE source = ?",
+            (source,),
+            fetchall=True,
+        )
+    else:
+        rows = db.execute("SELECT rowid FROM vec_embeddings", fetchall=True)
+    rowids = [r[0] for r in rows or []]
+    rowids = random.Random(0).sample(rowids, min(samples, len(rowids)))
+    if not rowids:
+        return []
+    placeholders = ", ".join("?" for _ in rowids)
+    rows = db.execute(
+        f"""
+        SELECT source, problem_id, embedding FROM vec_embeddings
+        WHERE rowid IN ({placeholders})
+        """,
+        tuple(rowids),
+        fetchall=True,
+    )
+    return [((src, pid), list(deserialize_vector(emb))) for src, pid, emb in rows]
+
+
+def _scan_bytes_sync(db: EmbeddingDatabaseManager, table: str) -> Optional[int]:
+    """Size of the vector chunks a KNN pass over ``table`` reads, if dbstat exists."""
+    try:
+        row = db.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name GLOB ?",
+            (f"{table}_vector_chunks*",),
+            fetchone=True,
+        )
+    except Exception:
+        return None
+    return int(row[0]) if row and row[0] is not None else None
+
+
+async def index_report(
+    db: EmbeddingDatabaseManager,
+    source: Optional[str],
+    top_k: int,
+    samples: int,
+) -> None:
+    """Print recall@k and per-query latency for each available search index.
+
+    Stored vectors are used as queries; the query's own row is excluded and
+    exact vec0 KNN over float32 vectors is the ground truth.
+    """
+    config = get_config()
+    embedding_config = config.get_embedding_model_config()
+    similar_config = config.get_similar_config()
+
+    await _prepare_db(db, embedding_config.dim, rebuild=False)
+    queries = await asyncio.to_thread(_sample_vectors_sync, db, source, samples)
+    if not queries:
+        print("Embedding index is empty. Run embedding_cli.py --build first.")
+        return
+
+    candidates: List[Tuple[str, Optional[object], Optional[int]]] = [
+        ("float32", None, _scan_bytes_sync(db, "vec_embeddings"))
+    ]
+    for mode in QUANTIZATION_MODES:
+        try:
+            index = QuantizedIndex(
+                db,
+                embedding_config.dim,
+                mode,
+                rerank_factor=similar_config.rerank_factor,
+            )
+        except ValueError as exc:
+            logger.info("Skipping %s index: %s", mode, exc)
+            continue
+        await asyncio.to_thread(index.refresh)
+        candidates.append(
+            (
+                f"{mode} x{index.rerank_factor}",
+                index,
+                _scan_bytes_sync(db, index.table),
+            )
+        )
+    try:
+        matrix_index = MatrixIndex(db, similar_config.index_dir, embedding_config.dim)
+    except RuntimeError as exc:
+        logger.info("Skipping numpy backend: %s", exc)
+    else:
+        await asyncio.to_thread(matrix_index.refresh)
+        matrix_bytes = os.path.getsize(matrix_index.matrix_path)
+        candidates.append(("numpy", matrix_index, matrix_bytes))
+        ivf_index = IVFIndex(
+            db,
+            similar_config.index_dir,
+            embedding_config.dim,
+            nlist=similar_config.ivf_lists,
+        )
+        await asyncio.to_thread(ivf_index.refresh)
+        nlist = ivf_index.list_count
+        for nprobe in sorted({1, 4, 16, 64, similar_config.ivf_nprobe}):
+            if nprobe > nlist:
+                continue
+            probe = copy.copy(ivf_index)
+            probe.nprobe = nprobe
+            candidates.append(
+                (
+                    f"ivf {nprobe}/{nlist}",
+                    probe,
+                    # Expected share of the matrix a query reads.
+                    int(matrix_bytes * nprobe / nlist),
+                )
+            )
+
+    truth: List[set] = []
+    print(
+        f"Index report: {len(queries)} queries, top_k={top_k}, source={source or 'all'}"
+    )
+    print(
+        f"  {'mode':<14} {'recall@k':>9} {'mean ms':>9} {'p95 ms':>9} {'scan MiB':>9}"
+    )
+    for name, index, size in candidates:
+        storage = EmbeddingStorage(db, search_index=index)
+        hits = 0
+        expected = 0
+        latencies: List[float] = []
+        for i, (key, vector) in enumerate(queries):
+            start = time.perf_counter()
+            results = await storage.search_similar(vector, source, top_k + 1, -math.inf)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found = [
+                (r["source"], r["problem_id"])
+                for r in results
+                if (r["source"], r["problem_id"]) != key
+            ][:top_k]
+            if index is None:
+                truth.append(set(found))
+            hits += len(truth[i].intersection(found))
+            expected += len(truth[i])
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        recall = hits / expected if expected else 1.0
+        size_mib = f"{size / 1048576:.1f}" if size is not None else "n/a"
+        print(
+            f"  {name:<14} {recall:>9.3f} {sum(latencies) / len(latencies):>9.2f} "
+            f"{p95:>9.2f} {size_mib:>9}"
+        )
+
+
+async def _close_clients(*clients) -> None:
+    for client in clients:
+        if client is not None:
+            await client.aclose()
+
+
 async def main() -> None:
     parser = argparse.ArgumentParser(description="Embedding CLI tool")
     parser.add_argument("--build", action="store_true", help="Build embeddings")
@@ -570,9 +1409,80 @@ async def main() -> None:
     parser.add_argument(
         "--dry-run", action="store_true", help="Estimate embedding cost"
     )
+    parser.add_argument(
+        "--reembed",
+        action="store_true",
+        help="With --build/--rebuild, embed cached rewrites only (no rewrite LLM calls)",
+    )
     parser.add_argument(
         "--embed-text", type=str, help="Generate embedding for given text", default=None
     )
+    parser.add_argument(
+        "--migrate-vectors",
+        action="store_true",
+        help="Convert JSON-text vectors to float32 blobs and partition the vector table by source",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a resident embed-text server (NDJSON over stdin/stdout or --socket)",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        help="Unix socket path for --serve (default: embedding.server_socket)",
+        default=None,
+    )
+    parser.add_argument(
+        "--versions", action="store_true", help="List embedding index versions"
+    )
+    parser.add_argument(
+        "--activate",
+        type=int,
+        metavar="VERSION",
+        default=None,
+        help="Swap the given embedding index version in as the live index",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help="Re-activate the most recently retired embedding index version",
+    )
+    parser.add_argument(
+        "--prune-versions",
+        type=int,
+        nargs="?",
+        const=0,
+        default=None,
+        metavar="KEEP",
+        help="Drop retired index versions, keeping the KEEP most recent (default: 0)",
+    )
+    parser.add_argument(
+        "--build-neighbors",
+        action="store_true",
+        help="Refresh the precomputed top-k neighbor table (after --build if given)",
+    )
+    parser.add_argument(
+        "--find-duplicates",
+        action="store_true",
+        help="Refresh the cross-source duplicate mapping (after --build if given)",
+    )
+    parser.add_argument(
+        "--fit-local-idf",
+        action="store_true",
+        help="Fit IDF weights of the local embedding provider on all problems",
+    )
+    parser.add_argument(
+        "--index-report",
+        action="store_true",
+        help="Report recall@k and latency of float32, int8, binary and numpy search",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        help="Number of stored vectors used as queries for --index-report",
+        default=200,
+    )
     parser.add_argument("--source", type=str, help="Problem source", default="all")
     parser.add_argument("--top-k", type=int, help="Top-k results", default=None)
     parser.add_argument(
@@ -590,6 +1500,18 @@ async def main() -> None:
     parser.add_argument(
         "--job-id", type=str, help="Job ID for progress tracking", default=None
     )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between progress file updates (default: 1.0)",
+    )
+    parser.add_argument(
+        "--progress-fd",
+        type=int,
+        default=None,
+        help="Also stream progress as JSON lines to this file descriptor",
+    )
 
     args = parser.parse_args()
     config = get_config()
@@ -607,130 +1529,270 @@ async def main() -> None:
     filter_pattern = args.filter
     job_id = args.job_id or str(uuid.uuid4())
 
-    if not (args.build or args.rebuild or args.query or args.stats or args.embed_text):
+    if not (
+        args.build
+        or args.rebuild
+        or args.query
+        or args.stats
+        or args.embed_text
+        or args.serve
+        or args.migrate_vectors
+        or args.index_report
+        or args.versions
+        or args.activate is not None
+        or args.rollback
+        or args.prune_versions is not None
+        or args.fit_local_idf
+        or args.build_neighbors
+        or args.find_duplicates
+    ):
         parser.print_help()
         return
 
+    if args.serve:
+        server_config = config.get_embed_server_config()
+        db = EmbeddingDatabaseManager(db_path=config.database_path)
+        rewriter = EmbeddingRewriter(config)
+        generator = EmbeddingGenerator(config)
+        server = EmbeddingServer(
+            rewriter,
+            generator,
+            workers=server_config.workers,
+            queue_size=server_config.queue_size,
+            cache=QueryEmbeddingCache.from_config(config, db),
+        )
+        try:
+            await server.serve(args.socket or server_config.socket_path)
+        finally:
+            await _close_clients(rewriter, generator)
+            db.close()
+        return
+
     if args.embed_text:
         import json as _json
 
+        db = EmbeddingDatabaseManager(db_path=config.database_path)
+        cache = QueryEmbeddingCache.from_config(config, db)
         rewriter = EmbeddingRewriter(config)
         generator = EmbeddingGenerator(config)
-        rewritten = await rewriter.rewrite(args.embed_text)
-        embedding = await generator.embed(rewritten)
+        try:
+            rewritten, embedding = await embed_query(
+                rewriter, generator, args.embed_text, cache
+            )
+        finally:
+            await _close_clients(rewriter, generator)
+            db.close()
         print(_json.dumps({"embedding": embedding, "rewritten": rewritten}))
         return
 
     db = EmbeddingDatabaseManager(db_path=config.database_path)
-    storage = EmbeddingStorage(db)
+    search_index = None
+    if args.query:
+        search_index = (
+            IVFIndex.from_config(config, db)
+            or MatrixIndex.from_config(config, db)
+            or QuantizedIndex.from_config(config, db)
+        )
+    storage = EmbeddingStorage(db, search_index=search_index)
     rewriter = None
     generator = None
-    needs_llm = args.query or ((args.build or args.rebuild) and not args.dry_run)
-    if needs_llm:
-        rewriter = EmbeddingRewriter(config)
-        generator = EmbeddingGenerator(config)
-
-    sources: List[str] = []
-    if source == "all":
-        sources = await asyncio.to_thread(_fetch_sources_with_content_sync, db)
+    try:
+        needs_llm = args.query or ((args.build or args.rebuild) and not args.dry_run)
+        if needs_llm:
+            if args.query or not args.reembed:
+                rewriter = EmbeddingRewriter(config)
+            generator = EmbeddingGenerator(config)
+
+        if args.migrate_vectors:
+            await _prepare_db(db, embedding_config.dim, rebuild=False)
+            converted = await storage.migrate_json_vectors()
+            print(f"Converted {converted} JSON vector rows to float32 blobs.")
+            moved = await storage.partition_vec_table(embedding_config.dim)
+            if moved is None:
+                print("Vector table already partitioned by source.")
+            else:
+                print(f"Rebuilt vector table partitioned by source ({moved} rows).")
+
+        versions = IndexVersions(db)
+        activated: IndexVersion | None = None
+        if args.activate is not None:
+            activated = await asyncio.to_thread(versions.activate, args.activate)
+        elif args.rollback:
+            activated = await asyncio.to_thread(versions.rollback)
+        if activated is not None:
+            print(f"Activated embedding index v{activated.version}.")
+            if (activated.model, activated.dim) != (
+                embedding_config.name,
+                embedding_config.dim,
+            ):
+                logger.warning(
+                    "Active index uses %s (dim=%s) but config has %s (dim=%s); "
+                    "update [embedding] to match before querying",
+                    activated.model,
+                    activated.dim,
+                    embedding_config.name,
+                    embedding_config.dim,
+                )
+            else:
+                neighbors = NeighborTable.from_config(config, db)
+                if neighbors.is_built():
+                    await refresh_neighbors(neighbors)
+                duplicates = DuplicateTable.from_config(config, db)
+                if duplicates.is_built():
+                    await refresh_duplicates(duplicates)
+        if args.prune_versions is not None:
+            dropped = await asyncio.to_thread(versions.prune, args.prune_versions)
+            print(
+                "Dropped index versions: "
+                + (", ".join(f"v{v}" for v in dropped) or "none")
+            )
+        if args.versions:
+            await asyncio.to_thread(show_index_versions, versions)
+        if args.fit_local_idf:
+            await asyncio.to_thread(fit_local_idf, db, config)
 
-    if args.stats:
+        sources: List[str] = []
         if source == "all":
-            if not sources:
-                print("No problems with content found.")
-            for src in sources:
-                print(f"Source: {src}")
-                await show_stats(db, storage, src, filter_pattern)
-        else:
-            await show_stats(db, storage, source, filter_pattern)
+            sources = await asyncio.to_thread(_fetch_sources_with_content_sync, db)
 
-    if args.query:
-        query_source = None if source == "all" else source
-        await query_similar(
-            db,
-            storage,
-            rewriter,
-            generator,
-            query_source,
-            args.query,
-            top_k,
-            min_similarity,
-        )
-
-    if args.build or args.rebuild:
-        combined_report = BuildReport()
-        start_time = time.monotonic()
-        try:
+        if args.stats:
             if source == "all":
                 if not sources:
                     print("No problems with content found.")
-                    return
-                if args.rebuild:
-                    await _prepare_db(db, embedding_config.dim, rebuild=True)
-                    await storage.delete_all_embeddings(None)
-                for index, src in enumerate(sources, start=1):
+                for src in sources:
+                    print(f"Source: {src}")
+                    await show_stats(db, storage, src, filter_pattern)
+            else:
+                await show_stats(db, storage, source, filter_pattern)
+
+        if args.index_report:
+            await index_report(
+                db, None if source == "all" else source, top_k, args.samples
+            )
+
+        if args.query:
+            query_source = None if source == "all" else source
+            await query_similar(
+                db,
+                storage,
+                rewriter,
+                generator,
+                query_source,
+                args.query,
+                top_k,
+                min_similarity,
+            )
+
+        if args.build_neighbors and not (args.build or args.rebuild):
+            await refresh_neighbors(NeighborTable.from_config(config, db))
+
+        if args.find_duplicates and not (args.build or args.rebuild):
+            await refresh_duplicates(DuplicateTable.from_config(config, db))
+
+        if args.build or args.rebuild:
+            combined_report = BuildReport()
+            start_time = time.monotonic()
+            progress = ProgressReporter(
+                os.path.join(LOGS_DIR, f"{job_id}.progress.json"),
+                interval=args.progress_interval,
+                stream=(
+                    os.fdopen(args.progress_fd, "w")
+                    if args.progress_fd is not None
+                    else None
+                ),
+            )
+            await progress.start()
+            # SIGTERM (job cancel/timeout) stops the build gracefully so the
+            # summary and in-flight batches are still written.
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+
+            def request_stop() -> None:
+                if not stop.is_set():
+                    logger.warning("SIGTERM received, finishing in-flight work")
+                stop.set()
+
+            loop.add_signal_handler(signal.SIGTERM, request_stop)
+            try:
+                build_sources: List[str] = [source]
+                if source == "all":
+                    if not sources:
+                        print("No problems with content found.")
+                        return
                     logger.info(
-                        "Building embeddings for source '%s' (%d/%d)",
-                        src,
-                        index,
+                        "Building embeddings for %d sources: %s",
                         len(sources),
+                        ", ".join(sources),
                     )
-                    try:
-                        r = await build_embeddings(
+                    build_sources = sources
+                # --rebuild and model/dim changes fill a shadow index version;
+                # the live index keeps serving until the shadow is complete.
+                target = await asyncio.to_thread(
+                    versions.build_target,
+                    embedding_config.name,
+                    embedding_config.dim,
+                    args.rebuild,
+                    not args.dry_run,
+                )
+                if target is None:
+                    combined_report = await asyncio.to_thread(
+                        _fresh_build_report, db, build_sources, filter_pattern
+                    )
+                else:
+                    build_storage = storage
+                    if target.status != "active":
+                        build_storage = EmbeddingStorage(
                             db,
-                            storage,
-                            rewriter,
-                            generator,
-                            src,
-                            batch_size,
-                            rebuild=False,
-                            dry_run=args.dry_run,
-                            filter_pattern=filter_pattern,
-                            job_id=job_id,
-                        )
-                        combined_report.total_pending += r.total_pending
-                        combined_report.succeeded += r.succeeded
-                        for k, v in r.skipped.items():
-                            combined_report.skipped[k] = (
-                                combined_report.skipped.get(k, 0) + v
-                            )
-                        for k, v in r.failed.items():
-                            combined_report.failed[k] = (
-                                combined_report.failed.get(k, 0) + v
-                            )
-                    except Exception as exc:
-                        logger.error(
-                            "Failed to build embeddings for source '%s': %s",
-                            src,
-                            exc,
-                            exc_info=True,
+                            vec_table=target.vec_table,
+                            meta_table=target.meta_table,
                         )
-                        combined_report.add_failed(f"source_fatal:{src}", src)
-            else:
-                combined_report = await build_embeddings(
-                    db,
-                    storage,
-                    rewriter,
-                    generator,
-                    source,
-                    batch_size,
-                    args.rebuild,
-                    args.dry_run,
-                    filter_pattern,
-                    job_id,
+                    combined_report = await build_embeddings(
+                        db,
+                        build_storage,
+                        rewriter,
+                        generator,
+                        build_sources,
+                        batch_size,
+                        rebuild=False,
+                        dry_run=args.dry_run,
+                        filter_pattern=filter_pattern,
+                        progress=progress,
+                        reembed_only=args.reembed,
+                        report=combined_report,
+                        stop=stop,
+                    )
+                    if (
+                        target.status == "building"
+                        and not args.dry_run
+                        and not stop.is_set()
+                        and combined_report.total_failed == 0
+                    ):
+                        await _finish_shadow_build(db, versions, target)
+                if not args.dry_run and not stop.is_set():
+                    # Once built, neighbor lists are kept fresh by every build.
+                    neighbors = NeighborTable.from_config(config, db)
+                    if args.build_neighbors or neighbors.is_built():
+                        progress.update("neighbors")
+                        await refresh_neighbors(neighbors)
+                    duplicates = DuplicateTable.from_config(config, db)
+                    if args.find_duplicates or duplicates.is_built():
+                        progress.update("duplicates")
+                        await refresh_duplicates(duplicates)
+            finally:
+                loop.remove_signal_handler(signal.SIGTERM)
+                combined_report.duration_secs = time.monotonic() - start_time
+                print(f"EMBEDDING_SUMMARY:{json.dumps(combined_report.to_dict())}")
+                progress.update(
+                    "failed" if combined_report.total_failed > 0 else "completed"
                 )
-        finally:
-            combined_report.duration_secs = time.monotonic() - start_time
-            print(f"EMBEDDING_SUMMARY:{json.dumps(combined_report.to_dict())}")
-            if job_id:
-                phase = "failed" if combined_report.total_failed > 0 else "completed"
-                try:
-                    _write_progress(job_id, {"phase": phase})
-                except Exception:
-                    pass
-
-        if combined_report.total_failed > 0:
-            sys.exit(1)
+                await progress.close()
+                if progress.stream is not None:
+                    progress.stream.close()
+
+            if combined_report.total_failed > 0:
+                sys.exit(1)
+    finally:
+        await _close_clients(rewriter, generator)
 
 
 if __name__ == "__main__":
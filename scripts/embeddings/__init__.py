@@ -1,13 +1,32 @@
 """Embedding utilities for similar-problem search."""
 
+from .duplicates import DuplicateTable
 from .generator import EmbeddingGenerator
+from .index_versions import IndexVersion, IndexVersions
+from .ivf_index import IVFIndex
+from .matrix_index import MatrixIndex
+from .neighbors import NeighborTable
+from .progress import ProgressReporter
+from .quantized_index import QuantizedIndex
+from .query_cache import QueryEmbeddingCache
 from .rewriter import EmbeddingRewriter
 from .searcher import SimilaritySearcher
+from .server import EmbeddingServer
 from .storage import EmbeddingStorage
 
 __all__ = [
+    "DuplicateTable",
     "EmbeddingGenerator",
     "EmbeddingRewriter",
+    "EmbeddingServer",
     "EmbeddingStorage",
+    "IndexVersion",
+    "IndexVersions",
+    "IVFIndex",
+    "MatrixIndex",
+    "NeighborTable",
+    "ProgressReporter",
+    "QuantizedIndex",
+    "QueryEmbeddingCache",
     "SimilaritySearcher",
 ]
@@ -0,0 +1,313 @@
+"""Cross-source near-duplicate problems, found from their stored vectors."""
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from utils.config import ConfigManager
+from utils.database import EmbeddingDatabaseManager
+from utils.logger import get_database_logger
+
+from .matrix_index import _require_numpy
+from .neighbors import load_vectors, sq_distances
+
+logger = get_database_logger()
+
+ProblemKey = Tuple[str, str]
+# (match, canonical, similarity to the match) of a duplicate.
+Mapping = Tuple[ProblemKey, ProblemKey, float]
+
+# vec_index_state rows are named "problem_duplicates:<threshold>:<priority>",
+# so changing either setting makes the next refresh a full pass.
+_STATE_PREFIX = "problem_duplicates"
+_CHUNK = 500
+
+
+class DuplicateTable:
+    """``problem_duplicates`` rows mapping mirrored problems to a canonical one.
+
+    Sources are ordered by ``source_priority`` (unlisted sources follow, by
+    name). A problem is a duplicate when its nearest vector on a
+    higher-priority source reaches ``threshold`` similarity; that problem is
+    its match, and its canonical problem is the match's canonical (or the
+    match itself). Problems of one source are never compared, so mirrors
+    always point at the original judge.
+
+    ``refresh`` computes matches with blocked matrix products, ``block_mb``
+    of distances at a time, against only the higher-priority rows. After
+    the first pass it recomputes problems whose vector changed, problems
+    whose match changed or disappeared, and problems a changed vector now
+    matches better. Mappings of problems that lost their vector (builds skip
+    known duplicates) are kept while their match still exists. Activating
+    an index version clears the state watermark, which keeps the table
+    built but makes the next refresh a full pass.
+    """
+
+    def __init__(
+        self,
+        db: EmbeddingDatabaseManager,
+        dim: int,
+        threshold: float = 0.95,
+        source_priority: Sequence[str] = (),
+        block_mb: int = 256,
+    ):
+        self.np = None  # imported by refresh, so is_built works without numpy
+        self.db = db
+        self.dim = dim
+        self.threshold = threshold
+        self.source_priority = tuple(source_priority)
+        self.block_bytes = max(1, block_mb) << 20
+        self.state_name = (
+            f"{_STATE_PREFIX}:{threshold}:{','.join(self.source_priority)}"
+        )
+
+    @classmethod
+    def from_config(
+        cls, config: ConfigManager, db: EmbeddingDatabaseManager
+    ) -> "DuplicateTable":
+        duplicates_config = config.get_duplicates_config()
+        return cls(
+            db,
+            config.get_embedding_model_config().dim,
+            threshold=duplicates_config.threshold,
+            source_priority=duplicates_config.source_priority,
+            block_mb=duplicates_config.block_mb,
+        )
+
+    def is_built(self) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM vec_index_state WHERE name LIKE ? LIMIT 1",
+            (f"{_STATE_PREFIX}:%",),
+            fetchone=True,
+        )
+        return row is not None
+
+    def _state_sync(self) -> Tuple[Optional[str], int]:
+        row = self.db.execute(
+            "SELECT watermark, db_rows FROM vec_index_state WHERE name = ?",
+            (self.state_name,),
+            fetchone=True,
+        )
+        return (row[0], int(row[1])) if row else (None, -1)
+
+    def _rank(self, source: str) -> Tuple[int, str]:
+        try:
+            return (self.source_priority.index(source), source)
+        except ValueError:
+            return (len(self.source_priority), source)
+
+    def _stored_sync(self) -> Dict[ProblemKey, Mapping]:
+        rows = self.db.execute(
+            """
+            SELECT source, problem_id, match_source, match_id,
+                   canonical_source, canonical_id, similarity
+            FROM problem_duplicates
+            """,
+            fetchall=True,
+        )
+        return {
+            (r[0], r[1]): ((r[2], r[3]), (r[4], r[5]), float(r[6])) for r in rows or []
+        }
+
+    def _block_rows(self, n: int) -> int:
+        # The distance block plus the matmul temporary, float32 each.
+        return max(1, self.block_bytes // max(1, n * 4 * 2))
+
+    def _best_matches(self, matrix, sq_norms, higher, rows):
+        """Nearest higher-priority row and its squared distance, per row.
+
+        Rows are ordered by priority, so the candidates of row ``i`` are the
+        prefix ``[0, higher[i])``; ``rows`` must be ascending.
+        """
+        np = self.np
+        best = np.full(len(rows), -1, dtype=np.int64)
+        best_d2 = np.full(len(rows), np.inf, dtype=np.float32)
+        if len(rows) == 0:
+            return best, best_d2
+        step = self._block_rows(max(1, int(higher[rows[-1]])))
+        for start in range(0, len(rows), step):
+            block = rows[start : start + step]
+            limit = int(higher[block[-1]])
+            if limit == 0:
+                continue
+            cols = np.arange(limit)
+            d2 = sq_distances(np, matrix, sq_norms, block, cols)
+            d2[cols[None, :] >= higher[block][:, None]] = np.inf
+            nearest = d2.argmin(axis=1)
+            best[start : start + len(block)] = nearest
+            best_d2[start : start + len(block)] = d2[np.arange(len(block)), nearest]
+        best[~np.isfinite(best_d2)] = -1
+        return best, best_d2
+
+    def refresh(self, force: bool = False) -> int:
+        """Bring the mapping up to date; returns how many problems were compared."""
+        np = self.np = _require_numpy()
+        row = self.db.execute(
+            """
+            SELECT (SELECT MAX(updated_at) FROM problem_embeddings),
+                   (SELECT COUNT(*) FROM problem_embeddings)
+            """,
+            fetchone=True,
+        )
+        watermark, db_rows = (row[0], int(row[1])) if row else (None, 0)
+        old_watermark, old_rows = self._state_sync()
+        if not force and watermark == old_watermark and db_rows == old_rows:
+            return 0
+
+        keys, matrix = load_vectors(np, self.db, self.dim)
+        order = sorted(range(len(keys)), key=lambda i: (self._rank(keys[i][0]), i))
+        keys = [keys[i] for i in order]
+        matrix = matrix[order] if keys else matrix
+        n = len(keys)
+        position = {key: i for i, key in enumerate(keys)}
+        ranks: Dict[Tuple[int, str], int] = {}
+        for src, _ in keys:
+            ranks.setdefault(self._rank(src), len(ranks))
+        rank = np.array([ranks[self._rank(src)] for src, _ in keys], dtype=np.int64)
+        # Rows of strictly higher priority than row i: [0, higher[i]).
+        higher = np.searchsorted(rank, rank, side="left")
+        sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        max_d2 = (1.0 - self.threshold) ** 2
+
+        stored = self._stored_sync()
+        matches: Dict[ProblemKey, Tuple[ProblemKey, float]] = {
+            key: (match, similarity) for key, (match, _, similarity) in stored.items()
+        }
+        full = force or old_watermark is None
+        if full:
+            affected = np.arange(n)
+            # Only mappings of problems without a vector carry over, and only
+            # while they still point at a higher-priority source.
+            matches = {
+                key: value
+                for key, value in matches.items()
+                if key not in position and self._rank(value[0][0]) < self._rank(key[0])
+            }
+        else:
+            changed_rows = self.db.execute(
+                "SELECT source, problem_id FROM problem_embeddings WHERE updated_at >= ?",
+                (old_watermark,),
+                fetchall=True,
+            )
+            changed = sorted(
+                position[(r[0], r[1])]
+                for r in changed_rows or []
+                if (r[0], r[1]) in position
+            )
+            changed_keys: Set[ProblemKey] = {keys[i] for i in changed}
+            marked = np.zeros(n, dtype=bool)
+            marked[changed] = True
+            for key, (match, _) in matches.items():
+                i = position.get(key)
+                if i is not None and (match in changed_keys or match not in position):
+                    marked[i] = True
+            if changed:
+                # A changed vector becomes the match of a lower-priority row
+                # when it is closer than that row's current match.
+                current_d2 = np.full(n, max_d2, dtype=np.float32)
+                for key, (_, similarity) in matches.items():
+                    i = position.get(key)
+                    if i is not None:
+                        current_d2[i] = (1.0 - similarity) ** 2
+                cols = np.array(changed)
+                candidates = np.flatnonzero(higher > cols[0])
+                step = self._block_rows(len(cols))
+                for start in range(0, len(candidates), step):
+                    rows = candidates[start : start + step]
+                    d2 = sq_distances(np, matrix, sq_norms, rows, cols)
+                    d2[cols[None, :] >= higher[rows][:, None]] = np.inf
+                    marked[rows[d2.min(axis=1) <= current_d2[rows]]] = True
+            affected = np.flatnonzero(marked)
+
+        best, best_d2 = self._best_matches(matrix, sq_norms, higher, affected)
+        for i, j, d2 in zip(affected.tolist(), best.tolist(), best_d2.tolist()):
+            if j >= 0 and d2 <= max_d2:
+                matches[keys[i]] = (keys[j], 1.0 - float(np.sqrt(d2)))
+            else:
+                matches.pop(keys[i], None)
+
+        resolved = self._resolve(matches, position)
+        self._write_sync(stored, resolved, watermark, db_rows)
+        logger.info(
+            f"Duplicates refreshed ({'full' if full else 'incremental'}): "
+            f"{len(affected)} of {n} problems compared, {len(resolved)} duplicates "
+            f"(threshold {self.threshold})"
+        )
+        return len(affected)
+
+    @staticmethod
+    def _resolve(
+        matches: Dict[ProblemKey, Tuple[ProblemKey, float]],
+        position: Dict[ProblemKey, int],
+    ) -> Dict[ProblemKey, Mapping]:
+        """Follow match chains to their canonical problem.
+
+        Matches point at a higher-priority source, so chains end. Chains that
+        end at a problem with neither a vector nor a match (it was deleted)
+        are dropped.
+        """
+        canonical: Dict[ProblemKey, Optional[ProblemKey]] = {}
+
+        def find(key: ProblemKey) -> Optional[ProblemKey]:
+            path: List[ProblemKey] = []
+            seen: Set[ProblemKey] = set()
+            while key in matches and key not in canonical and key not in seen:
+                path.append(key)
+                seen.add(key)
+                key = matches[key][0]
+            if key in canonical:
+                root = canonical[key]
+            elif key in seen:
+                root = None
+            else:
+                root = key if key in position else None
+            for step in path:
+                canonical[step] = root
+            return root
+
+        resolved: Dict[ProblemKey, Mapping] = {}
+        for key, (match, similarity) in matches.items():
+            root = find(key)
+            if root is not None:
+                resolved[key] = (match, root, similarity)
+        return resolved
+
+    def _write_sync(
+        self,
+        stored: Dict[ProblemKey, Mapping],
+        resolved: Dict[ProblemKey, Mapping],
+        watermark: Optional[str],
+        db_rows: int,
+    ) -> None:
+        removed = [key for key in stored if key not in resolved]
+        upserts = [
+            (*key, *match, *canonical, similarity)
+            for key, (match, canonical, similarity) in resolved.items()
+            if stored.get(key) != (match, canonical, similarity)
+        ]
+        with self.db.transaction() as conn:
+            for start in range(0, len(removed), _CHUNK):
+                conn.executemany(
+                    "DELETE FROM problem_duplicates WHERE source = ? AND problem_id = ?",
+                    removed[start : start + _CHUNK],
+                )
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO problem_duplicates (
+                    source, problem_id, match_source, match_id,
+                    canonical_source, canonical_id, similarity
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                upserts,
+            )
+            conn.execute(
+                "DELETE FROM vec_index_state WHERE name LIKE ?",
+                (f"{_STATE_PREFIX}:%",),
+            )
+            conn.execute(
+                """
+                INSERT INTO vec_index_state (name, watermark, db_rows)
+                VALUES (?, ?, ?)
+                """,
+                (self.state_name, watermark, db_rows),
+            )
@@ -3,9 +3,10 @@
 from __future__ import annotations
 
 import asyncio
-from typing import List, Sequence
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from embeddings.providers import create_provider
+from embeddings.providers.rate_limit import AdaptiveRateLimiter, estimate_tokens
 from utils.config import ConfigManager, EmbeddingModelConfig, get_config
 from utils.logger import get_llm_logger
 
@@ -13,18 +14,109 @@ logger = get_llm_logger()
 
 
 class EmbeddingGenerator:
+    """Embeds texts through the configured provider.
+
+    Concurrent :meth:`embed` calls are coalesced: the first one waits up to
+    ``coalesce_wait_ms`` for others, then up to ``coalesce_max_batch`` of
+    them share a single ``embed_batch`` request (a full batch is sent without
+    waiting). A burst of queries therefore costs one provider call and one
+    rate-limiter slot. A wait of 0 or a max batch of 1 turns this off;
+    :meth:`embed_batch` is never delayed.
+    """
+
     def __init__(self, config: ConfigManager | None = None):
         self.config = config or get_config()
         self.model_config: EmbeddingModelConfig = (
             self.config.get_embedding_model_config()
         )
         self._provider = create_provider(self.config, "embedding")
+        self.limiter = AdaptiveRateLimiter.from_model_config(
+            "embedding", self.model_config
+        )
+        self.coalesce_wait = max(0.0, self.model_config.coalesce_wait_ms) / 1000.0
+        self.coalesce_max_batch = max(
+            1, self.model_config.coalesce_max_batch or self.model_config.batch_size
+        )
+        self._waiting: List[Tuple[str, asyncio.Future]] = []
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: set[asyncio.Task] = set()
+        self.embed_calls = 0
+        self.coalesced_batches = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "embed_calls": self.embed_calls,
+            "coalesced_batches": self.coalesced_batches,
+            "waiting": len(self._waiting),
+        }
 
     async def embed(self, content: str) -> List[float]:
-        vectors = await self.embed_batch([content])
-        return vectors[0] if vectors else []
+        self.embed_calls += 1
+        if self.coalesce_wait <= 0 or self.coalesce_max_batch <= 1:
+            vectors = await self.embed_batch([content])
+            return vectors[0] if vectors else []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting.append((content, future))
+        if len(self._waiting) >= self.coalesce_max_batch:
+            self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(self.coalesce_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Send everything waiting, in batches of ``coalesce_max_batch`` texts."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        waiting, self._waiting = self._waiting, []
+        waiting = [(text, future) for text, future in waiting if not future.done()]
+        for start in range(0, len(waiting), self.coalesce_max_batch):
+            task = asyncio.ensure_future(
+                self._embed_waiting(waiting[start : start + self.coalesce_max_batch])
+            )
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _embed_waiting(self, waiting: List[Tuple[str, asyncio.Future]]) -> None:
+        # Identical texts in one burst (the same query from several clients)
+        # are embedded once.
+        positions: Dict[str, int] = {}
+        for text, _ in waiting:
+            positions.setdefault(text, len(positions))
+        self.coalesced_batches += 1
+        try:
+            vectors = await self.embed_batch(list(positions))
+            if len(vectors) != len(positions):
+                raise ValueError(
+                    f"Provider returned {len(vectors)} embeddings "
+                    f"for {len(positions)} texts"
+                )
+        except Exception as exc:
+            for _, future in waiting:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        except asyncio.CancelledError:
+            for _, future in waiting:
+                future.cancel()
+            raise
+        for text, future in waiting:
+            if not future.done():
+                future.set_result(list(vectors[positions[text]]))
 
     async def embed_batch(self, contents: Sequence[str]) -> List[List[float]]:
         if not contents:
             return []
-        return await asyncio.to_thread(self._provider.embed_batch, contents)
+        return await self.limiter.call(
+            lambda: self._provider.aembed_batch(contents),
+            cost=estimate_tokens(contents),
+        )
+
+    async def aclose(self) -> None:
+        if self._waiting:
+            self._flush()
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+        await self._provider.aclose()
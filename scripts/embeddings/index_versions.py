@@ -0,0 +1,306 @@
+"""Versioned embedding indexes: build in shadow tables, swap in atomically."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from utils.database import (
+    METADATA_TABLE,
+    QUANTIZATION_MODES,
+    VEC_TABLE,
+    EmbeddingDatabaseManager,
+)
+from utils.logger import get_database_logger
+
+logger = get_database_logger()
+
+
+@dataclass
+class IndexVersion:
+    version: int
+    model: str
+    dim: int
+    status: str
+    created_at: str
+    activated_at: Optional[str] = None
+
+    @property
+    def vec_table(self) -> str:
+        if self.status == "active":
+            return VEC_TABLE
+        return f"{VEC_TABLE}__v{self.version}"
+
+    @property
+    def meta_table(self) -> str:
+        if self.status == "active":
+            return METADATA_TABLE
+        return f"{METADATA_TABLE}__v{self.version}"
+
+
+class IndexVersions:
+    """Registry of embedding index versions, one per build target.
+
+    The active version always owns the tables readers use
+    (``vec_embeddings`` / ``problem_embeddings``), so the server and search
+    paths never look the version up. Every other version keeps its own
+    ``__v<version>`` copies: ``building`` while a build fills them, ``retired``
+    once replaced, kept for rollback until pruned. ``activate`` swaps tables
+    by renaming them inside one transaction, so readers see either the old
+    index or the new one, never a partial one.
+    """
+
+    def __init__(self, db: EmbeddingDatabaseManager):
+        self.db = db
+
+    @staticmethod
+    def _now_iso() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def _fetch(self, where: str = "", params: tuple = ()) -> List[IndexVersion]:
+        rows = self.db.execute(
+            f"""
+            SELECT version, model, dim, status, created_at, activated_at
+            FROM embedding_index_versions {where}
+            ORDER BY version ASC
+            """,
+            params,
+            fetchall=True,
+        )
+        return [IndexVersion(*row) for row in rows or []]
+
+    def get(self, version: int) -> Optional[IndexVersion]:
+        found = self._fetch("WHERE version = ?", (version,))
+        return found[0] if found else None
+
+    def list_versions(self) -> List[IndexVersion]:
+        self._register_legacy()
+        return self._fetch()
+
+    def active(self) -> Optional[IndexVersion]:
+        self._register_legacy()
+        found = self._fetch("WHERE status = 'active'")
+        return found[0] if found else None
+
+    def _register_legacy(self) -> None:
+        """Adopt live tables built before versions existed as the active version."""
+        row = self.db.execute(
+            "SELECT COUNT(*) FROM embedding_index_versions", fetchone=True
+        )
+        if row and row[0]:
+            return
+        row = self.db.execute(
+            f"""
+            SELECT model, dim FROM {METADATA_TABLE}
+            GROUP BY model, dim ORDER BY COUNT(*) DESC LIMIT 1
+            """,
+            fetchone=True,
+        )
+        if not row:
+            return
+        now = self._now_iso()
+        self.db.execute(
+            """
+            INSERT INTO embedding_index_versions
+                (model, dim, status, created_at, activated_at)
+            VALUES (?, ?, 'active', ?, ?)
+            """,
+            (row[0], row[1], now, now),
+            commit=True,
+        )
+
+    def _create(self, model: str, dim: int, status: str) -> IndexVersion:
+        now = self._now_iso()
+        self.db.execute(
+            """
+            INSERT INTO embedding_index_versions
+                (model, dim, status, created_at, activated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (model, dim, status, now, now if status == "active" else None),
+            commit=True,
+        )
+        row = self.db.execute(
+            "SELECT MAX(version) FROM embedding_index_versions", fetchone=True
+        )
+        version = self.get(int(row[0]))
+        self.db.create_vec_table(dim, version.vec_table)
+        self.db.create_metadata_table(version.meta_table)
+        return version
+
+    def build_target(
+        self, model: str, dim: int, fresh: bool = False, create: bool = True
+    ) -> Optional[IndexVersion]:
+        """Pick the version a build of ``(model, dim)`` should write to.
+
+        An unfinished shadow for the same model and dim is resumed, then the
+        active version is built in place if it matches. Otherwise (or with
+        ``fresh``) a new shadow is started; with ``create=False`` None is
+        returned instead. The very first build goes straight to the live
+        tables since there is nothing to keep serving.
+        """
+        active = self.active()
+        building = self._fetch(
+            "WHERE status = 'building' AND model = ? AND dim = ?", (model, dim)
+        )
+        if fresh:
+            if not create:
+                return None
+            for version in building:
+                self.drop(version.version)
+        elif building:
+            return building[-1]
+        elif active and (active.model, active.dim) == (model, dim):
+            return active
+        if not create:
+            return None
+        if active is None and not self._has_live_rows():
+            self.db.execute(f"DROP TABLE IF EXISTS {VEC_TABLE}", commit=True)
+            return self._create(model, dim, "active")
+        version = self._create(model, dim, "building")
+        logger.info(
+            f"Building embedding index v{version.version} ({model}, dim={dim}) "
+            f"in {version.vec_table}; the active index keeps serving until it is swapped in"
+        )
+        return version
+
+    def _has_live_rows(self) -> bool:
+        if not self.db.table_exists(VEC_TABLE):
+            return False
+        row = self.db.execute(f"SELECT COUNT(*) FROM {VEC_TABLE}", fetchone=True)
+        return bool(row and row[0])
+
+    def count_rows(self, version: IndexVersion) -> int:
+        if not self.db.table_exists(version.meta_table):
+            return 0
+        row = self.db.execute(
+            f"SELECT COUNT(*) FROM {version.meta_table}", fetchone=True
+        )
+        return int(row[0]) if row else 0
+
+    def activate(self, version: int) -> IndexVersion:
+        """Swap ``version`` in as the live index and retire the current one."""
+        target = self.get(version)
+        if target is None:
+            raise ValueError(f"Embedding index version {version} does not exist")
+        if target.status == "active":
+            return target
+        current = self.active()
+        if not self.db.table_exists(target.vec_table):
+            raise ValueError(f"Tables of embedding index v{version} are missing")
+        # Rows of problems deleted while the shadow was built (the server
+        # only deletes from the live tables).
+        self._drop_orphans(target)
+        now = self._now_iso()
+        with self.db.transaction() as conn:
+            if current is not None:
+                retired_vec = f"{VEC_TABLE}__v{current.version}"
+                retired_meta = f"{METADATA_TABLE}__v{current.version}"
+                self.db.rename_vec_table(conn, VEC_TABLE, retired_vec)
+                conn.execute(f"ALTER TABLE {METADATA_TABLE} RENAME TO {retired_meta}")
+                conn.execute(
+                    "UPDATE embedding_index_versions SET status = 'retired' WHERE version = ?",
+                    (current.version,),
+                )
+            else:
+                conn.execute(f"DROP TABLE IF EXISTS {VEC_TABLE}")
+                conn.execute(f"DROP TABLE IF EXISTS {METADATA_TABLE}")
+            self.db.rename_vec_table(conn, target.vec_table, VEC_TABLE)
+            conn.execute(f"ALTER TABLE {target.meta_table} RENAME TO {METADATA_TABLE}")
+            conn.execute(
+                """
+                UPDATE embedding_index_versions
+                SET status = 'active', activated_at = ?
+                WHERE version = ?
+                """,
+                (now, version),
+            )
+            # Quantized copies mirror the old vectors; they are rebuilt from
+            # the new table on the next query.
+            for mode in QUANTIZATION_MODES:
+                conn.execute(f"DROP TABLE IF EXISTS vec_quantized_{mode}")
+            conn.execute(
+                "DELETE FROM vec_index_state WHERE name LIKE 'vec_quantized_%'"
+            )
+            # Neighbor lists were computed from the old vectors; by-problem
+            # lookups fall back to KNN until the next refresh, which the NULL
+            # watermark turns into a full pass.
+            conn.execute("DELETE FROM problem_neighbors")
+            conn.execute(
+                """
+                UPDATE vec_index_state SET watermark = NULL, db_rows = -1
+                WHERE name = 'problem_neighbors'
+                """
+            )
+            # Duplicate mappings stay (builds keep skipping those problems);
+            # the NULL watermark makes the next refresh re-check them all
+            # against the new vectors.
+            conn.execute(
+                """
+                UPDATE vec_index_state SET watermark = NULL, db_rows = -1
+                WHERE name LIKE 'problem_duplicates:%'
+                """
+            )
+        logger.info(
+            f"Activated embedding index v{version} ({target.model}, dim={target.dim})"
+            + (f", retired v{current.version}" if current is not None else "")
+        )
+        return self.get(version)
+
+    def _drop_orphans(self, version: IndexVersion) -> None:
+        rows = self.db.execute(
+            f"""
+            SELECT source, problem_id FROM {version.meta_table} e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM problems p
+                WHERE p.source = e.source AND p.id = e.problem_id
+            )
+            """,
+            fetchall=True,
+        )
+        if not rows:
+            return
+        with self.db.transaction() as conn:
+            conn.executemany(
+                f"DELETE FROM {version.vec_table} WHERE source = ? AND problem_id = ?",
+                rows,
+            )
+            conn.executemany(
+                f"DELETE FROM {version.meta_table} WHERE source = ? AND problem_id = ?",
+                rows,
+            )
+        logger.info(
+            f"Dropped {len(rows)} rows of deleted problems from index v{version.version}"
+        )
+
+    def rollback(self) -> IndexVersion:
+        """Re-activate the most recently retired version."""
+        retired = self._fetch("WHERE status = 'retired'")
+        if not retired:
+            raise ValueError("No retired embedding index version to roll back to")
+        retired.sort(key=lambda v: v.activated_at or "", reverse=True)
+        return self.activate(retired[0].version)
+
+    def drop(self, version: int) -> None:
+        target = self.get(version)
+        if target is None:
+            return
+        if target.status == "active":
+            raise ValueError("The active embedding index version cannot be dropped")
+        with self.db.transaction() as conn:
+            # DROP on a vec0 table removes its shadow tables as well.
+            conn.execute(f"DROP TABLE IF EXISTS {target.vec_table}")
+            conn.execute(f"DROP TABLE IF EXISTS {target.meta_table}")
+            conn.execute(
+                "DELETE FROM embedding_index_versions WHERE version = ?", (version,)
+            )
+
+    def prune(self, keep: int = 0) -> List[int]:
+        """Drop retired versions except the ``keep`` most recently active ones."""
+        retired = self._fetch("WHERE status = 'retired'")
+        retired.sort(key=lambda v: v.activated_at or "", reverse=True)
+        dropped = [v.version for v in retired[max(0, keep) :]]
+        for version in dropped:
+            self.drop(version)
+        return dropped
@@ -0,0 +1,331 @@
+"""Approximate KNN over the matrix index through an IVF coarse quantizer."""
+
+from __future__ import annotations
+
+import math
+import os
+from typing import List, Optional, Sequence
+
+from utils.config import ConfigManager
+from utils.database import EmbeddingDatabaseManager
+from utils.logger import get_database_logger
+
+from .matrix_index import MatrixIndex, ProblemKey
+
+logger = get_database_logger()
+
+# k-means trains on at most this many points per list, for this many rounds.
+_TRAIN_POINTS_PER_LIST = 64
+_TRAIN_ITERATIONS = 12
+# Retrain once the row count drifts this far from the trained size.
+_RETRAIN_GROWTH = 2.0
+# Bytes of (rows x lists) distances computed at a time while assigning.
+_ASSIGN_BLOCK_BYTES = 64 << 20
+
+
+def auto_lists(n: int) -> int:
+    """Default list count for ``n`` rows: ``4 * sqrt(n)``, at most ``n``."""
+    return max(1, min(n, int(round(4 * math.sqrt(n)))))
+
+
+def nearest_centroids(np, vectors, centroids):
+    """Index of the nearest centroid (L2) for every row of ``vectors``."""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    step = max(1, _ASSIGN_BLOCK_BYTES // max(1, len(centroids) * 4))
+    for start in range(0, len(vectors), step):
+        block = np.asarray(vectors[start : start + step], dtype=np.float32)
+        # |x|^2 is the same for every centroid, so it does not move the argmin.
+        scores = block @ centroids.T
+        scores *= -2.0
+        scores += c_sq[None, :]
+        labels[start : start + len(block)] = scores.argmin(axis=1)
+    return labels
+
+
+def train_centroids(
+    np, matrix, nlist: int, iterations: int = _TRAIN_ITERATIONS, seed: int = 0
+):
+    """Lloyd's k-means on a random sample of ``matrix``; returns ``(nlist, dim)``.
+
+    Centroids start at distinct sample rows; a list that empties during
+    training is reseeded from a random sample row. When the vectors are unit
+    length (as every provider here returns them) the centroids are kept on
+    the unit sphere too: plain means of near-orthogonal unit vectors shrink
+    toward the origin and turn into hubs that collect oversized lists.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    sample_size = min(n, nlist * _TRAIN_POINTS_PER_LIST)
+    sample_rows = np.sort(rng.choice(n, sample_size, replace=False))
+    sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+    norms = np.linalg.norm(sample, axis=1)
+    spherical = bool(np.all(np.abs(norms - 1.0) < 1e-3))
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroids(np, sample, centroids)
+        counts = np.bincount(labels, minlength=nlist)
+        order = np.argsort(labels, kind="stable")
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None].astype(np.float32)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty))]
+        if spherical:
+            lengths = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.maximum(lengths, 1e-12)
+    return centroids
+
+
+class IVFIndex(MatrixIndex):
+    """Inverted-file index on top of the :class:`MatrixIndex` matrix.
+
+    k-means splits the vectors into ``nlist`` lists (``4 * sqrt(n)`` when
+    ``nlist`` is 0); a query scores the centroids, then runs exact L2 only
+    over the rows of the ``nprobe`` nearest lists, so it reads roughly
+    ``nprobe / nlist`` of the matrix. Raising ``nprobe`` trades latency for
+    recall; ``nprobe >= nlist`` is an exact search. When a source filter
+    leaves fewer than ``top_k`` candidates, further lists are probed in
+    centroid order until it does.
+
+    The centroids and each row's list live in ``ivf.npz`` next to the
+    matrix files. ``refresh`` assigns new and re-embedded rows to the
+    existing centroids and retrains only when the row count has grown or
+    shrunk by ``_RETRAIN_GROWTH`` since training, or when another index
+    version is activated.
+    """
+
+    def __init__(
+        self,
+        db: EmbeddingDatabaseManager,
+        index_dir: str,
+        dim: int,
+        nlist: int = 0,
+        nprobe: int = 16,
+    ):
+        super().__init__(db, index_dir, dim)
+        self.nlist = max(0, nlist)
+        self.nprobe = max(1, nprobe)
+        self.ivf_path = os.path.join(index_dir, "ivf.npz")
+        self._centroids = None
+        self._centroid_sq = None
+        self._labels = None
+        self._list_rows = None
+        self._list_offsets = None
+        self._trained_rows = 0
+        self._ivf_loaded = False
+
+    @classmethod
+    def from_config(
+        cls, config: ConfigManager, db: EmbeddingDatabaseManager
+    ) -> Optional["IVFIndex"]:
+        similar_config = config.get_similar_config()
+        if similar_config.backend != "ivf":
+            return None
+        return cls(
+            db,
+            similar_config.index_dir,
+            config.get_embedding_model_config().dim,
+            nlist=similar_config.ivf_lists,
+            nprobe=similar_config.ivf_nprobe,
+        )
+
+    @property
+    def list_count(self) -> int:
+        return 0 if self._centroids is None else len(self._centroids)
+
+    # --- persistence ---
+
+    def _load_lists(self) -> None:
+        """Load ``ivf.npz`` if it was written for the current matrix."""
+        np = self.np
+        self._ivf_loaded = True
+        if not os.path.exists(self.ivf_path):
+            return
+        with np.load(self.ivf_path) as data:
+            centroids = data["centroids"]
+            labels = data["labels"]
+            watermark = str(data["watermark"]) or None
+            trained_rows = int(data["trained_rows"])
+        if (
+            centroids.ndim != 2
+            or centroids.shape[1] != self.dim
+            or len(labels) != len(self._keys)
+            or watermark != self._watermark
+        ):
+            logger.warning("IVF lists do not match the matrix index, reassigning")
+            return
+        self._centroids = centroids
+        self._trained_rows = trained_rows
+        self._set_lists(labels)
+
+    def _save_lists(self) -> None:
+        np = self.np
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = self.ivf_path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self._centroids,
+            labels=self._labels,
+            watermark=np.array(self._watermark or ""),
+            trained_rows=np.array(self._trained_rows),
+        )
+        os.replace(tmp_path, self.ivf_path)
+
+    def _set_lists(self, labels) -> None:
+        np = self.np
+        self._labels = labels
+        self._centroid_sq = np.einsum("ij,ij->i", self._centroids, self._centroids)
+        # Row numbers grouped by list; list i is rows[offsets[i]:offsets[i+1]].
+        self._list_rows = np.argsort(labels, kind="stable").astype(np.int64)
+        counts = np.bincount(labels, minlength=len(self._centroids))
+        self._list_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def _clear_lists(self) -> None:
+        self._centroids = None
+        self._centroid_sq = None
+        self._labels = None
+        self._list_rows = None
+        self._list_offsets = None
+        self._trained_rows = 0
+
+    # --- refresh ---
+
+    def refresh(self) -> bool:
+        """Sync the matrix, then (re)assign rows to lists; True if anything changed."""
+        with self._lock:
+            if self._matrix is None:
+                self._load()
+            if not self._ivf_loaded:
+                self._load_lists()
+            previous_keys = self._keys
+            previous_labels = self._labels
+            previous_version = self._index_version
+        changed = super().refresh()
+        with self._lock:
+            if not changed and (
+                len(self._keys) == 0
+                or (self._labels is not None and len(self._labels) == len(self._keys))
+            ):
+                return False
+            if previous_version != self._index_version:
+                self._clear_lists()
+            self._update_lists(previous_keys, previous_labels)
+            if self._centroids is not None:
+                self._save_lists()
+            elif os.path.exists(self.ivf_path):
+                os.remove(self.ivf_path)
+            return True
+
+    def _needs_training(self, n: int) -> bool:
+        if self._centroids is None or self._trained_rows <= 0:
+            return True
+        if self.nlist and self.nlist != len(self._centroids):
+            return True
+        growth = n / self._trained_rows
+        return growth >= _RETRAIN_GROWTH or growth <= 1 / _RETRAIN_GROWTH
+
+    def _update_lists(
+        self,
+        previous_keys: List[ProblemKey],
+        previous_labels,
+    ) -> None:
+        np = self.np
+        n = len(self._keys)
+        if n == 0:
+            self._clear_lists()
+            return
+        if self._needs_training(n):
+            nlist = min(self.nlist or auto_lists(n), n)
+            self._centroids = train_centroids(np, self._matrix, nlist)
+            self._trained_rows = n
+            self._set_lists(nearest_centroids(np, self._matrix, self._centroids))
+            logger.info(f"IVF index trained: {n} rows in {nlist} lists")
+            return
+
+        previous = {}
+        if previous_labels is not None and len(previous_labels) == len(previous_keys):
+            previous = dict(zip(previous_keys, previous_labels.tolist()))
+        labels = np.empty(n, dtype=np.int32)
+        pending: List[int] = []
+        for i, key in enumerate(self._keys):
+            label = None if key in self.updated_keys else previous.get(key)
+            if label is None:
+                pending.append(i)
+            else:
+                labels[i] = label
+        if pending:
+            labels[pending] = nearest_centroids(
+                np, self._matrix[pending], self._centroids
+            )
+        self._set_lists(labels)
+        logger.info(
+            f"IVF lists updated: {len(pending)} of {n} rows assigned "
+            f"to {len(self._centroids)} lists"
+        )
+
+    # --- search ---
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        source: Optional[str],
+        top_k: int,
+        min_similarity: float,
+    ) -> List[dict]:
+        np = self.np
+        with self._lock:
+            centroids = self._centroids
+            centroid_sq = self._centroid_sq
+            list_rows = self._list_rows
+            offsets = self._list_offsets
+            matrix = self._matrix
+            sq_norms = self._sq_norms
+            codes = self._source_codes
+            keys = self._keys
+            source_code = self._source_index.get(source) if source else None
+        if centroids is None or list_rows is None:
+            return super().search(query_embedding, source, top_k, min_similarity)
+        if len(keys) == 0 or top_k <= 0:
+            return []
+        if source and source_code is None:
+            return []
+
+        q = np.asarray(query_embedding, dtype=np.float32)
+        centroid_d2 = centroid_sq - 2.0 * (centroids @ q)
+        nprobe = min(self.nprobe, len(centroids))
+        probe_order = np.argpartition(centroid_d2, nprobe - 1)[:nprobe]
+        probe_order = probe_order[np.argsort(centroid_d2[probe_order])]
+        rows = self._probe(list_rows, offsets, probe_order, codes, source_code)
+        if len(rows) < top_k and nprobe < len(centroids):
+            # Widen the probe in centroid order until top_k candidates exist.
+            remaining = np.argsort(centroid_d2)[nprobe:]
+            for start in range(0, len(remaining), nprobe):
+                more = self._probe(
+                    list_rows,
+                    offsets,
+                    remaining[start : start + nprobe],
+                    codes,
+                    source_code,
+                )
+                rows = np.concatenate([rows, more])
+                if len(rows) >= top_k:
+                    break
+        if len(rows) == 0:
+            return []
+
+        rows.sort()  # sequential reads from the memory map
+        sq_dist = sq_norms[rows] - 2.0 * (matrix[rows] @ q) + float(q @ q)
+        return self._top_k(keys, rows, sq_dist, top_k, min_similarity)
+
+    def _probe(self, list_rows, offsets, lists, codes, source_code):
+        np = self.np
+        rows = np.concatenate(
+            [list_rows[offsets[i] : offsets[i + 1]] for i in lists]
+            or [np.empty(0, dtype=np.int64)]
+        )
+        if source_code is not None:
+            rows = rows[codes[rows] == source_code]
+        return rows
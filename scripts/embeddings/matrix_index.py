@@ -0,0 +1,303 @@
+"""Exact KNN over a memory-mapped float32 matrix exported from vec_embeddings."""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.config import ConfigManager
+from utils.database import EmbeddingDatabaseManager
+from utils.logger import get_database_logger
+
+from .storage import deserialize_vector
+
+logger = get_database_logger()
+
+ProblemKey = Tuple[str, str]
+# Keys per IN (...) lookup, well under SQLite's bound-parameter limit.
+_CHUNK = 500
+
+
+def _require_numpy():
+    try:
+        import numpy as np
+    except ImportError as exc:
+        raise RuntimeError(
+            "numpy is required for the numpy search backend. "
+            "Install with: pip install numpy"
+        ) from exc
+    return np
+
+
+class MatrixIndex:
+    """Contiguous ``(n, dim)`` float32 copy of the vector table.
+
+    The matrix lives in ``vectors.npy`` (opened with ``mmap_mode="r"``) next
+    to an ``ids.json`` sidecar holding the row keys and the
+    ``problem_embeddings.updated_at`` watermark it was built from. ``refresh``
+    re-reads only rows whose ``updated_at`` reached the watermark and drops
+    rows that disappeared, then rewrites both files atomically. Swapping in
+    another index version (see IndexVersions) forces a full re-export.
+
+    Distances are L2, matching the vec0 table, so ``similarity = 1 - distance``
+    means the same thing on both backends.
+    """
+
+    def __init__(self, db: EmbeddingDatabaseManager, index_dir: str, dim: int):
+        self.np = _require_numpy()
+        self.db = db
+        self.index_dir = index_dir
+        self.dim = dim
+        self.matrix_path = os.path.join(index_dir, "vectors.npy")
+        self.sidecar_path = os.path.join(index_dir, "ids.json")
+        self._lock = threading.Lock()
+        self._keys: List[ProblemKey] = []
+        self._matrix = None
+        self._sq_norms = None
+        self._source_codes = None
+        self._source_index: Dict[str, int] = {}
+        self._watermark: Optional[str] = None
+        self._row_count = -1
+        self._index_version: Optional[int] = None
+        # Keys whose vector the last refresh (re)loaded.
+        self.updated_keys: set = set()
+
+    @classmethod
+    def from_config(
+        cls, config: ConfigManager, db: EmbeddingDatabaseManager
+    ) -> Optional["MatrixIndex"]:
+        similar_config = config.get_similar_config()
+        if similar_config.backend != "numpy":
+            return None
+        return cls(
+            db, similar_config.index_dir, config.get_embedding_model_config().dim
+        )
+
+    # --- persistence ---
+
+    def _load(self) -> None:
+        np = self.np
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.sidecar_path)):
+            self._set_state([], np.empty((0, self.dim), dtype=np.float32), None)
+            return
+        with open(self.sidecar_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("dim") != self.dim:
+            logger.warning(
+                f"Matrix index dim {meta.get('dim')} != {self.dim}, rebuilding"
+            )
+            self._set_state([], np.empty((0, self.dim), dtype=np.float32), None)
+            return
+        matrix = np.load(self.matrix_path, mmap_mode="r")
+        keys = [(src, pid) for src, pid in meta.get("keys", [])]
+        if matrix.shape != (len(keys), self.dim):
+            logger.warning("Matrix index sidecar does not match matrix, rebuilding")
+            self._set_state([], np.empty((0, self.dim), dtype=np.float32), None)
+            return
+        self._set_state(keys, matrix, meta.get("watermark"))
+        self._row_count = meta.get("db_rows", -1)
+        self._index_version = meta.get("index_version")
+
+    def _save(self) -> None:
+        np = self.np
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_matrix = self.matrix_path + ".tmp.npy"
+        tmp_sidecar = self.sidecar_path + ".tmp"
+        np.save(tmp_matrix, np.ascontiguousarray(self._matrix, dtype=np.float32))
+        with open(tmp_sidecar, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dim": self.dim,
+                    "watermark": self._watermark,
+                    "db_rows": self._row_count,
+                    "index_version": self._index_version,
+                    "keys": [list(k) for k in self._keys],
+                },
+                f,
+            )
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_sidecar, self.sidecar_path)
+        # Re-open as a read-only map so the heap copy can be released.
+        self._set_state(
+            self._keys, np.load(self.matrix_path, mmap_mode="r"), self._watermark
+        )
+
+    def _set_state(self, keys: List[ProblemKey], matrix, watermark) -> None:
+        np = self.np
+        self._keys = keys
+        self._matrix = matrix
+        self._watermark = watermark
+        self._sq_norms = np.einsum("ij,ij->i", matrix, matrix, dtype=np.float32)
+        self._source_index = {}
+        codes = np.empty(len(keys), dtype=np.int32)
+        for i, (src, _) in enumerate(keys):
+            codes[i] = self._source_index.setdefault(src, len(self._source_index))
+        self._source_codes = codes
+
+    # --- refresh ---
+
+    def _db_state_sync(self) -> Tuple[Optional[str], int, Optional[int]]:
+        row = self.db.execute(
+            """
+            SELECT (SELECT MAX(updated_at) FROM problem_embeddings),
+                   (SELECT COUNT(*) FROM problem_embeddings),
+                   (SELECT MAX(version) FROM embedding_index_versions
+                    WHERE status = 'active')
+            """,
+            fetchone=True,
+        )
+        return (row[0], int(row[1]), row[2]) if row else (None, 0, None)
+
+    def _fetch_vectors_sync(
+        self, keys: Sequence[ProblemKey]
+    ) -> Dict[ProblemKey, Sequence[float]]:
+        by_source: Dict[str, List[str]] = {}
+        for src, pid in keys:
+            by_source.setdefault(src, []).append(pid)
+        found: Dict[ProblemKey, Sequence[float]] = {}
+        for src, pids in by_source.items():
+            pids = sorted(set(pids))
+            for start in range(0, len(pids), _CHUNK):
+                chunk = pids[start : start + _CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = self.db.execute(
+                    f"""
+                    SELECT problem_id, embedding FROM vec_embeddings
+                    WHERE source = ? AND problem_id IN ({placeholders})
+                    """,
+                    (src, *chunk),
+                    fetchall=True,
+                )
+                for pid, data in rows or []:
+                    if isinstance(data, bytes) and len(data) % 4 == 0:
+                        found[(src, pid)] = deserialize_vector(data)
+        return found
+
+    def refresh(self) -> bool:
+        """Bring the matrix up to date with the database; returns True if it changed."""
+        np = self.np
+        with self._lock:
+            if self._matrix is None:
+                self._load()
+            watermark, db_count, index_version = self._db_state_sync()
+            if index_version != self._index_version:
+                self._set_state([], np.empty((0, self.dim), dtype=np.float32), None)
+                self._index_version = index_version
+            elif watermark == self._watermark and db_count == self._row_count:
+                return False
+
+            if self._watermark is None:
+                changed_rows = self.db.execute(
+                    "SELECT source, problem_id FROM problem_embeddings",
+                    fetchall=True,
+                )
+            else:
+                changed_rows = self.db.execute(
+                    "SELECT source, problem_id FROM problem_embeddings WHERE updated_at >= ?",
+                    (self._watermark,),
+                    fetchall=True,
+                )
+            live_rows = self.db.execute(
+                "SELECT source, problem_id FROM problem_embeddings",
+                fetchall=True,
+            )
+            live = {(r[0], r[1]) for r in live_rows or []}
+            changed = [(r[0], r[1]) for r in changed_rows or []]
+            vectors = self._fetch_vectors_sync(changed)
+
+            keep = [i for i, key in enumerate(self._keys) if key in live]
+            matrix = np.array(self._matrix[keep], dtype=np.float32)
+            keys = [self._keys[i] for i in keep]
+            position = {key: i for i, key in enumerate(keys)}
+            appended_keys: List[ProblemKey] = []
+            appended: List[Sequence[float]] = []
+            for key, vec in vectors.items():
+                if len(vec) != self.dim:
+                    continue
+                if key in position:
+                    matrix[position[key]] = np.frombuffer(vec, dtype=np.float32)
+                else:
+                    appended_keys.append(key)
+                    appended.append(vec)
+            if appended:
+                extra = np.stack([np.frombuffer(v, dtype=np.float32) for v in appended])
+                matrix = np.concatenate([matrix, extra])
+                keys.extend(appended_keys)
+
+            dropped = len(self._keys) - len(keep)
+            self.updated_keys = set(vectors)
+            self._keys = keys
+            self._matrix = matrix
+            self._watermark = watermark
+            self._row_count = db_count
+            self._save()
+            logger.info(
+                f"Matrix index refreshed: {len(keys)} rows "
+                f"({len(vectors)} updated, {dropped} dropped)"
+            )
+            return True
+
+    # --- search ---
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        source: Optional[str],
+        top_k: int,
+        min_similarity: float,
+    ) -> List[dict]:
+        np = self.np
+        with self._lock:
+            matrix = self._matrix
+            sq_norms = self._sq_norms
+            codes = self._source_codes
+            keys = self._keys
+            source_code = self._source_index.get(source) if source else None
+        if matrix is None or len(keys) == 0 or top_k <= 0:
+            return []
+        if source and source_code is None:
+            return []
+
+        q = np.asarray(query_embedding, dtype=np.float32)
+        sq_dist = sq_norms - 2.0 * (matrix @ q) + float(q @ q)
+        if source_code is not None:
+            sq_dist = np.where(codes == source_code, sq_dist, np.inf)
+        return self._top_k(keys, np.arange(len(keys)), sq_dist, top_k, min_similarity)
+
+    def _top_k(
+        self,
+        keys: List[ProblemKey],
+        rows,
+        sq_dist,
+        top_k: int,
+        min_similarity: float,
+    ) -> List[dict]:
+        """Result dicts for the ``top_k`` smallest ``sq_dist`` (of ``rows``)."""
+        np = self.np
+        k = min(top_k, len(rows))
+        if k <= 0:
+            return []
+        candidates = np.argpartition(sq_dist, k - 1)[:k]
+        candidates = candidates[np.argsort(sq_dist[candidates])]
+
+        results: List[dict] = []
+        for idx in candidates:
+            d2 = float(sq_dist[idx])
+            if not np.isfinite(d2):
+                break
+            distance = float(np.sqrt(max(d2, 0.0)))
+            similarity = 1 - distance
+            if similarity < min_similarity:
+                break
+            src, pid = keys[rows[idx]]
+            results.append(
+                {
+                    "source": src,
+                    "problem_id": pid,
+                    "distance": distance,
+                    "similarity": similarity,
+                }
+            )
+        return results
@@ -0,0 +1,272 @@
+"""Materialized top-K neighbor lists for every embedded problem."""
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from utils.config import ConfigManager
+from utils.database import EmbeddingDatabaseManager
+from utils.logger import get_database_logger
+
+from .matrix_index import _require_numpy
+
+logger = get_database_logger()
+
+ProblemKey = Tuple[str, str]
+
+# Row in vec_index_state holding the updated_at watermark of the lists.
+_STATE_NAME = "problem_neighbors"
+_CHUNK = 500
+
+
+def load_vectors(np, db: EmbeddingDatabaseManager, dim: int):
+    """``(keys, (n, dim) float32 matrix)`` of every live vector of size ``dim``."""
+    rows = db.execute(
+        "SELECT source, problem_id, embedding FROM vec_embeddings",
+        fetchall=True,
+    )
+    size = dim * 4
+    rows = [r for r in rows or [] if isinstance(r[2], bytes) and len(r[2]) == size]
+    keys = [(r[0], r[1]) for r in rows]
+    if not rows:
+        return keys, np.empty((0, dim), dtype=np.float32)
+    matrix = np.frombuffer(b"".join(r[2] for r in rows), dtype="<f4")
+    return keys, matrix.reshape(len(rows), dim).astype(np.float32)
+
+
+def sq_distances(np, matrix, sq_norms, rows, cols=None):
+    """Squared L2 distances between ``rows`` and ``cols`` (all rows if None)."""
+    other = matrix if cols is None else matrix[cols]
+    other_sq = sq_norms if cols is None else sq_norms[cols]
+    d2 = matrix[rows] @ other.T
+    d2 *= -2.0
+    d2 += sq_norms[rows][:, None]
+    d2 += other_sq[None, :]
+    return np.maximum(d2, 0.0, out=d2)
+
+
+class NeighborTable:
+    """Precomputed ``problem_neighbors`` rows, ``k`` per embedded problem.
+
+    ``refresh`` loads the live vectors into one float32 matrix and computes
+    L2 neighbors with blocked matrix products, ``block_mb`` of distances at a
+    time. After the first full pass only affected lists are recomputed:
+    problems whose vector changed, lists that reference a changed or deleted
+    problem, and lists a changed vector now beats the last entry of.
+    Each problem's list is replaced in one transaction, so readers never see
+    a partial list. Similarities are ``1 - distance``, as in search.
+    """
+
+    def __init__(
+        self,
+        db: EmbeddingDatabaseManager,
+        dim: int,
+        k: int = 50,
+        block_mb: int = 256,
+    ):
+        self.np = None  # imported by refresh, so is_built works without numpy
+        self.db = db
+        self.dim = dim
+        self.k = max(1, k)
+        self.block_bytes = max(1, block_mb) << 20
+
+    @classmethod
+    def from_config(
+        cls, config: ConfigManager, db: EmbeddingDatabaseManager
+    ) -> "NeighborTable":
+        similar_config = config.get_similar_config()
+        return cls(
+            db,
+            config.get_embedding_model_config().dim,
+            k=similar_config.neighbors_k,
+            block_mb=similar_config.neighbors_block_mb,
+        )
+
+    def is_built(self) -> bool:
+        # Activating an index version keeps the state row with a NULL
+        # watermark, so the next refresh is a full pass over the new vectors.
+        row = self.db.execute(
+            "SELECT 1 FROM vec_index_state WHERE name = ?",
+            (_STATE_NAME,),
+            fetchone=True,
+        )
+        return row is not None
+
+    def _state_sync(self) -> Tuple[Optional[str], int]:
+        row = self.db.execute(
+            "SELECT watermark, db_rows FROM vec_index_state WHERE name = ?",
+            (_STATE_NAME,),
+            fetchone=True,
+        )
+        return (row[0], int(row[1])) if row else (None, -1)
+
+    def _stored_lists_sync(self) -> Dict[ProblemKey, Tuple[int, float]]:
+        """``(count, last similarity)`` of every stored list."""
+        rows = self.db.execute(
+            """
+            SELECT source, problem_id, COUNT(*), MIN(similarity)
+            FROM problem_neighbors
+            GROUP BY source, problem_id
+            """,
+            fetchall=True,
+        )
+        return {(r[0], r[1]): (int(r[2]), float(r[3])) for r in rows or []}
+
+    def _listing_sync(self, keys: Sequence[ProblemKey]) -> Set[ProblemKey]:
+        """Problems whose stored list contains any of ``keys``."""
+        by_source: Dict[str, List[str]] = {}
+        for src, pid in keys:
+            by_source.setdefault(src, []).append(pid)
+        found: Set[ProblemKey] = set()
+        for src, pids in by_source.items():
+            for start in range(0, len(pids), _CHUNK):
+                chunk = pids[start : start + _CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = self.db.execute(
+                    f"""
+                    SELECT DISTINCT source, problem_id FROM problem_neighbors
+                    WHERE neighbor_source = ? AND neighbor_id IN ({placeholders})
+                    """,
+                    (src, *chunk),
+                    fetchall=True,
+                )
+                found.update((r[0], r[1]) for r in rows or [])
+        return found
+
+    def _block_rows(self, n: int) -> int:
+        # The distance block plus the matmul temporary, float32 each.
+        return max(1, self.block_bytes // max(1, n * 4 * 2))
+
+    def refresh(self, force: bool = False) -> int:
+        """Bring the lists up to date; returns how many lists were recomputed."""
+        np = self.np = _require_numpy()
+        row = self.db.execute(
+            # Separate subqueries so MAX() is an index lookup, not a scan.
+            """
+            SELECT (SELECT MAX(updated_at) FROM problem_embeddings),
+                   (SELECT COUNT(*) FROM problem_embeddings)
+            """,
+            fetchone=True,
+        )
+        watermark, db_rows = (row[0], int(row[1])) if row else (None, 0)
+        old_watermark, old_rows = self._state_sync()
+        if not force and watermark == old_watermark and db_rows == old_rows:
+            # Vectors are unchanged; only a new neighbors_k needs work.
+            row = self.db.execute(
+                "SELECT MAX(rank) FROM problem_neighbors", fetchone=True
+            )
+            stored_k = row[0] + 1 if row and row[0] is not None else 0
+            if stored_k == min(self.k, max(db_rows - 1, 0)):
+                return 0
+
+        keys, matrix = load_vectors(np, self.db, self.dim)
+        n = len(keys)
+        k = min(self.k, n - 1)
+        position = {key: i for i, key in enumerate(keys)}
+        stored = self._stored_lists_sync()
+        deleted = [key for key in stored if key not in position]
+        sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+
+        full = (
+            force
+            or old_watermark is None
+            or any(count != k for count, _ in stored.values())
+        )
+        if full or k <= 0:
+            affected = np.arange(n)
+        else:
+            changed_rows = self.db.execute(
+                "SELECT source, problem_id FROM problem_embeddings WHERE updated_at >= ?",
+                (old_watermark,),
+                fetchall=True,
+            )
+            changed = [
+                position[(r[0], r[1])]
+                for r in changed_rows or []
+                if (r[0], r[1]) in position
+            ]
+            marked = np.array([key not in stored for key in keys], dtype=bool)
+            marked[changed] = True
+            for key in self._listing_sync([keys[i] for i in changed] + deleted):
+                if key in position:
+                    marked[position[key]] = True
+            # A changed vector enters a list if it beats the last entry.
+            last_d2 = np.full(n, np.inf, dtype=np.float32)
+            for key, (_, last_similarity) in stored.items():
+                i = position.get(key)
+                if i is not None:
+                    last_d2[i] = (1.0 - last_similarity) ** 2
+            if changed:
+                step = self._block_rows(len(changed))
+                for start in range(0, n, step):
+                    rows = np.arange(start, min(start + step, n))
+                    best = sq_distances(np, matrix, sq_norms, rows, changed).min(axis=1)
+                    marked[rows[best < last_d2[rows]]] = True
+            affected = np.flatnonzero(marked)
+
+        if k > 0:
+            step = self._block_rows(n)
+            for start in range(0, len(affected), step):
+                rows = affected[start : start + step]
+                d2 = sq_distances(np, matrix, sq_norms, rows)
+                d2[np.arange(len(rows)), rows] = np.inf
+                nearest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+                nearest_d2 = np.take_along_axis(d2, nearest, axis=1)
+                order = np.argsort(nearest_d2, axis=1)
+                nearest = np.take_along_axis(nearest, order, axis=1)
+                similarity = 1.0 - np.sqrt(
+                    np.take_along_axis(nearest_d2, order, axis=1)
+                )
+                self._write_lists_sync(
+                    [keys[i] for i in rows], nearest, similarity, keys
+                )
+        else:
+            deleted = list(stored)
+
+        with self.db.transaction() as conn:
+            for start in range(0, len(deleted), _CHUNK):
+                conn.executemany(
+                    "DELETE FROM problem_neighbors WHERE source = ? AND problem_id = ?",
+                    deleted[start : start + _CHUNK],
+                )
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO vec_index_state (name, watermark, db_rows)
+                VALUES (?, ?, ?)
+                """,
+                (_STATE_NAME, watermark, db_rows),
+            )
+        recomputed = len(affected) if k > 0 else 0
+        logger.info(
+            f"Neighbor lists refreshed ({'full' if full else 'incremental'}): "
+            f"{recomputed} of {n} recomputed, {len(deleted)} dropped, k={k}"
+        )
+        return recomputed
+
+    def _write_lists_sync(
+        self,
+        owners: List[ProblemKey],
+        nearest,
+        similarity,
+        keys: List[ProblemKey],
+    ) -> None:
+        rows = [
+            (src, pid, rank, *keys[j], sim)
+            for (src, pid), cols, sims in zip(
+                owners, nearest.tolist(), similarity.tolist()
+            )
+            for rank, (j, sim) in enumerate(zip(cols, sims))
+        ]
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "DELETE FROM problem_neighbors WHERE source = ? AND problem_id = ?",
+                owners,
+            )
+            conn.executemany(
+                """
+                INSERT INTO problem_neighbors
+                    (source, problem_id, rank, neighbor_source, neighbor_id, similarity)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
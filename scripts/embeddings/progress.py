@@ -0,0 +1,117 @@
+"""Coalesced progress reporting for embedding build jobs."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Optional, TextIO
+
+from utils.logger import get_core_logger
+
+logger = get_core_logger()
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    """Atomic write of a JSON file via temp + rename."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class ProgressReporter:
+    """Keeps the latest job progress in memory and publishes it periodically.
+
+    ``update`` only merges fields into the in-memory state, so pipeline
+    workers can call it per item. A background task publishes the state at
+    most once per ``interval`` seconds, and right away the first time a
+    phase is entered (pipelined stages alternate phases, so later flips wait
+    for the interval). Publishing rewrites the ``path`` progress file atomically and,
+    if ``stream`` is set, writes the same state as one JSON line. The stream
+    is typically a pipe opened with ``--progress-fd``.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        interval: float = 1.0,
+        stream: Optional[TextIO] = None,
+    ):
+        self.path = path
+        self.interval = max(0.0, interval)
+        self.stream = stream
+        self._state: dict = {}
+        self._dirty = False
+        self._seen_phases: set = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.flushes = 0
+
+    def update(self, phase: str, **fields: Any) -> None:
+        self._state.update(fields)
+        self._state["phase"] = phase
+        self._dirty = True
+        if phase not in self._seen_phases:
+            self._seen_phases.add(phase)
+            if self._wake is not None:
+                self._wake.set()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+            if self._stopping and not self._dirty:
+                return
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        snapshot = dict(self._state)
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._publish, snapshot)
+        except Exception as exc:
+            logger.warning("Failed to publish progress: %s", exc)
+
+    def _publish(self, snapshot: dict) -> None:
+        self.flushes += 1
+        if self.path:
+            write_json_atomic(self.path, snapshot)
+        if self.stream is not None:
+            event = {"ts": round(time.time(), 3), **snapshot}
+            self.stream.write(json.dumps(event) + "\n")
+            self.stream.flush()
+
+    async def close(self) -> None:
+        """Publish any pending state and stop the background task."""
+        if self._task is None:
+            await self.flush()
+            return
+        # Let the task finish its own flush rather than cancelling it, so an
+        # in-flight write can never land after the final one.
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
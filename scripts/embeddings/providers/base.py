@@ -2,13 +2,19 @@
 
 from __future__ import annotations
 
+import asyncio
+import json
 from abc import ABC, abstractmethod
-from typing import List, Sequence
+from typing import Callable, List, Optional, Sequence
 
 
 class TransientProviderError(Exception):
     """Retryable provider error (rate limits, temporary unavailability)."""
 
+    def __init__(self, *args: object, retry_after: Optional[float] = None) -> None:
+        super().__init__(*args)
+        self.retry_after = retry_after
+
 
 class PermanentProviderError(Exception):
     """Non-retryable provider error (auth failure, invalid model, dimension mismatch)."""
@@ -18,6 +24,8 @@ class LLMProvider(ABC):
     """Abstract base class for LLM providers.
 
     Implementations must provide embed, embed_batch, and rewrite methods.
+    The async variants default to running the sync methods in a worker
+    thread; providers with an async SDK override them with native calls.
     """
 
     @abstractmethod
@@ -28,3 +36,35 @@ class LLMProvider(ABC):
 
     @abstractmethod
     def rewrite(self, prompt: str) -> str: ...
+
+    async def aembed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_batch, texts)
+
+    async def arewrite(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.rewrite, prompt)
+
+    async def aclose(self) -> None:
+        """Release async client resources (connection pools)."""
+
+
+def answer_rewrite_prompt(prompt: str, rewrite: Callable[[str], str]) -> str:
+    """Answer a rewrite prompt offline by applying ``rewrite`` to its statements.
+
+    Batch prompts ("Input Statements:" followed by a JSON array) get the JSON
+    ``{id: rewrite}`` object the real models are asked for.
+    """
+    _, sep, statements = prompt.rpartition("Input Statements:")
+    if sep:
+        try:
+            items = json.loads(statements)
+        except json.JSONDecodeError:
+            items = []
+        return json.dumps(
+            {
+                str(item.get("id")): rewrite(str(item.get("statement", "")))
+                for item in items
+                if isinstance(item, dict)
+            },
+            ensure_ascii=False,
+        )
+    return rewrite(prompt.rpartition("Input Statement:")[2])
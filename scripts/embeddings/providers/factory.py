@@ -9,7 +9,7 @@ if TYPE_CHECKING:
 
 from .base import LLMProvider
 
-_VALID_PROVIDERS = ("gemini", "openai")
+_VALID_PROVIDERS = ("gemini", "openai", "local", "mock")
 
 
 def create_provider(config: ConfigManager, capability: str) -> LLMProvider:
@@ -37,6 +37,16 @@ def create_provider(config: ConfigManager, capability: str) -> LLMProvider:
 
         return OpenAICompatProvider(config, capability)
 
+    if provider_name == "local":
+        from .local import LocalProvider
+
+        return LocalProvider(config, capability)
+
+    if provider_name == "mock":
+        from .mock import MockProvider
+
+        return MockProvider(config, capability)
+
     raise ValueError(
         f"Unknown LLM provider '{provider_name}'. Valid options: {', '.join(_VALID_PROVIDERS)}"
     )
@@ -11,6 +11,8 @@ logger = logging.getLogger("llm.gemini")
 
 
 def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
     try:
         from google.genai import errors
     except ImportError:
@@ -20,6 +22,16 @@ def _is_retryable(exc: Exception) -> bool:
     return False
 
 
+def _map_error(exc: Exception) -> Exception:
+    """Map google-genai errors to provider-agnostic error types.
+
+    Retries are left to the caller's rate limiter.
+    """
+    if _is_retryable(exc):
+        return TransientProviderError(str(exc))
+    return PermanentProviderError(str(exc))
+
+
 class GeminiProvider(LLMProvider):
     """Provider wrapping the google-genai SDK for Gemini models."""
 
@@ -45,6 +57,8 @@ class GeminiProvider(LLMProvider):
 
         base_url = config.resolve_base_url(capability)
         http_options = types.HttpOptions(base_url=base_url) if base_url else None
+        # One client per provider: the sync and async (``client.aio``) surfaces
+        # each keep a single connection pool shared by all calls.
         self._client = genai.Client(api_key=api_key, http_options=http_options)
 
         if capability == "embedding":
@@ -57,7 +71,6 @@ class GeminiProvider(LLMProvider):
             self._model = mc.name
             self._temperature = mc.temperature
             self._timeout = mc.timeout
-            self._max_retries = mc.max_retries
 
         logger.debug(
             "GeminiProvider(%s): model=%s, base_url=%s",
@@ -93,37 +106,32 @@ class GeminiProvider(LLMProvider):
     def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
         if not texts:
             return []
-        result = self._embed_with_retry(list(texts))
+        try:
+            result = self._client.models.embed_content(
+                model=self._model,
+                contents=list(texts),
+                config=self._embed_config,
+            )
+        except Exception as exc:
+            raise _map_error(exc) from exc
         vectors = self._extract_vectors(result)
         self._validate_dims(vectors)
         return vectors
 
-    def _embed_with_retry(self, contents: list[str]) -> Any:
-        from tenacity import (
-            Retrying,
-            retry_if_exception,
-            stop_after_attempt,
-            wait_exponential,
-        )
-
-        retryer = Retrying(
-            stop=stop_after_attempt(5),
-            wait=wait_exponential(multiplier=1, min=2, max=60),
-            retry=retry_if_exception(_is_retryable),
-            reraise=True,
-        )
+    async def aembed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
         try:
-            for attempt in retryer:
-                with attempt:
-                    return self._client.models.embed_content(
-                        model=self._model,
-                        contents=contents,
-                        config=self._embed_config,
-                    )
+            result = await self._client.aio.models.embed_content(
+                model=self._model,
+                contents=list(texts),
+                config=self._embed_config,
+            )
         except Exception as exc:
-            if _is_retryable(exc):
-                raise TransientProviderError(str(exc)) from exc
-            raise PermanentProviderError(str(exc)) from exc
+            raise _map_error(exc) from exc
+        vectors = self._extract_vectors(result)
+        self._validate_dims(vectors)
+        return vectors
 
     @staticmethod
     def _extract_vectors(result: Any) -> List[List[float]]:
@@ -155,41 +163,39 @@ class GeminiProvider(LLMProvider):
     # --- rewrite ---
 
     def rewrite(self, prompt: str) -> str:
-        from tenacity import (
-            Retrying,
-            retry_if_exception,
-            stop_after_attempt,
-            wait_exponential,
-        )
+        try:
+            try:
+                response = self._client.models.generate_content(
+                    model=self._model,
+                    contents=prompt,
+                    config=self._build_generation_config(),
+                    timeout=self._timeout,
+                )
+            except TypeError:
+                response = self._client.models.generate_content(
+                    model=self._model,
+                    contents=prompt,
+                    config=self._build_generation_config(),
+                )
+        except Exception as exc:
+            raise _map_error(exc) from exc
+        return self._extract_text(response)
 
-        retryer = Retrying(
-            stop=stop_after_attempt(self._max_retries),
-            wait=wait_exponential(multiplier=1, min=2, max=30),
-            retry=retry_if_exception(_is_retryable),
-            reraise=True,
-        )
+    async def arewrite(self, prompt: str) -> str:
         try:
-            for attempt in retryer:
-                with attempt:
-                    try:
-                        response = self._client.models.generate_content(
-                            model=self._model,
-                            contents=prompt,
-                            config=self._build_generation_config(),
-                            timeout=self._timeout,
-                        )
-                    except TypeError:
-                        response = self._client.models.generate_content(
-                            model=self._model,
-                            contents=prompt,
-                            config=self._build_generation_config(),
-                        )
-                    return self._extract_text(response)
+            response = await self._client.aio.models.generate_content(
+                model=self._model,
+                contents=prompt,
+                config=self._build_generation_config(),
+            )
         except Exception as exc:
-            if _is_retryable(exc):
-                raise TransientProviderError(str(exc)) from exc
-            raise PermanentProviderError(str(exc)) from exc
-        return ""
+            raise _map_error(exc) from exc
+        return self._extract_text(response)
+
+    async def aclose(self) -> None:
+        aclose = getattr(self._client.aio, "aclose", None)
+        if aclose is not None:
+            await aclose()
 
     @staticmethod
     def _extract_text(response: Any) -> str:
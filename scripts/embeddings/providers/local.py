@@ -0,0 +1,214 @@
+"""Local CPU embedding provider: hashed n-gram TF-IDF plus a random projection."""
+
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import unicodedata
+from typing import Any, Iterable, List, Optional, Sequence
+
+from .base import LLMProvider, PermanentProviderError, answer_rewrite_prompt
+
+logger = logging.getLogger("llm.local")
+
+# FNV-1a 64-bit, applied to the UTF-8 bytes of every n-gram at once.
+_FNV_OFFSET = 0xCBF29CE484222325
+_FNV_PRIME = 0x100000001B3
+_MIX = 0x9E3779B97F4A7C15
+
+
+def _require_numpy():
+    try:
+        import numpy as np
+    except ImportError as exc:
+        raise PermanentProviderError(
+            "numpy is required for the local provider. Install with: pip install numpy"
+        ) from exc
+    return np
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return f" {' '.join(text.split())} "
+
+
+def _identity_rewrite(statement: str) -> str:
+    return " ".join(statement.split())
+
+
+class HashedNgramEncoder:
+    """Vocabulary-free text encoder.
+
+    Character n-grams of the case-folded text are hashed into ``buckets``
+    features, weighted by sublinear TF times the IDF fitted with
+    :meth:`fit_idf` (1.0 everywhere until then), and projected to ``dim`` by
+    a fixed sparse random matrix with ``density`` +/-1 entries per bucket.
+    The projection roughly preserves the cosine similarity of the TF-IDF
+    vectors; everything is seeded, so a text always maps to the same vector.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        ngram_min: int = 3,
+        ngram_max: int = 5,
+        buckets: int = 1 << 18,
+        density: int = 8,
+        seed: int = 0,
+    ):
+        np = _require_numpy()
+        self.np = np
+        self.dim = dim
+        self.ngrams = range(ngram_min, ngram_max + 1)
+        self.buckets = buckets
+        rng = np.random.default_rng(seed)
+        self._cols = rng.integers(0, dim, size=(buckets, density), dtype=np.int64)
+        signs = np.where(rng.random((buckets, density)) < 0.5, -1.0, 1.0)
+        self._signs = (signs / np.sqrt(density)).astype(np.float32)
+        self.idf = np.ones(buckets, dtype=np.float32)
+
+    def features(self, text: str):
+        """Bucket ids of every n-gram in ``text`` (with repeats)."""
+        np = self.np
+        data = np.frombuffer(_normalize(text).encode("utf-8"), dtype=np.uint8)
+        data = data.astype(np.uint64)
+        parts = []
+        for n in self.ngrams:
+            count = len(data) - n + 1
+            if count <= 0:
+                continue
+            h = np.full(count, _FNV_OFFSET ^ n, dtype=np.uint64)
+            for k in range(n):
+                h ^= data[k : k + count]
+                h *= np.uint64(_FNV_PRIME)
+            h ^= h >> np.uint64(31)
+            h *= np.uint64(_MIX)
+            h ^= h >> np.uint64(29)
+            parts.append(h % np.uint64(self.buckets))
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts).astype(np.int64)
+
+    def encode(self, texts: Sequence[str]):
+        """``(len(texts), dim)`` float32 matrix of L2-normalized vectors.
+
+        Empty texts map to zero vectors.
+        """
+        np = self.np
+        flat_index = []
+        flat_weight = []
+        for row, text in enumerate(texts):
+            ids, counts = np.unique(self.features(text), return_counts=True)
+            if not len(ids):
+                continue
+            weights = (1.0 + np.log(counts)).astype(np.float32) * self.idf[ids]
+            flat_index.append((self._cols[ids] + row * self.dim).ravel())
+            flat_weight.append((weights[:, None] * self._signs[ids]).ravel())
+        size = len(texts) * self.dim
+        if flat_index:
+            matrix = np.bincount(
+                np.concatenate(flat_index),
+                weights=np.concatenate(flat_weight),
+                minlength=size,
+            )
+        else:
+            matrix = np.zeros(size)
+        matrix = matrix.reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    def fit_idf(self, texts: Iterable[str]) -> int:
+        """Set ``idf`` from the document frequencies of ``texts``; returns the count."""
+        np = self.np
+        df = np.zeros(self.buckets, dtype=np.int64)
+        docs = 0
+        for text in texts:
+            df[np.unique(self.features(text))] += 1
+            docs += 1
+        self.idf = (np.log((1.0 + docs) / (1.0 + df)) + 1.0).astype(np.float32)
+        return docs
+
+    def _params(self):
+        np = self.np
+        return np.array(
+            [self.ngrams.start, self.ngrams.stop - 1, self.buckets], dtype=np.int64
+        )
+
+    def save_idf(self, path: str) -> None:
+        """Write ``idf`` to an ``.npz`` file atomically."""
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self.np.savez(f, idf=self.idf, params=self._params())
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def load_idf(self, path: str) -> bool:
+        """Load IDF weights fitted with the same n-gram range and bucket count."""
+        np = self.np
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            if not np.array_equal(data["params"], self._params()):
+                logger.warning(
+                    "Ignoring %s: fitted with different n-gram/bucket settings", path
+                )
+                return False
+            self.idf = data["idf"].astype(np.float32)
+        return True
+
+
+class LocalProvider(LLMProvider):
+    """Offline provider for when the remote models are unreachable.
+
+    Embeddings come from :class:`HashedNgramEncoder`; they live in their own
+    vector space, so a local index has to be built (and queried) with this
+    provider end to end. Rewrites pass the statement through unchanged.
+    """
+
+    def __init__(self, config: Any, capability: str) -> None:
+        self._capability = capability
+        self.encoder: Optional[HashedNgramEncoder] = None
+        if capability != "embedding":
+            return
+        local = config.get_local_provider_config()
+        self.encoder = HashedNgramEncoder(
+            config.get_embedding_model_config().dim,
+            ngram_min=local.ngram_min,
+            ngram_max=local.ngram_max,
+            buckets=local.buckets,
+            density=local.density,
+            seed=local.seed,
+        )
+        if not self.encoder.load_idf(local.idf_path):
+            logger.info(
+                "No IDF weights at %s, using TF only "
+                "(run embedding_cli.py --fit-local-idf)",
+                local.idf_path,
+            )
+
+    def embed(self, text: str) -> List[float]:
+        vectors = self.embed_batch([text])
+        return vectors[0] if vectors else []
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        if self.encoder is None:
+            raise PermanentProviderError("Local rewrite provider cannot embed")
+        if not texts:
+            return []
+        return self.encoder.encode(texts).tolist()
+
+    def rewrite(self, prompt: str) -> str:
+        return answer_rewrite_prompt(prompt, _identity_rewrite)
+
+    async def arewrite(self, prompt: str) -> str:
+        return self.rewrite(prompt)
@@ -0,0 +1,134 @@
+"""Offline mock LLM provider for pipeline tests and benchmarks."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, List, Sequence
+
+from .base import (
+    LLMProvider,
+    PermanentProviderError,
+    TransientProviderError,
+    answer_rewrite_prompt,
+)
+
+logger = logging.getLogger("llm.mock")
+
+_WHITESPACE = re.compile(r"\s+")
+# Canned rewrites keep this many characters of the statement.
+_REWRITE_CHARS = 400
+
+
+def mock_vector(text: str, dim: int) -> List[float]:
+    """Unit vector seeded by the SHA-256 of ``text``: same text, same vector."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    values = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def mock_rewrite(statement: str) -> str:
+    return "Simplified: " + _WHITESPACE.sub(" ", statement).strip()[:_REWRITE_CHARS]
+
+
+class MockProvider(LLMProvider):
+    """Deterministic provider that never touches the network.
+
+    Embeddings are hash-seeded unit vectors of the configured ``dim`` and
+    rewrites are canned (batch rewrite prompts get the JSON object the real
+    models are asked for). Latency, 429/503 injection and the batch-size
+    limit come from ``[llm.mock]`` / ``[llm.models.<cap>.mock]``; injected
+    failures draw from a seeded RNG so runs are reproducible.
+    """
+
+    def __init__(self, config: Any, capability: str) -> None:
+        self._capability = capability
+        self._mock = config.get_mock_provider_config(capability)
+        self._rng = random.Random(self._mock.seed)
+        self._rng_lock = threading.Lock()
+        if capability == "embedding":
+            self._dim = config.get_embedding_model_config().dim
+        self.calls = 0
+        self.items = 0
+        self.throttled = 0
+        logger.debug("MockProvider(%s): %s", capability, self._mock)
+
+    def _draw(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _latency(self, items: int) -> float:
+        """Seconds one request of ``items`` texts takes."""
+        mock = self._mock
+        base = mock.latency_ms / 1000.0
+        if base > 0:
+            with self._rng_lock:
+                if mock.latency_dist == "uniform":
+                    spread = base * mock.latency_jitter
+                    base = self._rng.uniform(base - spread, base + spread)
+                elif mock.latency_dist == "exponential":
+                    base = self._rng.expovariate(1.0 / base)
+                elif mock.latency_dist == "lognormal":
+                    base = base * self._rng.lognormvariate(0.0, mock.latency_jitter)
+        return max(0.0, base) + items * mock.latency_per_item_ms / 1000.0
+
+    def _admit(self, items: int) -> float:
+        """Count the call, raise an injected failure, or return its latency."""
+        self.calls += 1
+        mock = self._mock
+        if mock.max_batch_size and items > mock.max_batch_size:
+            raise PermanentProviderError(
+                f"Batch of {items} exceeds mock max_batch_size={mock.max_batch_size}"
+            )
+        draw = self._draw()
+        if draw < mock.rate_limit_rate:
+            self.throttled += 1
+            raise TransientProviderError(
+                "429 mock rate limit", retry_after=mock.retry_after
+            )
+        if draw < mock.rate_limit_rate + mock.unavailable_rate:
+            self.throttled += 1
+            raise TransientProviderError("503 mock unavailable")
+        self.items += items
+        return self._latency(items)
+
+    # --- embed ---
+
+    def _vectors(self, texts: Sequence[str]) -> List[List[float]]:
+        if self._capability != "embedding":
+            raise PermanentProviderError("Mock rewrite provider cannot embed")
+        return [mock_vector(text, self._dim) for text in texts]
+
+    def embed(self, text: str) -> List[float]:
+        vectors = self.embed_batch([text])
+        return vectors[0] if vectors else []
+
+    def embed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        time.sleep(self._admit(len(texts)))
+        return self._vectors(texts)
+
+    async def aembed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        await asyncio.sleep(self._admit(len(texts)))
+        return self._vectors(texts)
+
+    # --- rewrite ---
+
+    def rewrite(self, prompt: str) -> str:
+        time.sleep(self._admit(1))
+        return answer_rewrite_prompt(prompt, mock_rewrite)
+
+    async def arewrite(self, prompt: str) -> str:
+        await asyncio.sleep(self._admit(1))
+        return answer_rewrite_prompt(prompt, mock_rewrite)
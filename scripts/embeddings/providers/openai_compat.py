@@ -10,6 +10,15 @@ from .base import LLMProvider, PermanentProviderError, TransientProviderError
 logger = logging.getLogger("llm.openai")
 
 
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
 class OpenAICompatProvider(LLMProvider):
     """Provider wrapping the OpenAI SDK, compatible with any OpenAI-compatible endpoint."""
 
@@ -34,7 +43,12 @@ class OpenAICompatProvider(LLMProvider):
 
         base_url: Optional[str] = config.resolve_base_url(capability)
 
-        self._client = _openai.OpenAI(api_key=api_key, base_url=base_url)
+        # SDK retries are disabled; the caller's rate limiter owns the retry
+        # budget. The async client is shared so calls reuse one pool.
+        self._client = _openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self._aclient = _openai.AsyncOpenAI(
+            api_key=api_key, base_url=base_url, max_retries=0
+        )
 
         if capability == "embedding":
             mc = config.get_embedding_model_config()
@@ -44,7 +58,6 @@ class OpenAICompatProvider(LLMProvider):
             mc = config.get_rewrite_model_config()
             self._model = mc.name
             self._temperature = mc.temperature
-            self._max_retries = mc.max_retries
 
         logger.debug(
             "OpenAICompatProvider(%s): model=%s, base_url=%s",
@@ -57,7 +70,7 @@ class OpenAICompatProvider(LLMProvider):
         """Map OpenAI SDK errors to provider-agnostic error types."""
         openai = self._openai
         if isinstance(exc, openai.RateLimitError):
-            return TransientProviderError(str(exc))
+            return TransientProviderError(str(exc), retry_after=_retry_after(exc))
         if isinstance(exc, openai.APIConnectionError):
             return TransientProviderError(str(exc))
         if isinstance(exc, openai.AuthenticationError):
@@ -66,7 +79,7 @@ class OpenAICompatProvider(LLMProvider):
             return PermanentProviderError(str(exc))
         if isinstance(exc, openai.APIStatusError):
             if exc.status_code in {429, 502, 503}:
-                return TransientProviderError(str(exc))
+                return TransientProviderError(str(exc), retry_after=_retry_after(exc))
             return PermanentProviderError(str(exc))
         return PermanentProviderError(str(exc))
 
@@ -91,6 +104,21 @@ class OpenAICompatProvider(LLMProvider):
         self._validate_dims(vectors)
         return vectors
 
+    async def aembed_batch(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        try:
+            response = await self._aclient.embeddings.create(
+                input=list(texts),
+                model=self._model,
+            )
+        except Exception as exc:
+            raise self._map_error(exc) from exc
+
+        vectors = [item.embedding for item in response.data]
+        self._validate_dims(vectors)
+        return vectors
+
     def _validate_dims(self, vectors: List[List[float]]) -> None:
         for v in vectors:
             if len(v) != self._dim:
@@ -110,7 +138,26 @@ class OpenAICompatProvider(LLMProvider):
         except Exception as exc:
             raise self._map_error(exc) from exc
 
+        return self._extract_text(response)
+
+    async def arewrite(self, prompt: str) -> str:
+        try:
+            response = await self._aclient.chat.completions.create(
+                model=self._model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=self._temperature,
+            )
+        except Exception as exc:
+            raise self._map_error(exc) from exc
+
+        return self._extract_text(response)
+
+    @staticmethod
+    def _extract_text(response: Any) -> str:
         choice = response.choices[0] if response.choices else None
         if choice and choice.message and choice.message.content:
             return choice.message.content
         return ""
+
+    async def aclose(self) -> None:
+        await self._aclient.close()
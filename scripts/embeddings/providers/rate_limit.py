@@ -0,0 +1,212 @@
+"""Adaptive RPM/TPM rate control with a single retry budget per call."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Sequence, TypeVar
+
+from .base import TransientProviderError
+
+logger = logging.getLogger("llm.rate_limit")
+
+T = TypeVar("T")
+
+# Rough chars-per-token ratio used to charge the TPM bucket before a call.
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(texts: Sequence[str]) -> int:
+    return max(1, sum(len(t) for t in texts) // _CHARS_PER_TOKEN)
+
+
+class _Bucket:
+    """Token bucket holding up to one minute of budget."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, scale: float) -> None:
+        self.level = min(
+            self.capacity,
+            self.level + (now - self.updated) * self.capacity * scale / 60.0,
+        )
+        self.updated = now
+
+    def wait_time(self, cost: float, scale: float) -> float:
+        deficit = min(cost, self.capacity) - self.level
+        if deficit <= 0:
+            return 0.0
+        return deficit * 60.0 / (self.capacity * scale)
+
+
+class AdaptiveRateLimiter:
+    """Paces provider calls against RPM/TPM budgets and adapts to throttling.
+
+    Each call waits for a concurrency slot plus request/token budget. On a
+    :class:`TransientProviderError` (429/503, connection drops) the refill
+    rate and the concurrency window are halved (at most once per
+    ``decrease_interval``) and every caller pauses for a shared backoff,
+    honouring ``retry_after`` when the provider sent one. Successes grow both
+    back additively. A call makes at most ``max_retries`` attempts in total
+    (the first one included), which is the only retry layer between the
+    pipeline and the SDK.
+
+    ``rpm``/``tpm``/``max_concurrency`` of 0 mean unlimited.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 0,
+        max_retries: int = 3,
+        min_scale: float = 0.05,
+        increase_step: float = 0.05,
+        decrease_interval: float = 2.0,
+        max_backoff: float = 60.0,
+    ):
+        self.name = name
+        self.max_retries = max(1, max_retries)
+        self.max_concurrency = max(0, max_concurrency)
+        self.min_scale = min_scale
+        self.increase_step = increase_step
+        self.decrease_interval = decrease_interval
+        self.max_backoff = max_backoff
+        self._requests = _Bucket(rpm) if rpm > 0 else None
+        self._tokens = _Bucket(tpm) if tpm > 0 else None
+        self.scale = 1.0
+        self.window = float(self.max_concurrency) if self.max_concurrency else 0.0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._streak = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+
+    @classmethod
+    def from_model_config(
+        cls, name: str, model_config: Any, max_concurrency: int = 0
+    ) -> "AdaptiveRateLimiter":
+        return cls(
+            name,
+            rpm=getattr(model_config, "rpm", 0),
+            tpm=getattr(model_config, "tpm", 0),
+            max_concurrency=max_concurrency,
+            max_retries=getattr(model_config, "max_retries", 3),
+        )
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "scale": round(self.scale, 3),
+            "window": round(self.window, 2) if self.window else None,
+        }
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _wait_time(self, now: float, cost: int) -> Optional[float]:
+        """Seconds to wait before a call may start; None = wait for a release."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.window and self._in_flight >= max(1, int(self.window)):
+            return None
+        wait = 0.0
+        for bucket, amount in ((self._requests, 1), (self._tokens, cost)):
+            if bucket is not None:
+                bucket.refill(now, self.scale)
+                wait = max(wait, bucket.wait_time(amount, self.scale))
+        return wait
+
+    async def _acquire(self, cost: int) -> None:
+        cond = self._condition()
+        async with cond:
+            while True:
+                wait = self._wait_time(time.monotonic(), cost)
+                if wait == 0.0:
+                    break
+                try:
+                    await asyncio.wait_for(cond.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            for bucket, amount in ((self._requests, 1), (self._tokens, cost)):
+                if bucket is not None:
+                    bucket.level -= min(amount, bucket.capacity)
+            self._in_flight += 1
+
+    async def _release(self, outcome: str, retry_after: Optional[float] = None) -> None:
+        """Return a slot; ``outcome`` is "ok", "throttled" or "error"."""
+        cond = self._condition()
+        async with cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if outcome == "throttled":
+                self.throttled += 1
+                self._streak += 1
+                if now - self._last_decrease >= self.decrease_interval:
+                    self._last_decrease = now
+                    self.scale = max(self.min_scale, self.scale * 0.5)
+                    if self.window:
+                        self.window = max(1.0, self.window * 0.5)
+                backoff = retry_after
+                if backoff is None:
+                    backoff = min(self.max_backoff, 2.0**self._streak)
+                    backoff *= random.uniform(0.5, 1.0)
+                self._paused_until = max(self._paused_until, now + backoff)
+                logger.warning(
+                    "%s throttled: scale=%.2f window=%s, pausing %.1fs",
+                    self.name,
+                    self.scale,
+                    round(self.window, 1) if self.window else "-",
+                    backoff,
+                )
+            elif outcome == "ok":
+                self._streak = 0
+                self.scale = min(1.0, self.scale + self.increase_step)
+                if self.window:
+                    self.window = min(
+                        float(self.max_concurrency), self.window + 1.0 / self.window
+                    )
+            cond.notify_all()
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        cost: int = 1,
+        timeout: Optional[float] = None,
+    ) -> T:
+        """Run ``fn()`` under the budget, retrying transient failures."""
+        attempt = 0
+        while True:
+            await self._acquire(cost)
+            self.calls += 1
+            try:
+                if timeout:
+                    result = await asyncio.wait_for(fn(), timeout=timeout)
+                else:
+                    result = await fn()
+            except TransientProviderError as exc:
+                await self._release("throttled", exc.retry_after)
+                if attempt + 1 >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                continue
+            except BaseException:
+                await self._release("error")
+                raise
+            await self._release("ok")
+            return result
@@ -0,0 +1,221 @@
+"""Quantized first-pass KNN (int8 / binary) with float32 rerank."""
+
+from __future__ import annotations
+
+import sqlite3
+from typing import List, Optional, Sequence, Tuple
+
+from utils.config import ConfigManager
+from utils.database import QUANTIZATION_MODES, EmbeddingDatabaseManager
+from utils.logger import get_database_logger
+
+from .storage import _MAX_KNN_K, serialize_vector
+
+logger = get_database_logger()
+
+# Column type and quantizer expression per mode; the same expression is
+# applied to stored vectors and to the query so both sides share one space.
+_MODE_SQL = {
+    "int8": ("int8", "vec_quantize_int8({}, 'unit')"),
+    "binary": ("bit", "vec_quantize_binary({})"),
+}
+
+
+class QuantizedIndex:
+    """Shadow vec0 table holding quantized copies of ``vec_embeddings``.
+
+    The first pass scans only the quantized column; the float32 vector rides
+    along as a vec0 auxiliary column (stored outside the scanned chunks) so
+    the shortlisted rows are reranked by exact L2 distance in the same query.
+    ``refresh`` syncs rows whose ``problem_embeddings.updated_at`` reached the
+    stored watermark and falls back to a full requantize when counts drift.
+    """
+
+    def __init__(
+        self,
+        db: EmbeddingDatabaseManager,
+        dim: int,
+        mode: str,
+        rerank_factor: int = 8,
+    ):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Invalid quantization '{mode}', "
+                f"must be one of: {', '.join(QUANTIZATION_MODES)}"
+            )
+        if mode == "binary" and dim % 8:
+            raise ValueError("binary quantization requires dim divisible by 8")
+        self.db = db
+        self.dim = dim
+        self.mode = mode
+        self.rerank_factor = max(1, rerank_factor)
+        self.table = f"vec_quantized_{mode}"
+        self._column_type, self._quantize = _MODE_SQL[mode]
+        self._ensure_table()
+
+    @classmethod
+    def from_config(
+        cls, config: ConfigManager, db: EmbeddingDatabaseManager
+    ) -> Optional["QuantizedIndex"]:
+        similar_config = config.get_similar_config()
+        if similar_config.quantization == "none":
+            return None
+        return cls(
+            db,
+            config.get_embedding_model_config().dim,
+            similar_config.quantization,
+            rerank_factor=similar_config.rerank_factor,
+        )
+
+    def _ensure_table(self) -> None:
+        self.db.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING vec0(
+                source TEXT partition key,
+                problem_id TEXT,
+                embedding {self._column_type}[{self.dim}],
+                +full_embedding BLOB
+            )
+            """,
+            commit=True,
+        )
+
+    # --- refresh ---
+
+    def _state_sync(self) -> Tuple[Optional[str], int]:
+        row = self.db.execute(
+            "SELECT watermark, db_rows FROM vec_index_state WHERE name = ?",
+            (self.table,),
+            fetchone=True,
+        )
+        return (row[0], int(row[1])) if row else (None, -1)
+
+    def _requantize(self, conn: sqlite3.Connection, where: str, params: tuple) -> int:
+        cursor = conn.execute(
+            f"""
+            INSERT INTO {self.table}(source, problem_id, embedding, full_embedding)
+            SELECT source, problem_id, {self._quantize.format("embedding")}, embedding
+            FROM vec_embeddings {where}
+            """,
+            params,
+        )
+        return cursor.rowcount
+
+    def refresh(self, chunk_size: int = 500) -> bool:
+        """Sync the quantized table with ``vec_embeddings``; returns True if it changed."""
+        row = self.db.execute(
+            # Separate subqueries so MAX() is an index lookup, not a scan.
+            """
+            SELECT (SELECT MAX(updated_at) FROM problem_embeddings),
+                   (SELECT COUNT(*) FROM problem_embeddings)
+            """,
+            fetchone=True,
+        )
+        watermark, db_rows = (row[0], int(row[1])) if row else (None, 0)
+        old_watermark, old_rows = self._state_sync()
+        if watermark == old_watermark and db_rows == old_rows:
+            return False
+
+        changed = []
+        if old_watermark is not None:
+            changed = (
+                self.db.execute(
+                    """
+                    SELECT source, problem_id FROM problem_embeddings
+                    WHERE updated_at >= ?
+                    """,
+                    (old_watermark,),
+                    fetchall=True,
+                )
+                or []
+            )
+
+        with self.db.transaction() as conn:
+            full = old_watermark is None
+            if not full:
+                by_source: dict = {}
+                for src, pid in changed:
+                    by_source.setdefault(src, []).append(pid)
+                for src, pids in by_source.items():
+                    for start in range(0, len(pids), chunk_size):
+                        chunk = pids[start : start + chunk_size]
+                        placeholders = ", ".join("?" for _ in chunk)
+                        where = f"WHERE source = ? AND problem_id IN ({placeholders})"
+                        conn.execute(f"DELETE FROM {self.table} {where}", (src, *chunk))
+                        self._requantize(conn, where, (src, *chunk))
+                counts = conn.execute(
+                    f"""
+                    SELECT (SELECT COUNT(*) FROM {self.table}),
+                           (SELECT COUNT(*) FROM vec_embeddings)
+                    """
+                ).fetchone()
+                # Deleted problems leave the counts out of step;
+                # requantizing is cheaper than diffing keys.
+                full = counts[0] != counts[1]
+            if full:
+                conn.execute(f"DELETE FROM {self.table}")
+                self._requantize(conn, "", ())
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO vec_index_state (name, watermark, db_rows)
+                VALUES (?, ?, ?)
+                """,
+                (self.table, watermark, db_rows),
+            )
+        logger.info(
+            f"Quantized index {self.table} refreshed "
+            f"({'full' if full else f'{len(changed)} rows'})"
+        )
+        return True
+
+    # --- search ---
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        source: Optional[str],
+        top_k: int,
+        min_similarity: float,
+    ) -> List[dict]:
+        if top_k <= 0:
+            return []
+        query_blob = serialize_vector(query_embedding)
+        k = min(top_k * self.rerank_factor, _MAX_KNN_K)
+        match = self._quantize.format("?")
+        if source is None:
+            rows = self.db.execute(
+                f"""
+                SELECT source, problem_id, vec_distance_l2(full_embedding, ?)
+                FROM {self.table}
+                WHERE embedding MATCH {match}
+                  AND k = ?
+                """,
+                (query_blob, query_blob, k),
+                fetchall=True,
+            )
+        else:
+            rows = self.db.execute(
+                f"""
+                SELECT source, problem_id, vec_distance_l2(full_embedding, ?)
+                FROM {self.table}
+                WHERE embedding MATCH {match}
+                  AND k = ?
+                  AND source = ?
+                """,
+                (query_blob, query_blob, k, source),
+                fetchall=True,
+            )
+        results: List[dict] = []
+        for src, problem_id, distance in sorted(rows or [], key=lambda r: r[2]):
+            similarity = 1 - distance
+            if similarity < min_similarity or len(results) >= top_k:
+                break
+            results.append(
+                {
+                    "source": src,
+                    "problem_id": problem_id,
+                    "distance": distance,
+                    "similarity": similarity,
+                }
+            )
+        return results
@@ -0,0 +1,306 @@
+"""Two-tier cache for query rewrites and embeddings (in-process LRU + SQLite)."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from utils.config import ConfigManager
+from utils.database import EmbeddingDatabaseManager
+from utils.logger import get_database_logger
+
+from .rewriter import REWRITE_PROMPT_VERSION
+from .storage import deserialize_vector, serialize_vector
+
+logger = get_database_logger()
+
+# Persistent-tier trimming runs once per this many inserts.
+_TRIM_EVERY = 64
+
+
+@dataclass
+class CachedQuery:
+    rewritten: str
+    embedding: List[float]
+    created_at: float
+
+
+def normalize_query(query: str) -> str:
+    """Fold case, width and whitespace so trivially different queries share a key."""
+    text = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(text.split())
+
+
+class QueryEmbeddingCache:
+    """Caches ``(rewritten, embedding)`` per normalized query text.
+
+    Entries are scoped to the rewrite model and prompt version and the
+    embedding model/dim, so a model switch or a prompt change never serves
+    stale vectors. Both tiers honour ``ttl_secs``;
+    the memory tier holds at most ``max_entries`` items and the SQLite tier is
+    trimmed back to ``max_rows`` every few inserts, least recently used first.
+    """
+
+    def __init__(
+        self,
+        db: Optional[EmbeddingDatabaseManager],
+        rewrite_model: str,
+        embedding_model: str,
+        dim: int,
+        prompt_version: int = REWRITE_PROMPT_VERSION,
+        max_entries: int = 1024,
+        max_rows: int = 50000,
+        ttl_secs: int = 604800,
+    ):
+        self.db = db
+        self.rewrite_model = rewrite_model
+        self.embedding_model = embedding_model
+        self.dim = dim
+        self.prompt_version = prompt_version
+        self.max_entries = max(0, max_entries)
+        self.max_rows = max(0, max_rows)
+        self.ttl_secs = ttl_secs
+        self._memory: OrderedDict[str, CachedQuery] = OrderedDict()
+        self._puts = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        if self.db is not None:
+            self._ensure_table()
+
+    @classmethod
+    def from_config(
+        cls, config: ConfigManager, db: Optional[EmbeddingDatabaseManager]
+    ) -> Optional["QueryEmbeddingCache"]:
+        similar_config = config.get_similar_config()
+        if not similar_config.query_cache:
+            return None
+        embedding_config = config.get_embedding_model_config()
+        return cls(
+            db,
+            config.get_rewrite_model_config().name,
+            embedding_config.name,
+            embedding_config.dim,
+            prompt_version=REWRITE_PROMPT_VERSION,
+            max_entries=similar_config.query_cache_size,
+            max_rows=similar_config.query_cache_max_rows,
+            ttl_secs=similar_config.query_cache_ttl_secs,
+        )
+
+    def _ensure_table(self) -> None:
+        columns = {
+            row[1]
+            for row in self.db.execute(
+                "PRAGMA table_info(query_embedding_cache)", fetchall=True
+            )
+            or []
+        }
+        if columns and "prompt_version" not in columns:
+            # Rows from before prompt versions were keyed may come from any
+            # prompt; the cache refills on demand.
+            logger.info("Dropping query_embedding_cache rows without prompt_version")
+            self.db.execute("DROP TABLE query_embedding_cache", commit=True)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_embedding_cache (
+                query_hash TEXT NOT NULL,
+                rewrite_model TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                embedding_model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                query_text TEXT NOT NULL,
+                rewritten TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (
+                    query_hash, rewrite_model, prompt_version, embedding_model, dim
+                )
+            )
+            """,
+            commit=True,
+        )
+        self.db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_query_embedding_cache_last_used
+            ON query_embedding_cache (last_used_at)
+            """,
+            commit=True,
+        )
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_secs > 0 and now - created_at > self.ttl_secs
+
+    def _remember(self, key: str, entry: CachedQuery) -> None:
+        if self.max_entries == 0:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _key_params(self, key: str) -> Tuple[str, str, int, str, int]:
+        return (
+            key,
+            self.rewrite_model,
+            self.prompt_version,
+            self.embedding_model,
+            self.dim,
+        )
+
+    def _get_sync(self, key: str, now: float) -> Optional[CachedQuery]:
+        row = self.db.execute(
+            """
+            SELECT rewritten, embedding, created_at
+            FROM query_embedding_cache
+            WHERE query_hash = ? AND rewrite_model = ? AND prompt_version = ?
+              AND embedding_model = ? AND dim = ?
+            """,
+            self._key_params(key),
+            fetchone=True,
+        )
+        if not row:
+            return None
+        if self._expired(row[2], now):
+            self.db.execute(
+                """
+                DELETE FROM query_embedding_cache
+                WHERE query_hash = ? AND rewrite_model = ? AND prompt_version = ?
+                  AND embedding_model = ? AND dim = ?
+                """,
+                self._key_params(key),
+                commit=True,
+            )
+            return None
+        self.db.execute(
+            """
+            UPDATE query_embedding_cache
+            SET last_used_at = ?, hit_count = hit_count + 1
+            WHERE query_hash = ? AND rewrite_model = ? AND prompt_version = ?
+              AND embedding_model = ? AND dim = ?
+            """,
+            (now, *self._key_params(key)),
+            commit=True,
+        )
+        return CachedQuery(row[0], list(deserialize_vector(row[1])), row[2])
+
+    def _put_sync(
+        self, key: str, query_text: str, entry: CachedQuery, trim: bool
+    ) -> None:
+        self.db.execute(
+            """
+            INSERT OR REPLACE INTO query_embedding_cache (
+                query_hash, rewrite_model, prompt_version, embedding_model, dim,
+                query_text, rewritten, embedding, created_at, last_used_at,
+                hit_count
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+            """,
+            (
+                *self._key_params(key),
+                query_text,
+                entry.rewritten,
+                serialize_vector(entry.embedding),
+                entry.created_at,
+                entry.created_at,
+            ),
+            commit=True,
+        )
+        if trim:
+            self._trim_sync(entry.created_at)
+
+    def _trim_sync(self, now: float) -> None:
+        if self.ttl_secs > 0:
+            self.db.execute(
+                "DELETE FROM query_embedding_cache WHERE created_at < ?",
+                (now - self.ttl_secs,),
+                commit=True,
+            )
+        row = self.db.execute(
+            "SELECT COUNT(*) FROM query_embedding_cache", fetchone=True
+        )
+        excess = (int(row[0]) if row else 0) - self.max_rows
+        if excess > 0:
+            self.db.execute(
+                """
+                DELETE FROM query_embedding_cache WHERE rowid IN (
+                    SELECT rowid FROM query_embedding_cache
+                    ORDER BY last_used_at ASC LIMIT ?
+                )
+                """,
+                (excess,),
+                commit=True,
+            )
+
+    async def get(self, query: str) -> Optional[CachedQuery]:
+        key = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if not self._expired(entry.created_at, now):
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+            del self._memory[key]
+        if self.db is not None:
+            try:
+                entry = await asyncio.to_thread(self._get_sync, key, now)
+            except Exception as exc:
+                logger.warning("Query cache lookup failed: %s", exc)
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                self.db_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    async def put(self, query: str, rewritten: str, embedding: List[float]) -> None:
+        if not rewritten or not embedding:
+            return
+        normalized = normalize_query(query)
+        key = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        entry = CachedQuery(rewritten, list(embedding), time.time())
+        self._remember(key, entry)
+        if self.db is None:
+            return
+        self._puts += 1
+        trim = self._puts % _TRIM_EVERY == 1
+        try:
+            await asyncio.to_thread(self._put_sync, key, normalized, entry, trim)
+        except Exception as exc:
+            logger.warning("Query cache write failed: %s", exc)
+
+
+async def embed_query(
+    rewriter,
+    generator,
+    query: str,
+    cache: Optional[QueryEmbeddingCache] = None,
+) -> Tuple[str, List[float]]:
+    """Rewrite and embed a user query, consulting ``cache`` first."""
+    if cache is not None:
+        hit = await cache.get(query)
+        if hit is not None:
+            return hit.rewritten, hit.embedding
+    rewritten = await rewriter.rewrite(query)
+    embedding = await generator.embed(rewritten)
+    if cache is not None:
+        await cache.put(query, rewritten, embedding)
+    return rewritten, embedding
@@ -3,15 +3,24 @@
 from __future__ import annotations
 
 import asyncio
-from concurrent.futures import Executor
-from typing import Optional
-
-from embeddings.providers import create_provider
+import hashlib
+import json
+from typing import Dict, List, Sequence, Union
+
+from embeddings.providers import (
+    PermanentProviderError,
+    TransientProviderError,
+    create_provider,
+)
+from embeddings.providers.rate_limit import AdaptiveRateLimiter, estimate_tokens
 from utils.config import ConfigManager, RewriteModelConfig, get_config
 from utils.logger import get_llm_logger
 
 logger = get_llm_logger()
 
+# Bump whenever REWRITE_PROMPT changes so cached rewrites are not reused.
+REWRITE_PROMPT_VERSION = 1
+
 REWRITE_PROMPT = """Role: Competitive Programming Problem Simplifier
 
 Task: Rewrite the given problem statement into its core algorithmic essence. The output must be concise,
@@ -47,29 +56,53 @@ Input Statement:
 """
 
 
+# Same rules as REWRITE_PROMPT, applied to several statements per request.
+BATCH_REWRITE_PROMPT = (
+    REWRITE_PROMPT.split("Input Statement:")[0]
+    + """Batch Mode:
+
+The input is a JSON array of objects with "id" and "statement". Rewrite each statement
+independently following the instructions above. Respond with ONLY a JSON object that maps
+every "id" to its simplified statement (a string). No markdown fences.
+
+Input Statements:
+{STATEMENTS}
+"""
+)
+
+
+def content_hash(text: str) -> str:
+    """Stable key for a normalized problem statement."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
 class EmbeddingRewriter:
     def __init__(self, config: ConfigManager | None = None):
         self.config = config or get_config()
         self.model_config: RewriteModelConfig = self.config.get_rewrite_model_config()
         self._provider = create_provider(self.config, "rewrite")
+        # workers caps in-flight rewrites; AIMD shrinks the window on 429/503.
+        self.limiter = AdaptiveRateLimiter.from_model_config(
+            "rewrite", self.model_config, max_concurrency=self.model_config.workers
+        )
 
     def _build_prompt(self, original: str) -> str:
         return REWRITE_PROMPT.format(ORIGINAL=original)
 
     async def rewrite(self, content: str) -> str:
-        return await self.rewrite_with_executor(content, None)
+        """Rewrite ``content`` into its algorithmic core.
 
-    async def rewrite_with_executor(
-        self, content: str, executor: Optional[Executor]
-    ) -> str:
+        ``timeout`` applies to each attempt; transient failures are retried by
+        the rate limiter within ``max_retries``.
+        """
         if not content or not content.strip():
             return ""
         prompt = self._build_prompt(content)
+
         try:
-            return await asyncio.wait_for(
-                asyncio.get_running_loop().run_in_executor(
-                    executor, self._provider.rewrite, prompt
-                ),
+            return await self.limiter.call(
+                lambda: self._provider.arewrite(prompt),
+                cost=estimate_tokens([prompt]),
                 timeout=self.model_config.timeout,
             )
         except asyncio.TimeoutError:
@@ -78,3 +111,106 @@ class EmbeddingRewriter:
                 self.model_config.timeout,
             )
             raise
+
+    async def rewrite_batch(
+        self, contents: Sequence[str]
+    ) -> List[Union[str, BaseException]]:
+        """Rewrite several statements with one request.
+
+        Returns one entry per input: the rewrite, or the exception raised while
+        producing it. Items missing from an unparsable or incomplete response
+        are retried one by one through :meth:`rewrite`.
+        """
+        if len(contents) <= 1:
+            return list(
+                await asyncio.gather(
+                    *(self.rewrite(c) for c in contents), return_exceptions=True
+                )
+            )
+
+        results: List[Union[str, BaseException, None]] = [None] * len(contents)
+        pending = []
+        for index, content in enumerate(contents):
+            if content and content.strip():
+                pending.append(index)
+            else:
+                results[index] = ""
+        statements = [{"id": str(i), "statement": contents[i]} for i in pending]
+        prompt = BATCH_REWRITE_PROMPT.format(
+            STATEMENTS=json.dumps(statements, ensure_ascii=False)
+        )
+        parsed: Dict[str, str] = {}
+        try:
+            response = await self.limiter.call(
+                lambda: self._provider.arewrite(prompt),
+                cost=estimate_tokens([prompt]),
+                timeout=self.model_config.timeout * len(pending),
+            )
+            parsed = _parse_batch_response(response)
+        except (TransientProviderError, asyncio.TimeoutError) as exc:
+            for i in pending:
+                results[i] = exc
+            return results
+        except PermanentProviderError as exc:
+            logger.warning("Batch rewrite of %s failed: %s", len(pending), exc)
+        except Exception as exc:
+            # Unmapped SDK/transport errors: the per-item path below retries
+            # each statement and reports its own failure.
+            logger.warning(
+                "Batch rewrite of %s failed unexpectedly: %s",
+                len(pending),
+                exc,
+                exc_info=True,
+            )
+
+        missing = []
+        for i in pending:
+            text = parsed.get(str(i))
+            if text and text.strip():
+                results[i] = text.strip()
+            else:
+                missing.append(i)
+        if missing:
+            logger.warning(
+                "Batch rewrite returned %s/%s items, rewriting the rest one by one",
+                len(pending) - len(missing),
+                len(pending),
+            )
+            retried = await asyncio.gather(
+                *(self.rewrite(contents[i]) for i in missing), return_exceptions=True
+            )
+            for i, result in zip(missing, retried):
+                results[i] = result
+        return results
+
+    async def aclose(self) -> None:
+        await self._provider.aclose()
+
+
+def _parse_batch_response(response: object) -> Dict[str, str]:
+    """Extract ``{id: rewrite}`` from a batch response; ``{}`` if unparsable."""
+    if not isinstance(response, str):
+        return {}
+    text = response.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            return {}
+        try:
+            data = json.loads(text[start : end + 1])
+        except json.JSONDecodeError:
+            return {}
+    if isinstance(data, list):
+        data = {
+            str(item.get("id")): item.get("statement") or item.get("rewrite")
+            for item in data
+            if isinstance(item, dict)
+        }
+    if not isinstance(data, dict):
+        return {}
+    return {str(k): v for k, v in data.items() if isinstance(v, str)}
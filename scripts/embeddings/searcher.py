@@ -3,7 +3,10 @@
 from __future__ import annotations
 
 import asyncio
-from typing import List, Optional
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from utils.database import EmbeddingDatabaseManager
 from utils.logger import get_database_logger
@@ -12,11 +15,31 @@ from .storage import EmbeddingStorage
 
 logger = get_database_logger()
 
+ProblemKey = Tuple[str, str]
+
+# Extra candidates fetched per result when duplicates are collapsed.
+_COLLAPSE_OVER_FETCH = 2
+
 
 class SimilaritySearcher:
-    def __init__(self, db: EmbeddingDatabaseManager, storage: EmbeddingStorage):
+    def __init__(
+        self,
+        db: EmbeddingDatabaseManager,
+        storage: EmbeddingStorage,
+        metadata_cache_size: int = 0,
+        metadata_cache_ttl_secs: int = 3600,
+        collapse_duplicates: bool = False,
+    ):
         self.db = db
         self.storage = storage
+        # Keep one result per canonical problem (see DuplicateTable).
+        self.collapse_duplicates = collapse_duplicates
+        # Optional (source, id) -> problem info LRU for long-lived processes.
+        self.metadata_cache_size = max(0, metadata_cache_size)
+        self.metadata_cache_ttl_secs = metadata_cache_ttl_secs
+        self._metadata_cache: OrderedDict[ProblemKey, Tuple[float, dict]] = (
+            OrderedDict()
+        )
 
     def _get_problem_info_sync(self, source: str, problem_id: str) -> Optional[dict]:
         if problem_id is None:
@@ -41,6 +64,105 @@ class SimilaritySearcher:
     async def get_problem_info(self, source: str, problem_id: str) -> Optional[dict]:
         return await asyncio.to_thread(self._get_problem_info_sync, source, problem_id)
 
+    def _get_problem_infos_sync(
+        self, keys: Sequence[ProblemKey]
+    ) -> Dict[ProblemKey, dict]:
+        by_source: Dict[str, List[str]] = {}
+        for source, problem_id in keys:
+            by_source.setdefault(source, []).append(problem_id)
+        if not by_source:
+            return {}
+        clauses = []
+        params: list = []
+        for source, ids in by_source.items():
+            clauses.append(f"(source = ? AND id IN ({', '.join('?' for _ in ids)}))")
+            params.append(source)
+            params.extend(ids)
+        rows = self.db.execute(
+            f"SELECT source, id, title, difficulty, link FROM problems WHERE {' OR '.join(clauses)}",
+            tuple(params),
+            fetchall=True,
+        )
+        return {
+            (row[0], str(row[1])): {
+                "id": row[1],
+                "title": row[2],
+                "difficulty": row[3],
+                "link": row[4],
+            }
+            for row in rows or []
+        }
+
+    async def get_problem_infos(
+        self, keys: Sequence[ProblemKey]
+    ) -> Dict[ProblemKey, dict]:
+        """Fetch title/difficulty/link for many problems in one query."""
+        found: Dict[ProblemKey, dict] = {}
+        missing: List[ProblemKey] = []
+        now = time.monotonic()
+        for key in dict.fromkeys(keys):
+            cached = self._metadata_cache.get(key)
+            if cached and now - cached[0] <= self.metadata_cache_ttl_secs:
+                self._metadata_cache.move_to_end(key)
+                found[key] = cached[1]
+            else:
+                missing.append(key)
+        if missing:
+            fetched = await asyncio.to_thread(self._get_problem_infos_sync, missing)
+            found.update(fetched)
+            if self.metadata_cache_size:
+                for key, info in fetched.items():
+                    self._metadata_cache[key] = (now, info)
+                    self._metadata_cache.move_to_end(key)
+                while len(self._metadata_cache) > self.metadata_cache_size:
+                    self._metadata_cache.popitem(last=False)
+        return found
+
+    def _get_canonical_keys_sync(
+        self, keys: Sequence[ProblemKey]
+    ) -> Dict[ProblemKey, ProblemKey]:
+        by_source: Dict[str, List[str]] = {}
+        for source, problem_id in keys:
+            by_source.setdefault(source, []).append(problem_id)
+        if not by_source:
+            return {}
+        clauses = []
+        params: list = []
+        for source, ids in by_source.items():
+            clauses.append(
+                f"(source = ? AND problem_id IN ({', '.join('?' for _ in ids)}))"
+            )
+            params.append(source)
+            params.extend(ids)
+        try:
+            rows = self.db.execute(
+                f"""
+                SELECT source, problem_id, canonical_source, canonical_id
+                FROM problem_duplicates WHERE {" OR ".join(clauses)}
+                """,
+                tuple(params),
+                fetchall=True,
+            )
+        except sqlite3.OperationalError:
+            return {}  # table not created yet
+        return {(row[0], row[1]): (row[2], row[3]) for row in rows or []}
+
+    async def collapse(self, results: List[dict], top_k: int) -> List[dict]:
+        """Drop results whose canonical problem already appeared higher up."""
+        keys = [(r["source"], str(r["problem_id"])) for r in results]
+        canonical = await asyncio.to_thread(self._get_canonical_keys_sync, keys)
+        seen: set = set()
+        collapsed: List[dict] = []
+        for key, result in zip(keys, results):
+            group = canonical.get(key, key)
+            if group in seen:
+                continue
+            seen.add(group)
+            collapsed.append(result)
+            if len(collapsed) == top_k:
+                break
+        return collapsed
+
     async def search(
         self,
         query_embedding: List[float],
@@ -48,16 +170,20 @@ class SimilaritySearcher:
         top_k: int,
         min_similarity: float,
     ) -> List[dict]:
+        fetch_k = top_k * _COLLAPSE_OVER_FETCH if self.collapse_duplicates else top_k
         results = await self.storage.search_similar(
-            query_embedding, source, top_k, min_similarity
+            query_embedding, source, fetch_k, min_similarity
         )
+        if results and self.collapse_duplicates:
+            results = await self.collapse(results, top_k)
         if not results:
             return []
 
-        enriched: List[dict] = []
+        infos = await self.get_problem_infos(
+            [(result["source"], str(result["problem_id"])) for result in results]
+        )
         for result in results:
-            info = await self.get_problem_info(result["source"], result["problem_id"])
+            info = infos.get((result["source"], str(result["problem_id"])))
             if info:
                 result.update(info)
-            enriched.append(result)
-        return enriched
+        return results
@@ -0,0 +1,251 @@
+"""Resident embed-text server speaking newline-delimited JSON.
+
+Each request line is ``{"id": ..., "text": "..."}``; each response line echoes
+the ``id`` and carries either ``embedding``/``rewritten`` (same shape as
+``embedding_cli.py --embed-text``) or ``error``. ``{"id": ..., "cmd": "stats"}``
+returns queue depth, query-cache hit/miss and embed coalescing counters. Responses may be returned out
+of order, so clients pipelining requests must match on ``id``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import os
+import signal
+import stat
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logger import get_llm_logger
+
+from .generator import EmbeddingGenerator
+from .providers import TransientProviderError
+from .query_cache import QueryEmbeddingCache, embed_query
+from .rewriter import EmbeddingRewriter
+
+logger = get_llm_logger()
+
+# Upper bound for a single request line; queries are capped at 2000 chars upstream.
+_LINE_LIMIT = 1 << 20
+
+
+class _StdoutWriter:
+    """Minimal StreamWriter stand-in for stdout, which may be a regular file."""
+
+    def write(self, data: bytes) -> None:
+        sys.stdout.buffer.write(data)
+
+    async def drain(self) -> None:
+        sys.stdout.buffer.flush()
+
+    def close(self) -> None:
+        with contextlib.suppress(Exception):
+            sys.stdout.buffer.flush()
+
+    async def wait_closed(self) -> None:
+        return None
+
+
+class EmbeddingServer:
+    """Long-lived embed-text worker pool sharing warm provider clients."""
+
+    def __init__(
+        self,
+        rewriter: EmbeddingRewriter,
+        generator: EmbeddingGenerator,
+        workers: int = 4,
+        queue_size: int = 64,
+        cache: Optional[QueryEmbeddingCache] = None,
+    ):
+        self.rewriter = rewriter
+        self.generator = generator
+        self.cache = cache
+        self.workers = max(1, workers)
+        self._queue: asyncio.Queue[Tuple[str, asyncio.Future]] = asyncio.Queue(
+            maxsize=max(1, queue_size)
+        )
+        self._worker_tasks: List[asyncio.Task] = []
+        self._connections: set[Any] = set()
+        self._stop = asyncio.Event()
+
+    async def embed_text(self, text: str) -> Dict[str, Any]:
+        rewritten, embedding = await embed_query(
+            self.rewriter, self.generator, text, self.cache
+        )
+        return {"embedding": embedding, "rewritten": rewritten}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "workers": self.workers,
+            "cache": self.cache.stats if self.cache is not None else None,
+            "embedding": self.generator.stats,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            text, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                result = await self.embed_text(text)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+            finally:
+                self._queue.task_done()
+
+    def _start_workers(self) -> None:
+        if self._worker_tasks:
+            return
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def _stop_workers(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def _handle_line(self, line: bytes) -> Dict[str, Any]:
+        try:
+            payload = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return {"id": None, "error": "invalid_json"}
+        if not isinstance(payload, dict):
+            return {"id": None, "error": "invalid_request"}
+        request_id = payload.get("id")
+        if payload.get("cmd") == "stats":
+            return {"id": request_id, "stats": self.stats}
+        text = payload.get("text")
+        if not isinstance(text, str) or not text.strip():
+            return {"id": request_id, "error": "empty_text"}
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            return {"id": request_id, "error": "server_busy", "transient": True}
+        try:
+            result = await future
+        except TransientProviderError as exc:
+            logger.warning("Embed request %s transient failure: %s", request_id, exc)
+            return {"id": request_id, "error": str(exc), "transient": True}
+        except asyncio.TimeoutError:
+            return {"id": request_id, "error": "rewrite_timeout", "transient": True}
+        except Exception as exc:
+            logger.error("Embed request %s failed: %s", request_id, exc)
+            return {"id": request_id, "error": str(exc)}
+        return {"id": request_id, **result}
+
+    async def _respond(
+        self, line: bytes, writer: Any, write_lock: asyncio.Lock
+    ) -> None:
+        response = await self._handle_line(line)
+        data = (json.dumps(response) + "\n").encode()
+        async with write_lock:
+            writer.write(data)
+            await writer.drain()
+
+    async def _serve_connection(
+        self, reader: asyncio.StreamReader, writer: Any
+    ) -> None:
+        write_lock = asyncio.Lock()
+        pending: set[asyncio.Task] = set()
+        self._connections.add(writer)
+        try:
+            while not self._stop.is_set():
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    logger.warning("Dropping oversized request line")
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self._respond(line, writer, write_lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            for task in pending:
+                task.cancel()
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    def _install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            with contextlib.suppress(NotImplementedError, RuntimeError):
+                loop.add_signal_handler(sig, self._stop.set)
+
+    async def serve_unix(self, path: str) -> None:
+        """Serve on a Unix domain socket until SIGTERM/SIGINT."""
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise FileExistsError(f"{path} exists and is not a socket")
+            os.unlink(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._install_signal_handlers()
+        self._start_workers()
+        server = await asyncio.start_unix_server(
+            self._serve_connection, path=path, limit=_LINE_LIMIT
+        )
+        logger.info(
+            "Embedding server listening on %s (workers=%s, queue=%s)",
+            path,
+            self.workers,
+            self._queue.maxsize,
+        )
+        try:
+            await self._stop.wait()
+        finally:
+            server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await server.wait_closed()
+            await self._stop_workers()
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+            logger.info("Embedding server stopped (%s)", self.stats)
+
+    async def serve_stdio(self) -> None:
+        """Serve requests from stdin, writing responses to stdout, until EOF."""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=_LINE_LIMIT)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+        )
+        self._start_workers()
+        logger.info(
+            "Embedding server reading stdin (workers=%s, queue=%s)",
+            self.workers,
+            self._queue.maxsize,
+        )
+        try:
+            await self._serve_connection(reader, _StdoutWriter())
+        finally:
+            await self._stop_workers()
+            logger.info("Embedding server stopped (%s)", self.stats)
+
+    async def serve(self, socket_path: Optional[str] = None) -> None:
+        if socket_path:
+            await self.serve_unix(socket_path)
+        else:
+            await self.serve_stdio()
@@ -4,28 +4,77 @@ from __future__ import annotations
 
 import asyncio
 import json
-import struct
+import sqlite3
+import sys
+from array import array
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
-from utils.database import EmbeddingDatabaseManager
+from utils.database import METADATA_TABLE, VEC_TABLE, EmbeddingDatabaseManager
 from utils.logger import get_database_logger
 
+if TYPE_CHECKING:
+    from .matrix_index import MatrixIndex
+    from .quantized_index import QuantizedIndex
+
 logger = get_database_logger()
 
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+# vec0 rejects KNN queries with k above this.
+_MAX_KNN_K = 4096
+
+
+def serialize_vector(vector: Sequence[float]) -> bytes:
+    """Pack a vector as little-endian float32, sqlite-vec's native blob format."""
+    if isinstance(vector, (bytes, bytearray)):
+        return bytes(vector)
+    if hasattr(vector, "astype"):
+        return vector.astype("<f4", copy=False).tobytes()
+    buf = array("f", vector)
+    if not _LITTLE_ENDIAN:
+        buf.byteswap()
+    return buf.tobytes()
+
+
+def deserialize_vector(data: bytes) -> Sequence[float]:
+    """View a little-endian float32 blob as a float sequence.
+
+    On little-endian hosts this is a zero-copy ``memoryview`` over ``data``;
+    wrap it with ``numpy.frombuffer(view, dtype="<f4")`` for a NumPy view.
+    """
+    if _LITTLE_ENDIAN:
+        return memoryview(data).cast("f")
+    buf = array("f")
+    buf.frombytes(data)
+    buf.byteswap()
+    return buf
+
 
 class EmbeddingStorage:
-    def __init__(self, db: EmbeddingDatabaseManager):
+    def __init__(
+        self,
+        db: EmbeddingDatabaseManager,
+        search_index: Optional["MatrixIndex | QuantizedIndex"] = None,
+        vec_table: str = VEC_TABLE,
+        meta_table: str = METADATA_TABLE,
+    ):
         self.db = db
+        # Optional alternative KNN backend; see MatrixIndex / IVFIndex /
+        # QuantizedIndex.
+        self.search_index = search_index
+        # The live tables by default; a shadow index version while it is built.
+        self.vec_table = vec_table
+        self.meta_table = meta_table
 
     def _now_iso(self) -> str:
         return datetime.now(timezone.utc).isoformat()
 
     def _get_embedding_meta_sync(self, source: str, problem_id: str) -> Optional[dict]:
         row = self.db.execute(
-            """
+            f"""
             SELECT source, problem_id, rewritten_content, model, dim, updated_at
-            FROM problem_embeddings
+            FROM {self.meta_table}
             WHERE source = ? AND problem_id = ?
             """,
             (source, problem_id),
@@ -47,9 +96,11 @@ class EmbeddingStorage:
             self._get_embedding_meta_sync, source, problem_id
         )
 
-    def _get_vector_sync(self, source: str, problem_id: str) -> Optional[List[float]]:
+    def _get_vector_sync(
+        self, source: str, problem_id: str
+    ) -> Optional[Sequence[float]]:
         row = self.db.execute(
-            "SELECT embedding FROM vec_embeddings WHERE source = ? AND problem_id = ?",
+            f"SELECT embedding FROM {self.vec_table} WHERE source = ? AND problem_id = ?",
             (source, problem_id),
             fetchone=True,
         )
@@ -76,18 +127,17 @@ class EmbeddingStorage:
                     )
                     return None
 
-                # Use little-endian format for cross-platform consistency
-                # struct.unpack supports buffer protocol, works directly with memoryview
-                count = len(data) // 4
-                return list(struct.unpack(f"<{count}f", data))
+                return deserialize_vector(bytes(data))
             else:
                 # JSON string format (legacy)
                 return json.loads(data)
-        except (struct.error, json.JSONDecodeError) as e:
+        except (TypeError, ValueError) as e:
             logger.error(f"Failed to decode vector for {source}:{problem_id}: {e}")
             return None
 
-    async def get_vector(self, source: str, problem_id: str) -> Optional[List[float]]:
+    async def get_vector(
+        self, source: str, problem_id: str
+    ) -> Optional[Sequence[float]]:
         return await asyncio.to_thread(self._get_vector_sync, source, problem_id)
 
     def _get_problem_id_by_slug_sync(self, source: str, slug: str) -> Optional[str]:
@@ -105,9 +155,9 @@ class EmbeddingStorage:
 
     def _get_existing_ids_sync(self, source: str, model: str, dim: int) -> set[str]:
         rows = self.db.execute(
-            """
+            f"""
             SELECT problem_id
-            FROM problem_embeddings
+            FROM {self.meta_table}
             WHERE source = ? AND model = ? AND dim = ?
             """,
             (source, model, dim),
@@ -118,9 +168,40 @@ class EmbeddingStorage:
     async def get_existing_ids(self, source: str, model: str, dim: int) -> set[str]:
         return await asyncio.to_thread(self._get_existing_ids_sync, source, model, dim)
 
+    def _backfill_content_hashes_sync(self, source: str, model: str, dim: int) -> int:
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                f"""
+                UPDATE {self.meta_table}
+                SET content_hash = (
+                    SELECT content_sha256(p.content) FROM problems p
+                    WHERE p.source = {self.meta_table}.source
+                      AND p.id = {self.meta_table}.problem_id
+                )
+                WHERE source = ? AND model = ? AND dim = ? AND content_hash IS NULL
+                  AND EXISTS (
+                    SELECT 1 FROM problems p
+                    WHERE p.source = {self.meta_table}.source
+                      AND p.id = {self.meta_table}.problem_id
+                      AND p.content IS NOT NULL AND p.content != ''
+                  )
+                """,
+                (source, model, dim),
+            )
+            return cursor.rowcount
+
+    async def backfill_content_hashes(self, source: str, model: str, dim: int) -> int:
+        """Stamp the current content hash on rows saved before hashes were recorded.
+
+        Those rows are treated as up to date rather than re-embedded wholesale.
+        """
+        return await asyncio.to_thread(
+            self._backfill_content_hashes_sync, source, model, dim
+        )
+
     def _get_existing_vector_ids_sync(self, source: str) -> set[str]:
         rows = self.db.execute(
-            "SELECT problem_id FROM vec_embeddings WHERE source = ?",
+            f"SELECT problem_id FROM {self.vec_table} WHERE source = ?",
             (source,),
             fetchall=True,
         )
@@ -129,6 +210,108 @@ class EmbeddingStorage:
     async def get_existing_vector_ids(self, source: str) -> set[str]:
         return await asyncio.to_thread(self._get_existing_vector_ids_sync, source)
 
+    def _get_cached_rewrite_sync(
+        self, content_hash: str, model: str, prompt_version: int
+    ) -> Optional[str]:
+        row = self.db.execute(
+            """
+            SELECT rewritten_content
+            FROM rewrite_cache
+            WHERE content_hash = ? AND model = ? AND prompt_version = ?
+            """,
+            (content_hash, model, prompt_version),
+            fetchone=True,
+        )
+        return row[0] if row else None
+
+    async def get_cached_rewrite(
+        self, content_hash: str, model: str, prompt_version: int
+    ) -> Optional[str]:
+        return await asyncio.to_thread(
+            self._get_cached_rewrite_sync, content_hash, model, prompt_version
+        )
+
+    def _record_rewrite_sync(
+        self,
+        source: str,
+        problem_id: str,
+        content_hash: str,
+        text_key: str,
+        model: str,
+        prompt_version: int,
+        rewritten_content: str,
+    ) -> None:
+        now = self._now_iso()
+        with self.db.transaction() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO rewrite_cache (
+                    content_hash, model, prompt_version, rewritten_content, created_at
+                ) VALUES (?, ?, ?, ?, ?)
+                """,
+                (text_key, model, prompt_version, rewritten_content, now),
+            )
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO embedding_journal (
+                    source, problem_id, content_hash, model, prompt_version,
+                    rewritten_content, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    source,
+                    problem_id,
+                    content_hash,
+                    model,
+                    prompt_version,
+                    rewritten_content,
+                    now,
+                ),
+            )
+
+    async def record_rewrite(
+        self,
+        source: str,
+        problem_id: str,
+        content_hash: str,
+        text_key: str,
+        model: str,
+        prompt_version: int,
+        rewritten_content: str,
+    ) -> None:
+        """Cache a build rewrite and journal it until its embedding is saved.
+
+        ``content_hash`` is the hash of the source content (as stored in
+        ``problem_embeddings``); ``text_key`` keys the rewrite cache.
+        """
+        await asyncio.to_thread(
+            self._record_rewrite_sync,
+            source,
+            problem_id,
+            content_hash,
+            text_key,
+            model,
+            prompt_version,
+            rewritten_content,
+        )
+
+    def _get_rewritten_contents_sync(self, source: str) -> dict[str, str]:
+        rows = self.db.execute(
+            f"""
+            SELECT problem_id, rewritten_content
+            FROM {self.meta_table}
+            WHERE source = ? AND rewritten_content IS NOT NULL
+              AND rewritten_content != ''
+            """,
+            (source,),
+            fetchall=True,
+        )
+        return {row[0]: row[1] for row in rows} if rows else {}
+
+    async def get_rewritten_contents(self, source: str) -> dict[str, str]:
+        """Rewrites already stored alongside embeddings (pre-cache rows)."""
+        return await asyncio.to_thread(self._get_rewritten_contents_sync, source)
+
     def _save_embedding_sync(
         self,
         source: str,
@@ -137,25 +320,35 @@ class EmbeddingStorage:
         model: str,
         dim: int,
         embedding: List[float],
+        content_hash: Optional[str] = None,
     ) -> None:
         updated_at = self._now_iso()
         self.db.execute(
-            "DELETE FROM vec_embeddings WHERE source = ? AND problem_id = ?",
+            f"DELETE FROM {self.vec_table} WHERE source = ? AND problem_id = ?",
             (source, problem_id),
             commit=True,
         )
         self.db.execute(
-            "INSERT INTO vec_embeddings(source, problem_id, embedding) VALUES (?, ?, ?)",
-            (source, problem_id, json.dumps(embedding)),
+            f"INSERT INTO {self.vec_table}(source, problem_id, embedding) VALUES (?, ?, ?)",
+            (source, problem_id, serialize_vector(embedding)),
             commit=True,
         )
         self.db.execute(
-            """
-            INSERT OR REPLACE INTO problem_embeddings (
-                source, problem_id, rewritten_content, model, dim, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?)
+            f"""
+            INSERT OR REPLACE INTO {self.meta_table} (
+                source, problem_id, rewritten_content, model, dim, updated_at,
+                content_hash
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            (source, problem_id, rewritten_content, model, dim, updated_at),
+            (
+                source,
+                problem_id,
+                rewritten_content,
+                model,
+                dim,
+                updated_at,
+                content_hash,
+            ),
             commit=True,
         )
 
@@ -167,6 +360,7 @@ class EmbeddingStorage:
         model: str,
         dim: int,
         embedding: List[float],
+        content_hash: Optional[str] = None,
     ) -> None:
         await asyncio.to_thread(
             self._save_embedding_sync,
@@ -176,23 +370,84 @@ class EmbeddingStorage:
             model,
             dim,
             embedding,
+            content_hash,
+        )
+
+    def _save_embeddings_batch_sync(
+        self,
+        source: str,
+        items: Sequence[Tuple[str, str, Sequence[float]]],
+        model: str,
+        dim: int,
+        content_hashes: Optional[Dict[str, str]] = None,
+        chunk_size: int = 500,
+    ) -> None:
+        updated_at = self._now_iso()
+        hashes = content_hashes or {}
+        with self.db.transaction() as conn:
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start : start + chunk_size]
+                placeholders = ", ".join("?" for _ in chunk)
+                chunk_ids = tuple(pid for pid, _, _ in chunk)
+                conn.execute(
+                    f"DELETE FROM {self.vec_table} WHERE source = ? AND problem_id IN ({placeholders})",
+                    (source, *chunk_ids),
+                )
+                conn.execute(
+                    f"DELETE FROM embedding_journal WHERE source = ? AND problem_id IN ({placeholders})",
+                    (source, *chunk_ids),
+                )
+            conn.executemany(
+                f"INSERT INTO {self.vec_table}(source, problem_id, embedding) VALUES (?, ?, ?)",
+                [(source, pid, serialize_vector(emb)) for pid, _, emb in items],
+            )
+            conn.executemany(
+                f"""
+                INSERT OR REPLACE INTO {self.meta_table} (
+                    source, problem_id, rewritten_content, model, dim, updated_at,
+                    content_hash
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (source, pid, rewritten, model, dim, updated_at, hashes.get(pid))
+                    for pid, rewritten, _ in items
+                ],
+            )
+
+    async def save_embeddings_batch(
+        self,
+        source: str,
+        items: Sequence[Tuple[str, str, Sequence[float]]],
+        model: str,
+        dim: int,
+        content_hashes: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Persist ``(problem_id, rewritten_content, embedding)`` items in one transaction.
+
+        ``content_hashes`` maps problem ids to the hash of the source content the
+        rewrite was made from, so later builds can tell which rows went stale.
+        """
+        if not items:
+            return
+        await asyncio.to_thread(
+            self._save_embeddings_batch_sync, source, items, model, dim, content_hashes
         )
 
     def _delete_all_embeddings_sync(self, source: Optional[str] = None) -> None:
         if source:
             self.db.execute(
-                "DELETE FROM problem_embeddings WHERE source = ?",
+                f"DELETE FROM {self.meta_table} WHERE source = ?",
                 (source,),
                 commit=True,
             )
             self.db.execute(
-                "DELETE FROM vec_embeddings WHERE source = ?",
+                f"DELETE FROM {self.vec_table} WHERE source = ?",
                 (source,),
                 commit=True,
             )
             return
-        self.db.execute("DELETE FROM problem_embeddings", commit=True)
-        self.db.execute("DELETE FROM vec_embeddings", commit=True)
+        self.db.execute(f"DELETE FROM {self.meta_table}", commit=True)
+        self.db.execute(f"DELETE FROM {self.vec_table}", commit=True)
 
     async def delete_all_embeddings(self, source: Optional[str] = None) -> None:
         await asyncio.to_thread(self._delete_all_embeddings_sync, source)
@@ -204,22 +459,80 @@ class EmbeddingStorage:
         top_k: int,
         min_similarity: float,
     ) -> List[dict]:
-        over_fetch_k = max(top_k * 4, top_k)
-        rows = self.db.execute(
-            """
-            SELECT source, problem_id, distance
-            FROM vec_embeddings
-            WHERE embedding MATCH ?
-              AND k = ?
-            """,
-            (json.dumps(query_embedding), over_fetch_k),
-            fetchall=True,
-        )
+        source_filter = source if source and source != "all" else None
+        if self.search_index is not None:
+            self.search_index.refresh()
+            return self.search_index.search(
+                query_embedding, source_filter, top_k, min_similarity
+            )
+
+        query_blob = serialize_vector(query_embedding)
+        top_k = min(top_k, _MAX_KNN_K)
+
+        if source_filter is None:
+            rows = self._knn_sync(query_blob, top_k, None)
+            return self._rows_to_results(rows, None, min_similarity)[:top_k]
+
+        # Push the source constraint into vec0 (partition key or metadata
+        # column) so small sources are not crowded out of the KNN window.
+        try:
+            rows = self._knn_sync(query_blob, top_k, source_filter)
+            return self._rows_to_results(rows, None, min_similarity)[:top_k]
+        except sqlite3.OperationalError as e:
+            logger.warning(
+                f"Source filter not supported by vec index, post-filtering: {e}"
+            )
+
+        # Post-filter fallback: widen k until enough rows match, the index is
+        # exhausted, or the remaining rows fall below min_similarity.
+        k = min(top_k * 4, _MAX_KNN_K)
+        while True:
+            rows = self._knn_sync(query_blob, k, None)
+            results = self._rows_to_results(rows, source_filter, min_similarity)
+            if (
+                len(results) >= top_k
+                or len(rows) < k
+                or k >= _MAX_KNN_K
+                or 1 - rows[-1][2] < min_similarity
+            ):
+                return results[:top_k]
+            k = min(k * 2, _MAX_KNN_K)
+
+    def _knn_sync(
+        self, query_blob: bytes, k: int, source: Optional[str]
+    ) -> List[tuple]:
+        if source is None:
+            rows = self.db.execute(
+                f"""
+                SELECT source, problem_id, distance
+                FROM {self.vec_table}
+                WHERE embedding MATCH ?
+                  AND k = ?
+                """,
+                (query_blob, k),
+                fetchall=True,
+            )
+        else:
+            rows = self.db.execute(
+                f"""
+                SELECT source, problem_id, distance
+                FROM {self.vec_table}
+                WHERE embedding MATCH ?
+                  AND k = ?
+                  AND source = ?
+                """,
+                (query_blob, k, source),
+                fetchall=True,
+            )
+        return rows or []
+
+    @staticmethod
+    def _rows_to_results(
+        rows: List[tuple], source: Optional[str], min_similarity: float
+    ) -> List[dict]:
         results: List[dict] = []
-        if not rows:
-            return results
         for src, problem_id, distance in rows:
-            if source and source != "all" and src != source:
+            if source and src != source:
                 continue
             similarity = 1 - distance
             if similarity < min_similarity:
@@ -232,7 +545,7 @@ class EmbeddingStorage:
                     "similarity": similarity,
                 }
             )
-        return results[:top_k]
+        return results
 
     async def search_similar(
         self,
@@ -249,13 +562,46 @@ class EmbeddingStorage:
             min_similarity,
         )
 
+    def _migrate_json_vectors_sync(self, chunk_size: int = 500) -> int:
+        rows = self.db.execute(
+            f"SELECT rowid, embedding FROM {self.vec_table} WHERE typeof(embedding) = 'text'",
+            fetchall=True,
+        )
+        if not rows:
+            return 0
+        converted = 0
+        for start in range(0, len(rows), chunk_size):
+            params = []
+            for rowid, data in rows[start : start + chunk_size]:
+                try:
+                    params.append((serialize_vector(json.loads(data)), rowid))
+                except (TypeError, ValueError) as e:
+                    logger.error(f"Skipping undecodable vector rowid={rowid}: {e}")
+            if params:
+                converted += self.db.executemany(
+                    f"UPDATE {self.vec_table} SET embedding = ? WHERE rowid = ?",
+                    params,
+                    commit=True,
+                )
+        return converted
+
+    async def partition_vec_table(self, dim: int) -> Optional[int]:
+        """Recreate a legacy vec table with ``source`` as partition key; None if already done."""
+        if await asyncio.to_thread(self.db.vec_table_is_partitioned):
+            return None
+        return await asyncio.to_thread(self.db.partition_vec_table, dim)
+
+    async def migrate_json_vectors(self) -> int:
+        """Rewrite JSON-text vectors as float32 blobs in place; returns rows converted."""
+        return await asyncio.to_thread(self._migrate_json_vectors_sync)
+
     def _count_table_sync(
         self,
         table: str,
         source: Optional[str] = None,
         filter_pattern: Optional[str] = None,
     ) -> int:
-        if table not in ("vec_embeddings", "problem_embeddings"):
+        if table not in (self.vec_table, self.meta_table):
             raise ValueError(f"Invalid table name: {table}")
         conditions = []
         params: list = []
@@ -277,12 +623,12 @@ class EmbeddingStorage:
         self, source: Optional[str] = None, filter_pattern: Optional[str] = None
     ) -> int:
         return await asyncio.to_thread(
-            self._count_table_sync, "vec_embeddings", source, filter_pattern
+            self._count_table_sync, self.vec_table, source, filter_pattern
         )
 
     async def count_metadata(
         self, source: Optional[str] = None, filter_pattern: Optional[str] = None
     ) -> int:
         return await asyncio.to_thread(
-            self._count_table_sync, "problem_embeddings", source, filter_pattern
+            self._count_table_sync, self.meta_table, source, filter_pattern
         )
@@ -4,7 +4,7 @@ import sys
 import warnings
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 from urllib.parse import urlparse
 
 if sys.version_info >= (3, 11):
@@ -153,6 +153,11 @@ class ConfigManager:
             dim=section.get("dim", 768),
             task_type=section.get("task_type", "SEMANTIC_SIMILARITY"),
             batch_size=section.get("batch_size", 32),
+            rpm=section.get("rpm", 0),
+            tpm=section.get("tpm", 0),
+            max_retries=section.get("max_retries", 4),
+            coalesce_wait_ms=section.get("coalesce_wait_ms", 5.0),
+            coalesce_max_batch=section.get("coalesce_max_batch", 0),
             api_key=section.get("api_key"),
             base_url=section.get("base_url"),
         )
@@ -165,15 +170,124 @@ class ConfigManager:
             timeout=section.get("timeout", 30),
             max_retries=section.get("max_retries", 2),
             workers=section.get("workers", 4),
+            batch_size=section.get("batch_size", 1),
+            rpm=section.get("rpm", 0),
+            tpm=section.get("tpm", 0),
             api_key=section.get("api_key"),
             base_url=section.get("base_url"),
         )
 
+    def get_mock_provider_config(self, capability: str) -> "MockProviderConfig":
+        """[llm.mock] settings, overridden by [llm.models.<cap>.mock]."""
+        section = dict(self.get("llm.mock", {}))
+        section.update(self.get(f"llm.models.{capability}.mock", {}))
+        dist = section.get("latency_dist", "fixed")
+        if dist not in _MOCK_LATENCY_DISTS:
+            raise ValueError(
+                f"Invalid [llm.mock] latency_dist '{dist}', "
+                f"must be one of: {', '.join(_MOCK_LATENCY_DISTS)}"
+            )
+        return MockProviderConfig(
+            latency_ms=section.get("latency_ms", 0.0),
+            latency_per_item_ms=section.get("latency_per_item_ms", 0.0),
+            latency_dist=dist,
+            latency_jitter=section.get("latency_jitter", 0.5),
+            rate_limit_rate=section.get("rate_limit_rate", 0.0),
+            unavailable_rate=section.get("unavailable_rate", 0.0),
+            retry_after=section.get("retry_after"),
+            max_batch_size=section.get("max_batch_size", 0),
+            seed=section.get("seed", 0),
+        )
+
+    def get_local_provider_config(self) -> "LocalProviderConfig":
+        section = self.get("llm.local", {})
+        ngram_min = section.get("ngram_min", 3)
+        ngram_max = section.get("ngram_max", 5)
+        if not 1 <= ngram_min <= ngram_max:
+            raise ValueError(
+                f"Invalid [llm.local] n-gram range {ngram_min}..{ngram_max}"
+            )
+        idf_path = Path(section.get("idf_path", "data/local_idf.npz"))
+        if not idf_path.is_absolute():
+            idf_path = self.config_path.parent / idf_path
+        return LocalProviderConfig(
+            ngram_min=ngram_min,
+            ngram_max=ngram_max,
+            buckets=section.get("buckets", 1 << 18),
+            density=section.get("density", 8),
+            seed=section.get("seed", 0),
+            idf_path=str(idf_path),
+        )
+
     def get_similar_config(self) -> "SimilarConfig":
         section = self.get("similar", {})
+        backend = section.get("backend", "sqlite-vec")
+        if backend not in _SIMILAR_BACKENDS:
+            raise ValueError(
+                f"Invalid [similar] backend '{backend}', "
+                f"must be one of: {', '.join(_SIMILAR_BACKENDS)}"
+            )
+        quantization = section.get("quantization", "none")
+        if quantization not in _QUANTIZATION_MODES:
+            raise ValueError(
+                f"Invalid [similar] quantization '{quantization}', "
+                f"must be one of: {', '.join(_QUANTIZATION_MODES)}"
+            )
+        index_dir = Path(section.get("index_dir", "data/vec_index"))
+        if not index_dir.is_absolute():
+            index_dir = self.config_path.parent / index_dir
         return SimilarConfig(
             top_k=section.get("top_k", 5),
             min_similarity=section.get("min_similarity", 0.70),
+            query_cache=section.get("query_cache", True),
+            query_cache_size=section.get("query_cache_size", 1024),
+            query_cache_max_rows=section.get("query_cache_max_rows", 50000),
+            query_cache_ttl_secs=section.get("query_cache_ttl_secs", 604800),
+            backend=backend,
+            index_dir=str(index_dir),
+            quantization=quantization,
+            rerank_factor=section.get("rerank_factor", 8),
+            ivf_lists=section.get("ivf_lists", 0),
+            ivf_nprobe=section.get("ivf_nprobe", 16),
+            neighbors_k=section.get("neighbors_k", 50),
+            neighbors_block_mb=section.get("neighbors_block_mb", 256),
+        )
+
+    def get_duplicates_config(self) -> "DuplicatesConfig":
+        section = self.get("duplicates", {})
+        threshold = section.get("threshold", 0.95)
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(
+                f"Invalid [duplicates] threshold {threshold}, must be in (0, 1]"
+            )
+        return DuplicatesConfig(
+            threshold=threshold,
+            source_priority=tuple(
+                section.get("source_priority", DuplicatesConfig.source_priority)
+            ),
+            block_mb=section.get("block_mb", 256),
+            skip_in_builds=section.get("skip_in_builds", True),
+            collapse_in_search=section.get("collapse_in_search", True),
+        )
+
+    def get_embed_server_config(self) -> "EmbedServerConfig":
+        section = self.get("embedding", {})
+        socket_path = section.get("server_socket") or None
+        if socket_path:
+            p = Path(socket_path)
+            if not p.is_absolute():
+                p = self.config_path.parent / p
+            socket_path = str(p)
+        return EmbedServerConfig(
+            socket_path=socket_path,
+            workers=section.get("concurrency", 4),
+            queue_size=section.get("server_queue_size", 64),
+        )
+
+    def get_embedding_build_config(self) -> "EmbeddingBuildConfig":
+        section = self.get("embedding", {})
+        return EmbeddingBuildConfig(
+            text_workers=section.get("text_workers", 0),
         )
 
     def get_crawler_config(self, crawler_name: str) -> "CrawlerHttpConfig":
@@ -214,6 +328,11 @@ class EmbeddingModelConfig:
     dim: int = 768
     task_type: str = "SEMANTIC_SIMILARITY"
     batch_size: int = 32
+    rpm: int = 0
+    tpm: int = 0
+    max_retries: int = 4
+    coalesce_wait_ms: float = 5.0  # embed() calls wait this long to share a batch
+    coalesce_max_batch: int = 0  # texts per coalesced batch; 0 = batch_size
     api_key: Optional[str] = None
     base_url: Optional[str] = None
 
@@ -225,14 +344,88 @@ class RewriteModelConfig:
     timeout: int = 30
     max_retries: int = 2
     workers: int = 4
+    batch_size: int = 1
+    rpm: int = 0
+    tpm: int = 0
     api_key: Optional[str] = None
     base_url: Optional[str] = None
 
 
+@dataclass
+class MockProviderConfig:
+    latency_ms: float = 0.0  # per request; median for lognormal
+    latency_per_item_ms: float = 0.0  # added per text in an embed batch
+    latency_dist: str = "fixed"
+    latency_jitter: float = 0.5  # uniform: +/- fraction; lognormal: sigma
+    rate_limit_rate: float = 0.0  # fraction of calls failing with 429
+    unavailable_rate: float = 0.0  # fraction of calls failing with 503
+    retry_after: Optional[float] = None
+    max_batch_size: int = 0  # embed batches above this are rejected; 0 = no limit
+    seed: int = 0
+
+
+_MOCK_LATENCY_DISTS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+@dataclass
+class LocalProviderConfig:
+    ngram_min: int = 3  # character n-gram lengths hashed per text
+    ngram_max: int = 5
+    buckets: int = 1 << 18  # hashed feature space
+    density: int = 8  # non-zeros per row of the random projection
+    seed: int = 0
+    idf_path: str = "data/local_idf.npz"  # written by --fit-local-idf
+
+
 @dataclass
 class SimilarConfig:
     top_k: int = 5
     min_similarity: float = 0.70
+    query_cache: bool = True
+    query_cache_size: int = 1024
+    query_cache_max_rows: int = 50000
+    query_cache_ttl_secs: int = 604800
+    backend: str = "sqlite-vec"
+    index_dir: str = "data/vec_index"
+    quantization: str = "none"
+    rerank_factor: int = 8
+    ivf_lists: int = 0  # IVF inverted lists; 0 = 4 * sqrt(rows)
+    ivf_nprobe: int = 16  # lists scanned per IVF query
+    neighbors_k: int = 50  # rows per problem in problem_neighbors
+    neighbors_block_mb: int = 256  # distance block size for --build-neighbors
+
+
+_SIMILAR_BACKENDS = ("sqlite-vec", "numpy", "ivf")
+_QUANTIZATION_MODES = ("none", "int8", "binary")
+
+
+@dataclass
+class DuplicatesConfig:
+    threshold: float = 0.95  # min similarity (1 - L2 distance) of a duplicate
+    # Canonical copy wins in this order; unlisted sources follow by name.
+    source_priority: Tuple[str, ...] = (
+        "codeforces",
+        "atcoder",
+        "leetcode",
+        "uva",
+        "spoj",
+        "luogu",
+    )
+    block_mb: int = 256  # distance block size for --find-duplicates
+    skip_in_builds: bool = True  # builds do not re-embed known duplicates
+    collapse_in_search: bool = True  # one result per canonical problem
+
+
+@dataclass
+class EmbedServerConfig:
+    socket_path: Optional[str] = None
+    workers: int = 4
+    queue_size: int = 64
+
+
+@dataclass
+class EmbeddingBuildConfig:
+    text_workers: int = 0  # HTML normalization processes; 0 = CPU count
 
 
 _VALID_PROXY_SCHEMES = {"http", "https", "socks5", "socks5h"}
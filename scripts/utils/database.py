@@ -1,8 +1,11 @@
+import hashlib
 import json
 import os
+import re
 import sqlite3
 import threading
 import time
+from contextlib import contextmanager
 from pathlib import Path
 
 from .logger import get_database_logger
@@ -10,6 +13,26 @@ from .logger import get_database_logger
 # Module-level logger
 logger = get_database_logger()
 
+# Quantized copies of vec_embeddings live in vec_quantized_<mode>.
+QUANTIZATION_MODES = ("int8", "binary")
+
+# Tables the server and search read; index versions other than the active one
+# live in "<name>__v<version>" copies (see embeddings.index_versions).
+VEC_TABLE = "vec_embeddings"
+METADATA_TABLE = "problem_embeddings"
+
+# Suffixes of the shadow tables sqlite-vec creates for a vec0 table "<name>".
+_VEC0_SHADOW_SUFFIX = re.compile(
+    r"^(info|chunks|rowids|auxiliary|vector_chunks\d+|metadatachunks\d+|metadatatext\d+)$"
+)
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _check_identifier(name: str) -> str:
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid table name: {name}")
+    return name
+
 
 class SettingsDatabaseManager:
     """
@@ -655,6 +678,13 @@ class ProblemsDatabaseManager:
         return dict(zip(keys, row))
 
 
+def _content_sha256(text):
+    """SQL ``content_sha256(text)``; same digest as ``embeddings.rewriter.content_hash``."""
+    if text is None:
+        return None
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
 class EmbeddingDatabaseManager:
     """
     管理 embeddings 相關資料表與 sqlite-vec 連線
@@ -677,31 +707,172 @@ class EmbeddingDatabaseManager:
             raise RuntimeError("sqlite-vec is required for embeddings") from exc
         sqlite_vec.load(conn)
         conn.enable_load_extension(False)
+        conn.create_function("content_sha256", 1, _content_sha256, deterministic=True)
         return conn
 
-    def _ensure_metadata_table(self) -> None:
+    def create_metadata_table(self, table: str = METADATA_TABLE) -> None:
         self.execute(
-            """
-            CREATE TABLE IF NOT EXISTS problem_embeddings (
+            f"""
+            CREATE TABLE IF NOT EXISTS {_check_identifier(table)} (
                 source TEXT NOT NULL,
                 problem_id TEXT NOT NULL,
                 rewritten_content TEXT,
                 model TEXT NOT NULL,
                 dim INTEGER NOT NULL,
                 updated_at TEXT NOT NULL,
+                content_hash TEXT,
+                PRIMARY KEY (source, problem_id)
+            )
+            """,
+            commit=True,
+        )
+        # MAX(updated_at) is the freshness check the derived indexes run
+        # before every query; keep it off a full table scan. Index names are
+        # not renamed with their table when a version is activated, so look
+        # for any index led by updated_at rather than for this name.
+        existing = self.execute(
+            """
+            SELECT 1 FROM pragma_index_list(?) AS il, pragma_index_info(il.name) AS ii
+            WHERE ii.seqno = 0 AND ii.name = 'updated_at'
+            LIMIT 1
+            """,
+            (table,),
+            fetchone=True,
+        )
+        if existing is None:
+            self.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS idx_{table}_updated_at
+                ON {table} (updated_at)
+                """,
+                commit=True,
+            )
+
+    def _ensure_metadata_table(self) -> None:
+        self.create_metadata_table()
+        columns = {
+            row[1]
+            for row in self.execute(
+                "PRAGMA table_info(problem_embeddings)", fetchall=True
+            )
+            or []
+        }
+        if "content_hash" not in columns:
+            self.execute(
+                "ALTER TABLE problem_embeddings ADD COLUMN content_hash TEXT",
+                commit=True,
+            )
+        self.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rewrite_cache (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                rewritten_content TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (content_hash, model, prompt_version)
+            )
+            """,
+            commit=True,
+        )
+        # Rewrites finished by a build but not yet embedded; rows are removed
+        # when their embedding batch commits, so a killed build can resume.
+        self.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_journal (
+                source TEXT NOT NULL,
+                problem_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                rewritten_content TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (source, problem_id)
+            )
+            """,
+            commit=True,
+        )
+        self.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vec_index_state (
+                name TEXT PRIMARY KEY,
+                watermark TEXT,
+                db_rows INTEGER NOT NULL
+            )
+            """,
+            commit=True,
+        )
+        # Top-k neighbors of every embedded problem (--build-neighbors),
+        # rank 0 = nearest; the primary key serves by-problem lookups.
+        self.execute(
+            """
+            CREATE TABLE IF NOT EXISTS problem_neighbors (
+                source TEXT NOT NULL,
+                problem_id TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                neighbor_source TEXT NOT NULL,
+                neighbor_id TEXT NOT NULL,
+                similarity REAL NOT NULL,
+                PRIMARY KEY (source, problem_id, rank)
+            ) WITHOUT ROWID
+            """,
+            commit=True,
+        )
+        self.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_problem_neighbors_neighbor
+            ON problem_neighbors (neighbor_source, neighbor_id)
+            """,
+            commit=True,
+        )
+        # Cross-source near-duplicates (--find-duplicates): each row maps a
+        # problem to its best match on a higher-priority source and to the
+        # canonical problem at the end of that chain.
+        self.execute(
+            """
+            CREATE TABLE IF NOT EXISTS problem_duplicates (
+                source TEXT NOT NULL,
+                problem_id TEXT NOT NULL,
+                match_source TEXT NOT NULL,
+                match_id TEXT NOT NULL,
+                canonical_source TEXT NOT NULL,
+                canonical_id TEXT NOT NULL,
+                similarity REAL NOT NULL,
                 PRIMARY KEY (source, problem_id)
+            ) WITHOUT ROWID
+            """,
+            commit=True,
+        )
+        self.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_problem_duplicates_canonical
+            ON problem_duplicates (canonical_source, canonical_id)
+            """,
+            commit=True,
+        )
+        # status: building (shadow being filled), active (the live tables),
+        # retired (kept for rollback until pruned).
+        self.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_index_versions (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                activated_at TEXT
             )
             """,
             commit=True,
         )
 
-    def create_vec_table(self, dim: int) -> None:
+    def create_vec_table(self, dim: int, table: str = VEC_TABLE) -> None:
         if not isinstance(dim, int) or isinstance(dim, bool) or dim <= 0:
             raise ValueError("dim must be a positive integer")
         self.execute(
             f"""
-            CREATE VIRTUAL TABLE IF NOT EXISTS vec_embeddings USING vec0(
-                source TEXT,
+            CREATE VIRTUAL TABLE IF NOT EXISTS {_check_identifier(table)} USING vec0(
+                source TEXT partition key,
                 problem_id TEXT,
                 embedding float[{dim}]
             )
@@ -709,10 +880,88 @@ class EmbeddingDatabaseManager:
             commit=True,
         )
 
-    def check_dimension_consistency(self, dim: int) -> bool:
+    def vec_table_is_partitioned(self) -> bool:
+        row = self.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'vec_embeddings'",
+            fetchone=True,
+        )
+        return bool(row and row[0] and "partition key" in row[0].lower())
+
+    def partition_vec_table(self, dim: int) -> int:
+        """
+        以 source 為 partition key 重建舊版 vec_embeddings，保留所有向量
+        """
+        if not isinstance(dim, int) or isinstance(dim, bool) or dim <= 0:
+            raise ValueError("dim must be a positive integer")
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TEMP TABLE vec_embeddings_migrate AS
+                SELECT source, problem_id, embedding FROM vec_embeddings
+                """
+            )
+            conn.execute("DROP TABLE vec_embeddings")
+            conn.execute(
+                f"""
+                CREATE VIRTUAL TABLE vec_embeddings USING vec0(
+                    source TEXT partition key,
+                    problem_id TEXT,
+                    embedding float[{dim}]
+                )
+                """
+            )
+            cursor = conn.execute(
+                """
+                INSERT INTO vec_embeddings(source, problem_id, embedding)
+                SELECT source, problem_id, embedding FROM vec_embeddings_migrate
+                """
+            )
+            conn.execute("DROP TABLE vec_embeddings_migrate")
+            return cursor.rowcount
+
+    def table_exists(self, table: str) -> bool:
+        row = self.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table,),
+            fetchone=True,
+        )
+        return row is not None
+
+    @staticmethod
+    def rename_vec_table(conn: sqlite3.Connection, old: str, new: str) -> None:
+        """
+        重新命名 vec0 表及其 shadow tables（vec0 本身不會一併改名），須在交易中呼叫
+        """
+        _check_identifier(old)
+        _check_identifier(new)
+        prefix = old + "_"
+        shadows = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+            if _VEC0_SHADOW_SUFFIX.match(row[0][len(prefix) :])
+        ]
+        conn.execute(f"ALTER TABLE {old} RENAME TO {new}")
+        for shadow in shadows:
+            conn.execute(f"ALTER TABLE {shadow} RENAME TO {new}{shadow[len(old) :]}")
+
+    def drop_quantized_tables(self) -> None:
+        """
+        刪除量化索引表，下次查詢時會依 vec_embeddings 重新建立
+        """
+        with self.transaction() as conn:
+            for mode in QUANTIZATION_MODES:
+                conn.execute(f"DROP TABLE IF EXISTS vec_quantized_{mode}")
+            conn.execute(
+                "DELETE FROM vec_index_state WHERE name LIKE 'vec_quantized_%'"
+            )
+
+    def check_dimension_consistency(self, dim: int, table: str = VEC_TABLE) -> bool:
         try:
             row = self.execute(
-                "SELECT vec_length(embedding) FROM vec_embeddings LIMIT 1",
+                f"SELECT vec_length(embedding) FROM {_check_identifier(table)} LIMIT 1",
                 fetchone=True,
             )
             if row and row[0] != dim:
@@ -746,6 +995,19 @@ class EmbeddingDatabaseManager:
                 self._conn.commit()
             return cursor.rowcount
 
+    @contextmanager
+    def transaction(self):
+        """Hold the lock and yield the connection; commit on exit, roll back on error."""
+        with self._lock:
+            if not self._conn.in_transaction:
+                self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
     def __enter__(self):
         return self
 
@@ -16,6 +16,10 @@ use crate::models::{
 };
 use crate::AppState;
 
+/// How long an embedding build gets to save in-flight batches after SIGTERM
+/// before its process group is killed.
+const EMBEDDING_STOP_GRACE: std::time::Duration = std::time::Duration::from_secs(15);
+
 // Problem CRUD
 
 #[derive(Deserialize)]
@@ -770,6 +774,14 @@ pub async fn trigger_embedding(
         let mut lock = state_clone.embedding_lock.lock().await;
         // Clear pid under job lock to close the cancel race window
         *state_clone.active_embedding_pid.lock().await = None;
+        // Once the child has been reaped, a SIGKILL still pending from a
+        // cancel must not reach a reused process group. On timeout the child
+        // is still alive and the pending kill has to go ahead.
+        if timed.is_ok() {
+            if let Some(pending) = state_clone.pending_embedding_kill.lock().await.take() {
+                pending.cancel();
+            }
+        }
 
         if let Some(ref mut job) = *lock {
             // Only update if not already set to Cancelled
@@ -818,8 +830,11 @@ pub async fn trigger_embedding(
                     }
                     Err(_) => {
                         tracing::warn!("embedding job {} timed out", job_id_clone);
-                        crate::utils::kill_pgid(pid);
+                        let pending = crate::utils::terminate_pgid(pid, EMBEDDING_STOP_GRACE);
                         let _ = wait_task.await;
+                        if let Some(pending) = pending {
+                            pending.cancel();
+                        }
                         job.status = CrawlerStatus::TimedOut;
                     }
                 }
@@ -870,7 +885,9 @@ pub async fn cancel_embedding(State(state): State<Arc<AppState>>) -> impl IntoRe
         if job.status == CrawlerStatus::Running {
             let mut pid_lock = state.active_embedding_pid.lock().await;
             if let Some(pid) = pid_lock.take() {
-                crate::utils::kill_pgid(pid);
+                // Cancelled by the job task once it has reaped the child.
+                *state.pending_embedding_kill.lock().await =
+                    crate::utils::terminate_pgid(pid, EMBEDDING_STOP_GRACE);
             }
             job.status = CrawlerStatus::Cancelled;
             job.finished_at = Some(chrono::Utc::now().to_rfc3339());
@@ -1,3 +1,4 @@
+use std::collections::{HashMap, HashSet};
 use std::sync::Arc;
 
 use axum::extract::{Path, Query, State};
@@ -6,6 +7,7 @@ use axum::Json;
 use serde::{Deserialize, Serialize};
 
 use crate::api::error::ProblemDetail;
+use crate::db::DbPool;
 use crate::AppState;
 
 #[derive(Deserialize)]
@@ -42,8 +44,59 @@ struct SimilarResult {
 
 #[derive(Deserialize)]
 struct EmbedTextOutput {
+    #[serde(default)]
     embedding: Vec<f32>,
     rewritten: Option<String>,
+    #[serde(default)]
+    error: Option<String>,
+    /// Set by the resident server for retryable errors (queue full, provider
+    /// rate limits or timeouts); anything else is a permanent failure.
+    #[serde(default)]
+    transient: bool,
+}
+
+/// Keeps the first result of each group of cross-source duplicates, so a
+/// problem mirrored on several judges is listed once (at its best rank).
+struct DuplicateFilter {
+    enabled: bool,
+    canonical: HashMap<(String, String), (String, String)>,
+    seen: HashSet<(String, String)>,
+}
+
+impl DuplicateFilter {
+    /// Load the canonical problems of every candidate with one query.
+    fn load<'k>(
+        pool: &DbPool,
+        enabled: bool,
+        candidates: impl IntoIterator<Item = (&'k str, &'k str)>,
+    ) -> Self {
+        let canonical = if enabled {
+            let keys: Vec<(&str, &str)> = candidates.into_iter().collect();
+            crate::db::embeddings::get_canonicals(pool, &keys)
+        } else {
+            HashMap::new()
+        };
+        Self {
+            enabled,
+            canonical,
+            seen: HashSet::new(),
+        }
+    }
+
+    /// Drop every member of the group whose canonical problem is `group`.
+    fn exclude(&mut self, group: (String, String)) {
+        self.seen.insert(group);
+    }
+
+    /// Mark the group of `source`/`id` as seen; false if it already was.
+    fn first(&mut self, source: &str, id: &str) -> bool {
+        if !self.enabled {
+            return true;
+        }
+        let key = (source.to_string(), id.to_string());
+        let group = self.canonical.get(&key).cloned().unwrap_or(key);
+        self.seen.insert(group)
+    }
 }
 
 pub async fn similar_by_problem(
@@ -60,13 +113,73 @@ pub async fn similar_by_problem(
 
     let pool = state.ro_pool.clone();
     let over_fetch = state.config.embedding.over_fetch_factor;
+    let collapse = state.config.duplicates.collapse_in_search;
 
     let source_clone = source.clone();
     let id_clone = id.clone();
 
     let result = tokio::task::spawn_blocking(move || {
-        let embedding = match crate::db::embeddings::get_embedding(&pool, &source_clone, &id_clone)
+        let matches_source = |s: &String| {
+            source_filter
+                .as_ref()
+                .is_none_or(|filters| filters.iter().any(|f| f == s))
+        };
+        // Mirrors of the requested problem are the same problem, not similar.
+        let canonical = crate::db::embeddings::get_canonical(&pool, &source_clone, &id_clone);
+        let query_group = canonical
+            .clone()
+            .unwrap_or_else(|| (source_clone.clone(), id_clone.clone()));
+
+        // Precomputed lists answer the request with one indexed read. They are
+        // exact unless filtering left fewer than `limit` rows while the list
+        // was still above the threshold (it may have been cut off at k).
+        if let Some(neighbors) =
+            crate::db::embeddings::get_neighbors(&pool, &source_clone, &id_clone)
         {
+            let exhausted = neighbors.last().is_some_and(|n| n.similarity < threshold);
+            let candidates: Vec<_> = neighbors
+                .into_iter()
+                .filter(|n| n.similarity >= threshold && matches_source(&n.source))
+                .collect();
+            let mut duplicates = DuplicateFilter::load(
+                &pool,
+                collapse,
+                candidates
+                    .iter()
+                    .map(|n| (n.source.as_str(), n.id.as_str())),
+            );
+            duplicates.exclude(query_group.clone());
+            let results: Vec<SimilarResult> = candidates
+                .into_iter()
+                .filter(|n| duplicates.first(&n.source, &n.id))
+                .take(limit as usize)
+                .map(|n| SimilarResult {
+                    source: n.source,
+                    id: n.id,
+                    title: n.title,
+                    difficulty: n.difficulty,
+                    link: n.link,
+                    similarity: n.similarity,
+                })
+                .collect();
+            if exhausted || results.len() == limit as usize {
+                let rewritten_query =
+                    crate::db::embeddings::get_rewritten_content(&pool, &source, &id);
+                return Ok(SimilarResponse {
+                    rewritten_query,
+                    results,
+                });
+            }
+        }
+
+        // Builds skip known duplicates, so those are searched through the
+        // vector of their canonical problem.
+        let embedding = match crate::db::embeddings::get_embedding(&pool, &source_clone, &id_clone)
+            .or_else(|| {
+                canonical
+                    .as_ref()
+                    .and_then(|(s, pid)| crate::db::embeddings::get_embedding(&pool, s, pid))
+            }) {
             Some(e) => e,
             None => {
                 return Err(ProblemDetail::not_found(
@@ -75,12 +188,17 @@ pub async fn similar_by_problem(
             }
         };
 
-        let rewritten_query = crate::db::embeddings::get_rewritten_content(&pool, &source, &id);
+        let rewritten_query = crate::db::embeddings::get_rewritten_content(&pool, &source, &id)
+            .or_else(|| {
+                canonical.as_ref().and_then(|(s, pid)| {
+                    crate::db::embeddings::get_rewritten_content(&pool, s, pid)
+                })
+            });
 
         let k = (limit * over_fetch).min(200);
         let knn_results = crate::db::embeddings::knn_search(&pool, &embedding, k);
 
-        let mut results: Vec<SimilarResult> = knn_results
+        let candidates: Vec<(String, String, f32)> = knn_results
             .into_iter()
             .filter(|(s, pid, _)| !(s == &source && pid == &id))
             .map(|(s, pid, distance)| {
@@ -88,11 +206,20 @@ pub async fn similar_by_problem(
                 (s, pid, similarity)
             })
             .filter(|(_, _, sim)| *sim >= threshold)
-            .filter(|(s, _, _)| {
-                source_filter
-                    .as_ref()
-                    .is_none_or(|filters| filters.iter().any(|f| f == s))
-            })
+            .filter(|(s, _, _)| matches_source(s))
+            .collect();
+        let mut duplicates = DuplicateFilter::load(
+            &pool,
+            collapse,
+            candidates
+                .iter()
+                .map(|(s, pid, _)| (s.as_str(), pid.as_str())),
+        );
+        duplicates.exclude(query_group);
+
+        let mut results: Vec<SimilarResult> = candidates
+            .into_iter()
+            .filter(|(s, pid, _)| duplicates.first(s, pid))
             .take(limit as usize)
             .map(|(s, pid, similarity)| {
                 let problem = crate::db::problems::get_problem(&pool, &s, &pid);
@@ -166,73 +293,50 @@ pub async fn similar_by_text(
 
     let embed_timeout = state.config.embedding.timeout_secs;
 
-    // Acquire semaphore permit
-    let _permit = match state.embed_semaphore.acquire().await {
-        Ok(p) => p,
-        Err(_) => {
-            return ProblemDetail::internal("semaphore closed").into_response();
-        }
+    let embed_output = match state.config.embedding.server_socket.as_deref() {
+        Some(socket) => match tokio::time::timeout(
+            std::time::Duration::from_secs(embed_timeout),
+            embed_via_server(socket, &text),
+        )
+        .await
+        {
+            Ok(Ok(o)) if o.error.is_some() && o.transient => {
+                tracing::warn!(
+                    "embedding server transient error, falling back to subprocess: {}",
+                    o.error.as_deref().unwrap_or_default()
+                );
+                embed_via_subprocess(&state, &text, embed_timeout).await
+            }
+            Ok(Ok(o)) => Ok(o),
+            Ok(Err(e)) => {
+                tracing::warn!(
+                    "embedding server unavailable, falling back to subprocess: {}",
+                    e
+                );
+                embed_via_subprocess(&state, &text, embed_timeout).await
+            }
+            Err(_) => {
+                tracing::warn!("embedding server query timed out");
+                Err(ProblemDetail::gateway_timeout(
+                    "embedding service timed out",
+                ))
+            }
+        },
+        None => embed_via_subprocess(&state, &text, embed_timeout).await,
     };
 
-    // Spawn Python subprocess
-    let mut cmd = tokio::process::Command::new("uv");
-    cmd.args(["run", "python3", "embedding_cli.py", "--embed-text", &text]);
-    cmd.current_dir("scripts/");
-    cmd.stdout(std::process::Stdio::piped());
-    cmd.stderr(std::process::Stdio::piped());
-    cmd.kill_on_drop(true);
-
-    if let Some(ref cp) = state.config_path {
-        cmd.env("CONFIG_PATH", cp);
-    }
-
-    let child = match crate::utils::spawn_with_pgid(cmd) {
-        Ok(c) => c,
-        Err(e) => {
-            tracing::error!("failed to spawn embedding subprocess: {}", e);
-            return ProblemDetail::bad_gateway("embedding service unavailable").into_response();
-        }
+    let embed_output = match embed_output {
+        Ok(o) => o,
+        Err(e) => return e.into_response(),
     };
 
-    let pid = child.id().expect("child should have a pid");
-    let mut wait_task = tokio::spawn(async move { child.wait_with_output().await });
-
-    let output = match tokio::time::timeout(
-        std::time::Duration::from_secs(embed_timeout),
-        &mut wait_task,
-    )
-    .await
-    {
-        Ok(Ok(Ok(o))) => o,
-        Ok(Ok(Err(e))) => {
-            tracing::error!("embedding subprocess error: {}", e);
-            return ProblemDetail::bad_gateway("embedding service error").into_response();
-        }
-        Ok(Err(e)) => {
-            tracing::error!("embedding subprocess join error: {}", e);
-            return ProblemDetail::bad_gateway("embedding service error").into_response();
-        }
-        Err(_) => {
-            tracing::warn!("embedding query timed out");
-            crate::utils::kill_pgid(pid);
-            let _ = wait_task.await;
-            return ProblemDetail::gateway_timeout("embedding service timed out").into_response();
-        }
-    };
-
-    if !output.status.success() {
-        let stderr = String::from_utf8_lossy(&output.stderr);
-        tracing::warn!("embedding subprocess stderr: {}", stderr);
+    if let Some(ref err) = embed_output.error {
+        tracing::warn!("embedding server error: {}", err);
         return ProblemDetail::bad_gateway("embedding service failed").into_response();
     }
-
-    let stdout = String::from_utf8_lossy(&output.stdout);
-    let embed_output: EmbedTextOutput = match serde_json::from_str(&stdout) {
-        Ok(v) => v,
-        Err(_) => {
-            return ProblemDetail::bad_gateway("invalid embedding response").into_response();
-        }
-    };
+    if embed_output.embedding.is_empty() {
+        return ProblemDetail::bad_gateway("invalid embedding response").into_response();
+    }
 
     let rewritten_query = embed_output
         .rewritten
@@ -245,12 +349,13 @@ pub async fn similar_by_text(
 
     let pool = state.ro_pool.clone();
     let over_fetch = state.config.embedding.over_fetch_factor;
+    let collapse = state.config.duplicates.collapse_in_search;
 
     let result = tokio::task::spawn_blocking(move || {
         let k = (limit * over_fetch).min(200);
         let knn_results = crate::db::embeddings::knn_search(&pool, &embedding, k);
 
-        let mut results: Vec<SimilarResult> = knn_results
+        let candidates: Vec<(String, String, f32)> = knn_results
             .into_iter()
             .map(|(s, pid, distance)| {
                 let similarity = 1.0 - distance;
@@ -262,6 +367,18 @@ pub async fn similar_by_text(
                     .as_ref()
                     .is_none_or(|filters| filters.iter().any(|f| f == s))
             })
+            .collect();
+        let mut duplicates = DuplicateFilter::load(
+            &pool,
+            collapse,
+            candidates
+                .iter()
+                .map(|(s, pid, _)| (s.as_str(), pid.as_str())),
+        );
+
+        let mut results: Vec<SimilarResult> = candidates
+            .into_iter()
+            .filter(|(s, pid, _)| duplicates.first(s, pid))
             .take(limit as usize)
             .map(|(s, pid, similarity)| {
                 let problem = crate::db::problems::get_problem(&pool, &s, &pid);
@@ -292,3 +409,105 @@ pub async fn similar_by_text(
     })
     .into_response()
 }
+
+/// Embed `text` by spawning a one-shot `embedding_cli.py --embed-text` process.
+async fn embed_via_subprocess(
+    state: &AppState,
+    text: &str,
+    timeout_secs: u64,
+) -> Result<EmbedTextOutput, ProblemDetail> {
+    // Acquire semaphore permit
+    let _permit = match state.embed_semaphore.acquire().await {
+        Ok(p) => p,
+        Err(_) => {
+            return Err(ProblemDetail::internal("semaphore closed"));
+        }
+    };
+
+    // Spawn Python subprocess
+    let mut cmd = tokio::process::Command::new("uv");
+    cmd.args(["run", "python3", "embedding_cli.py", "--embed-text", text]);
+    cmd.current_dir("scripts/");
+    cmd.stdout(std::process::Stdio::piped());
+    cmd.stderr(std::process::Stdio::piped());
+    cmd.kill_on_drop(true);
+
+    if let Some(ref cp) = state.config_path {
+        cmd.env("CONFIG_PATH", cp);
+    }
+
+    let child = match crate::utils::spawn_with_pgid(cmd) {
+        Ok(c) => c,
+        Err(e) => {
+            tracing::error!("failed to spawn embedding subprocess: {}", e);
+            return Err(ProblemDetail::bad_gateway("embedding service unavailable"));
+        }
+    };
+
+    let pid = child.id().expect("child should have a pid");
+    let mut wait_task = tokio::spawn(async move { child.wait_with_output().await });
+
+    let output =
+        match tokio::time::timeout(std::time::Duration::from_secs(timeout_secs), &mut wait_task)
+            .await
+        {
+            Ok(Ok(Ok(o))) => o,
+            Ok(Ok(Err(e))) => {
+                tracing::error!("embedding subprocess error: {}", e);
+                return Err(ProblemDetail::bad_gateway("embedding service error"));
+            }
+            Ok(Err(e)) => {
+                tracing::error!("embedding subprocess join error: {}", e);
+                return Err(ProblemDetail::bad_gateway("embedding service error"));
+            }
+            Err(_) => {
+                tracing::warn!("embedding query timed out");
+                crate::utils::kill_pgid(pid);
+                let _ = wait_task.await;
+                return Err(ProblemDetail::gateway_timeout(
+                    "embedding service timed out",
+                ));
+            }
+        };
+
+    if !output.status.success() {
+        let stderr = String::from_utf8_lossy(&output.stderr);
+        tracing::warn!("embedding subprocess stderr: {}", stderr);
+        return Err(ProblemDetail::bad_gateway("embedding service failed"));
+    }
+
+    let stdout = String::from_utf8_lossy(&output.stdout);
+    serde_json::from_str(&stdout)
+        .map_err(|_| ProblemDetail::bad_gateway("invalid embedding response"))
+}
+
+/// Embed `text` through the resident `embedding_cli.py --serve` Unix socket.
+#[cfg(unix)]
+async fn embed_via_server(socket: &str, text: &str) -> std::io::Result<EmbedTextOutput> {
+    use tokio::io::{AsyncBufReadExt, AsyncWriteExt, BufReader};
+
+    let stream = tokio::net::UnixStream::connect(socket).await?;
+    let (read_half, mut write_half) = stream.into_split();
+
+    let mut request = serde_json::json!({ "id": 0, "text": text }).to_string();
+    request.push('\n');
+    write_half.write_all(request.as_bytes()).await?;
+
+    let mut line = String::new();
+    BufReader::new(read_half).read_line(&mut line).await?;
+    if line.is_empty() {
+        return Err(std::io::Error::new(
+            std::io::ErrorKind::UnexpectedEof,
+            "embedding server closed connection",
+        ));
+    }
+    serde_json::from_str(&line).map_err(|e| std::io::Error::new(std::io::ErrorKind::InvalidData, e))
+}
+
+#[cfg(not(unix))]
+async fn embed_via_server(_socket: &str, _text: &str) -> std::io::Result<EmbedTextOutput> {
+    Err(std::io::Error::new(
+        std::io::ErrorKind::Unsupported,
+        "unix sockets are not supported on this platform",
+    ))
+}
@@ -64,6 +64,7 @@ pub struct EmbeddingConfig {
     pub batch_timeout_secs: u64,
     pub over_fetch_factor: u32,
     pub concurrency: u32,
+    pub server_socket: Option<String>,
 }
 
 impl Default for EmbeddingConfig {
@@ -73,6 +74,21 @@ impl Default for EmbeddingConfig {
             batch_timeout_secs: 600,
             over_fetch_factor: 4,
             concurrency: 4,
+            server_socket: None,
+        }
+    }
+}
+
+#[derive(Debug, Clone, Deserialize)]
+#[serde(default)]
+pub struct DuplicatesConfig {
+    pub collapse_in_search: bool,
+}
+
+impl Default for DuplicatesConfig {
+    fn default() -> Self {
+        Self {
+            collapse_in_search: true,
         }
     }
 }
@@ -98,6 +114,7 @@ pub struct Config {
     pub database: DatabaseConfig,
     pub crawler: CrawlerConfig,
     pub embedding: EmbeddingConfig,
+    pub duplicates: DuplicatesConfig,
     pub logging: LoggingConfig,
     #[serde(skip)]
     pub config_path: PathBuf,
@@ -110,6 +127,7 @@ impl Default for Config {
             database: DatabaseConfig::default(),
             crawler: CrawlerConfig::default(),
             embedding: EmbeddingConfig::default(),
+            duplicates: DuplicatesConfig::default(),
             logging: LoggingConfig::default(),
             config_path: PathBuf::from("config.toml"),
         }
@@ -148,6 +166,21 @@ impl Config {
             config.database.path = config_dir.join(db_path).to_string_lossy().into_owned();
         }
 
+        // Resolve embedding.server_socket the same way; treat empty as unset
+        config.embedding.server_socket = config
+            .embedding
+            .server_socket
+            .take()
+            .filter(|s| !s.trim().is_empty())
+            .map(|s| {
+                let p = Path::new(&s);
+                if p.is_relative() {
+                    config_dir.join(p).to_string_lossy().into_owned()
+                } else {
+                    s
+                }
+            });
+
         config.config_path = std::fs::canonicalize(&path).unwrap_or(path);
 
         config.validate();
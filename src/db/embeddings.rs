@@ -1,3 +1,5 @@
+use std::collections::HashMap;
+
 use rusqlite::params;
 use zerocopy::AsBytes;
 
@@ -127,3 +129,114 @@ pub fn knn_search(pool: &DbPool, embedding: &[f32], k: u32) -> Vec<(String, Stri
 
     rows.filter_map(|r| r.ok()).collect()
 }
+
+/// A precomputed neighbor with the problem fields the similar endpoints return.
+pub struct Neighbor {
+    pub source: String,
+    pub id: String,
+    pub similarity: f32,
+    pub title: Option<String>,
+    pub difficulty: Option<String>,
+    pub link: Option<String>,
+}
+
+/// Read the materialized top-k list of a problem from `problem_neighbors`
+/// (written by `embedding_cli.py --build-neighbors`), nearest first.
+///
+/// Returns `None` when the table is missing or has no list for the problem,
+/// so callers can fall back to a KNN query.
+pub fn get_neighbors(pool: &DbPool, source: &str, id: &str) -> Option<Vec<Neighbor>> {
+    let conn = pool.get().ok()?;
+    let mut stmt = conn
+        .prepare(
+            "SELECT n.neighbor_source, n.neighbor_id, n.similarity,
+                    p.title, p.difficulty, p.link
+             FROM problem_neighbors n
+             JOIN problems p ON p.source = n.neighbor_source AND p.id = n.neighbor_id
+             WHERE n.source = ?1 AND n.problem_id = ?2
+               AND EXISTS (
+                   SELECT 1 FROM problem_embeddings pe
+                   WHERE pe.source = ?1 AND pe.problem_id = ?2
+               )
+             ORDER BY n.rank",
+        )
+        .ok()?;
+    let rows = stmt
+        .query_map(params![source, id], |row| {
+            Ok(Neighbor {
+                source: row.get(0)?,
+                id: row.get(1)?,
+                similarity: row.get(2)?,
+                title: row.get(3)?,
+                difficulty: row.get(4)?,
+                link: row.get(5)?,
+            })
+        })
+        .ok()?;
+    let neighbors: Vec<Neighbor> = rows.filter_map(|r| r.ok()).collect();
+    if neighbors.is_empty() {
+        None
+    } else {
+        Some(neighbors)
+    }
+}
+
+/// Canonical problem of a cross-source duplicate from `problem_duplicates`
+/// (written by `embedding_cli.py --find-duplicates`).
+///
+/// Returns `None` when the table is missing or the problem is not a known
+/// duplicate, in which case the problem is its own canonical.
+pub fn get_canonical(pool: &DbPool, source: &str, id: &str) -> Option<(String, String)> {
+    let conn = pool.get().ok()?;
+    conn.query_row(
+        "SELECT canonical_source, canonical_id FROM problem_duplicates
+         WHERE source = ?1 AND problem_id = ?2",
+        params![source, id],
+        |row| Ok((row.get(0)?, row.get(1)?)),
+    )
+    .ok()
+}
+
+/// Keys per `problem_duplicates` lookup, two bound parameters each.
+const CANONICAL_CHUNK: usize = 400;
+
+/// Batch form of [`get_canonical`] for a page of results, one query per
+/// [`CANONICAL_CHUNK`] keys. Problems that are not known duplicates (or all
+/// of them, when the table is missing) are absent from the map.
+pub fn get_canonicals(
+    pool: &DbPool,
+    keys: &[(&str, &str)],
+) -> HashMap<(String, String), (String, String)> {
+    let mut found = HashMap::new();
+    if keys.is_empty() {
+        return found;
+    }
+    let conn = match pool.get() {
+        Ok(c) => c,
+        Err(_) => return found,
+    };
+    for chunk in keys.chunks(CANONICAL_CHUNK) {
+        let placeholders = vec!["(?, ?)"; chunk.len()].join(", ");
+        let sql = format!(
+            "SELECT source, problem_id, canonical_source, canonical_id
+             FROM problem_duplicates
+             WHERE (source, problem_id) IN (VALUES {placeholders})"
+        );
+        let mut stmt = match conn.prepare(&sql) {
+            Ok(s) => s,
+            Err(_) => return found,
+        };
+        let params = chunk.iter().flat_map(|(source, id)| [*source, *id]);
+        let rows = match stmt.query_map(rusqlite::params_from_iter(params), |row| {
+            Ok((
+                (row.get::<_, String>(0)?, row.get::<_, String>(1)?),
+                (row.get::<_, String>(2)?, row.get::<_, String>(3)?),
+            ))
+        }) {
+            Ok(r) => r,
+            Err(_) => return found,
+        };
+        found.extend(rows.filter_map(|r| r.ok()));
+    }
+    found
+}
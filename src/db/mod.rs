@@ -128,10 +128,11 @@ pub fn ensure_data_tables(pool: &DbPool) {
             model TEXT NOT NULL,
             dim INTEGER NOT NULL,
             updated_at TEXT NOT NULL,
+            content_hash TEXT,
             PRIMARY KEY (source, problem_id)
         );
         CREATE VIRTUAL TABLE IF NOT EXISTS vec_embeddings USING vec0(
-            source TEXT,
+            source TEXT partition key,
             problem_id TEXT,
             embedding float[768]
         );
@@ -29,6 +29,8 @@ pub struct AppState {
     pub embedding_history: tokio::sync::Mutex<VecDeque<models::EmbeddingJob>>,
     pub active_crawler_pid: tokio::sync::Mutex<Option<u32>>,
     pub active_embedding_pid: tokio::sync::Mutex<Option<u32>>,
+    /// SIGKILL scheduled by a cancel request, dropped once the job is reaped.
+    pub pending_embedding_kill: tokio::sync::Mutex<Option<utils::PendingKill>>,
     pub daily_fallback: tokio::sync::Mutex<HashMap<String, models::DailyFallbackEntry>>,
     pub embed_semaphore: Semaphore,
     pub token_auth_enabled: Arc<AtomicBool>,
@@ -98,6 +100,7 @@ async fn main() {
         embedding_history: tokio::sync::Mutex::new(VecDeque::new()),
         active_crawler_pid: tokio::sync::Mutex::new(None),
         active_embedding_pid: tokio::sync::Mutex::new(None),
+        pending_embedding_kill: tokio::sync::Mutex::new(None),
         daily_fallback: tokio::sync::Mutex::new(HashMap::new()),
         embed_semaphore: Semaphore::new(config.embedding.concurrency as usize),
         token_auth_enabled: token_auth_flag.clone(),
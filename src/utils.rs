@@ -50,6 +50,54 @@ pub fn kill_pgid(_pid: u32) -> bool {
     false
 }
 
+/// SIGKILL scheduled by [`terminate_pgid`].
+///
+/// Cancel it once the process has been reaped: its process group ID may be
+/// reused by then, and the delayed SIGKILL would hit an unrelated group.
+pub struct PendingKill(tokio::task::AbortHandle);
+
+impl PendingKill {
+    pub fn cancel(self) {
+        self.0.abort();
+    }
+}
+
+/// Asks a process group to exit with SIGTERM and SIGKILLs it if it is still
+/// around after `grace`, so jobs that handle SIGTERM can save their work.
+///
+/// Returns the pending SIGKILL if SIGTERM was sent; the caller must cancel
+/// it after reaping the process.
+#[cfg(unix)]
+pub fn terminate_pgid(pid: u32, grace: std::time::Duration) -> Option<PendingKill> {
+    if pid <= 1 {
+        tracing::warn!("refusing to terminate pgid {pid}: unsafe target");
+        return None;
+    }
+    let ret = unsafe { libc::kill(-(pid as i32), libc::SIGTERM) };
+    if ret == -1 {
+        let err = std::io::Error::last_os_error();
+        if err.raw_os_error() == Some(libc::ESRCH) {
+            tracing::debug!("pgid {pid} already exited");
+        } else {
+            tracing::warn!("terminate_pgid({pid}) failed: {err}, sending SIGKILL");
+            kill_pgid(pid);
+        }
+        return None;
+    }
+    let task = tokio::spawn(async move {
+        tokio::time::sleep(grace).await;
+        if kill_pgid(pid) {
+            tracing::warn!("pgid {pid} still running {grace:?} after SIGTERM, killed");
+        }
+    });
+    Some(PendingKill(task.abort_handle()))
+}
+
+#[cfg(not(unix))]
+pub fn terminate_pgid(_pid: u32, _grace: std::time::Duration) -> Option<PendingKill> {
+    None
+}
+
 pub fn natural_sort_key(s: &str) -> String {
     let mut out = String::with_capacity(s.len() + 16);
     let mut buf = String::new();
@@ -96,6 +144,28 @@ fn flush_segment(out: &mut String, buf: &str, is_digit: bool) {
 mod tests {
     use super::natural_sort_key;
 
+    #[cfg(unix)]
+    #[test]
+    fn terminate_pgid_refuses_unsafe_targets() {
+        let grace = std::time::Duration::from_secs(1);
+        assert!(super::terminate_pgid(0, grace).is_none());
+        assert!(super::terminate_pgid(1, grace).is_none());
+    }
+
+    #[cfg(unix)]
+    #[tokio::test]
+    async fn terminate_pgid_stops_child_and_cancels_kill() {
+        let mut cmd = tokio::process::Command::new("sleep");
+        cmd.arg("30");
+        let mut child = super::spawn_with_pgid(cmd).expect("spawn sleep");
+        let pid = child.id().expect("child should have a pid");
+        let pending = super::terminate_pgid(pid, std::time::Duration::from_secs(30))
+            .expect("SIGTERM should be sent");
+        let status = child.wait().await.expect("wait for sleep");
+        assert!(!status.success());
+        pending.cancel();
+    }
+
     #[test]
     fn numeric_ordering() {
         assert!(natural_sort_key("P2000") < natural_sort_key("P10000"));